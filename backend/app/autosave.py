@@ -0,0 +1,284 @@
+# Write-behind buffer for document autosaves
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from app.content_store import discard_chunks, load_content, prune_chunks, store_content
+from app.database import documents_collection, summarize_content
+from app.metrics import metrics
+from app.revisions import record_revision
+
+AUTOSAVE_CONFIG = {
+    "enabled": os.getenv("AUTOSAVE_ENABLED", "true").lower() == "true",
+    # How often buffered documents are checked for flushing
+    "flush_interval_s": float(os.getenv("AUTOSAVE_FLUSH_INTERVAL", "1")),
+    # Flush once a document has had no saves for this long...
+    "idle_s": float(os.getenv("AUTOSAVE_IDLE_SECONDS", "2")),
+    # ...or has been dirty for this long, even while typing continues
+    "max_delay_s": float(os.getenv("AUTOSAVE_MAX_DELAY", "10")),
+    # Buffered documents beyond this are flushed early
+    "max_documents": int(os.getenv("AUTOSAVE_MAX_DOCUMENTS", "5000"))
+}
+
+# Fields a buffered save may change; everything else is left to the database
+BUFFERED_FIELDS = ("content", "title", "updated_at", "version")
+# Fields changed by other write paths (e.g. image uploads) while a document
+# is buffered; not held in the buffer, so its copy cannot go stale
+UNBUFFERED_FIELDS = ("images",)
+
+saves_total = metrics.counter(
+    "autosave_saves_total",
+    "Document saves acknowledged by the write-behind buffer"
+)
+flushes_total = metrics.counter(
+    "autosave_flushes_total",
+    "Buffered documents written to the database",
+    ["reason"]
+)
+flush_errors_total = metrics.counter(
+    "autosave_flush_errors_total",
+    "Failed writes of buffered documents (retried on the next tick)"
+)
+flush_conflicts_total = metrics.counter(
+    "autosave_flush_conflicts_total",
+    "Flushes that found a newer version stored by another worker, by outcome "
+    "(rebased: written above it; retrying: kept buffered; deleted: document gone)",
+    ["result"]
+)
+
+# Attempts at writing above a version stored by another worker before the
+# flush is left to the next tick
+CONFLICT_RETRIES = 3
+buffered_documents = metrics.gauge(
+    "autosave_buffered_documents",
+    "Documents with saves not yet written to the database"
+)
+
+class _Pending:
+    __slots__ = ("document", "dirty_since", "last_save", "flushing")
+
+    def __init__(self, document: Dict[str, Any]):
+        self.document = document
+        self.dirty_since = time.monotonic()
+        self.last_save = self.dirty_since
+        self.flushing = False
+
+class AutosaveBuffer:
+    """
+    Absorbs rapid successive saves of a document in memory. Each save is
+    acknowledged at once with a new version number, and only the latest state
+    is written back: when the document goes idle, when it has been dirty for
+    `max_delay_s`, or at shutdown. Reads should go through get() so they see
+    buffered content.
+
+    The buffer is per process. With several workers, a save must reach the
+    worker that buffered earlier saves, or the database write is guarded by
+    version so an older state never overwrites a newer one.
+    """
+    def __init__(self,
+                 collection: Any,
+                 flush_interval_s: float = 1.0,
+                 idle_s: float = 2.0,
+                 max_delay_s: float = 10.0,
+                 max_documents: int = 5000):
+        self.collection = collection
+        self.flush_interval_s = flush_interval_s
+        self.idle_s = idle_s
+        self.max_delay_s = max_delay_s
+        self.max_documents = max_documents
+        self._pending: Dict[str, _Pending] = {}
+        self._task: Optional[asyncio.Task] = None
+        buffered_documents.set_function(lambda: {(): len(self._pending)})
+
+    async def save(self, document_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Buffer new field values for a document and return its resulting state,
+        or None if the document does not exist. Only the first save of a burst
+        reads from the database.
+        """
+        return await self.apply(document_id, lambda document: fields)
+
+    async def apply(self,
+                    document_id: str,
+                    update: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Like save(), with the new field values computed by update() from the
+        current state. update() runs without yielding to the event loop, so it
+        is atomic with respect to other saves; it may raise to reject the save.
+        """
+        entry = self._pending.get(document_id)
+        loaded = False
+        if entry is None:
+            document = await load_content(await self.collection.find_one({"_id": document_id}))
+            if document is None:
+                return None
+            document.setdefault("version", 0)
+            for field in UNBUFFERED_FIELDS:
+                document.pop(field, None)
+            # Another save may have buffered this document while we waited
+            entry = self._pending.get(document_id)
+            if entry is None:
+                entry = self._pending[document_id] = _Pending(document)
+                loaded = True
+
+        try:
+            fields = update(dict(entry.document))
+        except Exception:
+            if loaded:
+                # Nothing was buffered; do not hold a clean copy
+                del self._pending[document_id]
+            raise
+        if loaded and len(self._pending) > self.max_documents:
+            self._flush_oldest()
+        entry.document.update(fields)
+        entry.document["updated_at"] = fields.get("updated_at", datetime.utcnow())
+        entry.document["version"] += 1
+        entry.last_save = time.monotonic()
+        saves_total.inc()
+        return dict(entry.document)
+
+    def get(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """The buffered state of a document, if it has unflushed saves"""
+        entry = self._pending.get(document_id)
+        return dict(entry.document) if entry is not None else None
+
+    def buffered_for_user(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        return {
+            document_id: dict(entry.document)
+            for document_id, entry in self._pending.items()
+            if entry.document.get("user_id") == user_id
+        }
+
+    def discard(self, document_id: str) -> None:
+        """Drop buffered saves, e.g. when the document is deleted"""
+        self._pending.pop(document_id, None)
+
+    async def flush(self, document_id: str, reason: str = "manual") -> None:
+        entry = self._pending.get(document_id)
+        if entry is None or entry.flushing:
+            return
+        entry.flushing = True
+        snapshot = {field: entry.document[field] for field in BUFFERED_FIELDS if field in entry.document}
+        if "content" in snapshot:
+            # Computed once per flush rather than on every buffered save
+            snapshot.update(summarize_content(snapshot["content"]))
+        version = snapshot["version"]
+        try:
+            stored = dict(snapshot)
+            inserted = {}
+            if "content" in snapshot:
+                # Chunks of the content the document was loaded with
+                previous = entry.document.get("content_chunks", [])
+                stored.update(await store_content(document_id, snapshot["content"], previous, inserted))
+            # Never let an older state overwrite a newer one (e.g. from another worker)
+            result = await self.collection.update_one(
+                {"_id": document_id, "$or": [{"version": {"$lt": version}}, {"version": {"$exists": False}}]},
+                {"$set": stored}
+            )
+            written = version if result.matched_count else await self._rebase(document_id, stored)
+            if written is None:
+                # Superseded or deleted: nothing points at the chunks just written
+                await discard_chunks(inserted)
+            if written is not None and "content" in snapshot:
+                await prune_chunks(document_id, stored, previous)
+                entry.document["content_chunks"] = stored["content_chunks"]
+                # History has one revision per flush, not per keystroke-level save
+                await record_revision(document_id, written, snapshot["content"], snapshot["updated_at"])
+        except Exception as e:
+            flush_errors_total.inc()
+            print(f"Warning: Could not flush autosave for {document_id}: {e}")
+            return
+        finally:
+            entry.flushing = False
+        if written is None:
+            if self._pending.get(document_id) is entry and not await self._exists(document_id):
+                # Deleted (e.g. through another worker): nothing left to write to
+                flush_conflicts_total.inc(result="deleted")
+                del self._pending[document_id]
+            return
+        flushes_total.inc(reason=reason)
+        if self._pending.get(document_id) is entry:
+            # Later acknowledgements continue above the version written
+            entry.document["version"] += written - version
+            if entry.document["version"] == written:
+                del self._pending[document_id]
+            else:
+                # Saved again while the write was in flight; stay buffered
+                entry.dirty_since = time.monotonic()
+
+    async def _rebase(self, document_id: str, stored: Dict[str, Any]) -> Optional[int]:
+        """
+        Write `stored` when the database already holds a version at or above
+        ours. Versions are counted per worker, so another worker's counter may
+        simply be ahead; the buffered state is this worker's latest save and
+        is written as the next version above the stored one, conditional on
+        that version staying put. Returns the version written, or None if the
+        document is gone or keeps changing (the entry stays buffered).
+        """
+        for _ in range(CONFLICT_RETRIES):
+            current = await self.collection.find_one({"_id": document_id}, {"version": 1})
+            if current is None:
+                return None
+            current_version = current.get("version", 0)
+            result = await self.collection.update_one(
+                {"_id": document_id, "version": current_version},
+                {"$set": {**stored, "version": current_version + 1}}
+            )
+            if result.matched_count:
+                flush_conflicts_total.inc(result="rebased")
+                return current_version + 1
+        flush_conflicts_total.inc(result="retrying")
+        print(f"Warning: Autosave flush of {document_id} conflicted with concurrent writes; will retry")
+        return None
+
+    async def _exists(self, document_id: str) -> bool:
+        return await self.collection.find_one({"_id": document_id}, {"_id": 1}) is not None
+
+    async def flush_all(self, reason: str = "shutdown") -> None:
+        await asyncio.gather(*(self.flush(document_id, reason) for document_id in list(self._pending)))
+
+    def _flush_oldest(self) -> None:
+        oldest = min(self._pending, key=lambda document_id: self._pending[document_id].last_save)
+        asyncio.ensure_future(self.flush(oldest, "capacity"))
+
+    def _due(self) -> List[tuple]:
+        now = time.monotonic()
+        due = []
+        for document_id, entry in self._pending.items():
+            if now - entry.last_save >= self.idle_s:
+                due.append((document_id, "idle"))
+            elif now - entry.dirty_since >= self.max_delay_s:
+                due.append((document_id, "max_delay"))
+        return due
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            due = self._due()
+            if due:
+                await asyncio.gather(*(self.flush(document_id, reason) for document_id, reason in due))
+
+    def start(self) -> None:
+        """Start the flush loop; called from the FastAPI lifespan"""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flush loop and write out everything still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_all()
+
+autosave_buffer = AutosaveBuffer(
+    documents_collection,
+    flush_interval_s=AUTOSAVE_CONFIG["flush_interval_s"],
+    idle_s=AUTOSAVE_CONFIG["idle_s"],
+    max_delay_s=AUTOSAVE_CONFIG["max_delay_s"],
+    max_documents=AUTOSAVE_CONFIG["max_documents"]
+)
@@ -0,0 +1,414 @@
+# Streaming export and import of a user's documents, chat history and image references
+import asyncio
+import io
+import json
+import os
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from pymongo.errors import BulkWriteError
+
+from app.autosave import autosave_buffer
+from app.chat_store import import_messages, migrate_legacy
+from app.content_store import is_large, load_content, store_content
+from app.database import (
+    chat_history_collection, chat_messages_collection, documents_collection,
+    users_collection, summarize_content
+)
+from app.metrics import metrics
+from app.models import User
+
+BACKUP_CONFIG = {
+    # Documents read (export) or inserted (import) per batch; bounds memory
+    "batch_size": max(1, int(os.getenv("BACKUP_BATCH_SIZE", "100"))),
+    # Zip uploads above this are spooled to a temporary file
+    "spool_mb": float(os.getenv("BACKUP_SPOOL_MB", "16"))
+}
+
+FORMAT = "essay-workspace"
+FORMAT_VERSION = 1
+
+backup_documents_total = metrics.counter(
+    "backup_documents_total",
+    "Documents exported or imported",
+    ["direction"]
+)
+
+# An export is a sequence of records (one JSON object per line in NDJSON):
+#   {"type": "header", "format", "version", "user_id", "exported_at"}
+#   {"type": "document", "id", "title", "content", "version", "created_at", "updated_at", "images"}
+#   {"type": "chat", "document_id", "messages": [...]}   (one per bucket, after its document)
+#   {"type": "end", "documents", "chat_messages"}
+# Dates are ISO 8601 strings.
+
+def _json_default(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _dumps(record: Dict[str, Any]) -> str:
+    return json.dumps(record, default=_json_default, ensure_ascii=False)
+
+def _parse_date(value: Any) -> Optional[datetime]:
+    """An ISO 8601 date as a naive UTC datetime, like those stored; None if absent"""
+    if value is None or value == "":
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid date {value!r}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _document_record(document: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": "document",
+        "id": document["_id"],
+        "title": document.get("title", ""),
+        "content": document.get("content", ""),
+        "version": document.get("version", 0),
+        "created_at": document.get("created_at"),
+        "updated_at": document.get("updated_at"),
+        "images": document.get("images", [])
+    }
+
+async def _chat_records(document_ids: List[str]) -> AsyncIterator[Dict[str, Any]]:
+    """Chat records of a batch of documents, bucket by bucket in order"""
+    async for head in chat_history_collection.find(
+        {"document_id": {"$in": document_ids}, "messages": {"$exists": True}},
+        {"document_id": 1, "messages": 1}
+    ):
+        await migrate_legacy(head)
+    cursor = chat_messages_collection.find(
+        {"document_id": {"$in": document_ids}},
+        {"document_id": 1, "messages": 1}
+    ).sort([("document_id", -1), ("bucket", 1)])  # the (document_id, bucket -1) index, reversed
+    async for bucket in cursor:
+        # A retried bulk write may have stored a message twice; seq identifies it
+        messages = sorted({message["seq"]: message for message in bucket["messages"]}.values(),
+                          key=lambda message: message["seq"])
+        yield {"type": "chat", "document_id": bucket["document_id"], "messages": messages}
+
+async def export_records(user_id: str, include_chat: bool = True) -> AsyncIterator[Dict[str, Any]]:
+    """
+    All of a user's documents as export records. Documents are read through
+    a cursor in batches, so memory does not grow with the number of documents.
+    """
+    yield {"type": "header", "format": FORMAT, "version": FORMAT_VERSION,
+           "user_id": user_id, "exported_at": datetime.utcnow()}
+    buffered = autosave_buffer.buffered_for_user(user_id)
+    # Oldest first: a document saved during the export moves to the end and
+    # may come up twice, so ids already exported are skipped
+    exported = set()
+    documents = chat_messages = 0
+    cursor = documents_collection.find({"user_id": user_id}).sort([("updated_at", 1), ("_id", 1)]) \
+        .batch_size(BACKUP_CONFIG["batch_size"])
+    batch: List[str] = []
+
+    async def flush_chat() -> AsyncIterator[Dict[str, Any]]:
+        nonlocal chat_messages
+        if include_chat and batch:
+            async for record in _chat_records(batch):
+                chat_messages += len(record["messages"])
+                yield record
+        batch.clear()
+
+    async for document in cursor:
+        if document["_id"] in exported:
+            continue
+        exported.add(document["_id"])
+        if document["_id"] in buffered:
+            # Unflushed autosaves are newer than the database
+            document = {**document, **buffered[document["_id"]]}
+        else:
+            document = await load_content(document)
+        documents += 1
+        backup_documents_total.inc(direction="export")
+        yield _document_record(document)
+        batch.append(document["_id"])
+        if len(batch) >= BACKUP_CONFIG["batch_size"]:
+            async for record in flush_chat():
+                yield record
+    async for record in flush_chat():
+        yield record
+    yield {"type": "end", "documents": documents, "chat_messages": chat_messages}
+
+async def export_ndjson(user_id: str, include_chat: bool = True) -> AsyncIterator[bytes]:
+    async for record in export_records(user_id, include_chat):
+        yield (_dumps(record) + "\n").encode()
+
+class _StreamBuffer(io.RawIOBase):
+    """Unseekable file that zipfile writes into and the response drains"""
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+async def export_zip(user_id: str, include_chat: bool = True) -> AsyncIterator[bytes]:
+    """
+    The export as a zip archive: documents/<id>.json per document,
+    chat/<id>.ndjson per chat (one line per bucket record) and manifest.json
+    with the header and end records. Written as it streams.
+    """
+    stream = _StreamBuffer()
+    archive = zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_DEFLATED)
+    manifest: Dict[str, Any] = {}
+    chat_entry: Optional[Tuple[str, Any]] = None
+    async for record in export_records(user_id, include_chat):
+        if record["type"] == "chat":
+            if chat_entry is None or chat_entry[0] != record["document_id"]:
+                if chat_entry is not None:
+                    chat_entry[1].close()
+                chat_entry = (record["document_id"], archive.open(f"chat/{record['document_id']}.ndjson", "w"))
+            chat_entry[1].write((_dumps(record) + "\n").encode())
+        else:
+            if chat_entry is not None:
+                chat_entry[1].close()
+                chat_entry = None
+            if record["type"] == "document":
+                archive.writestr(f"documents/{record['id']}.json", _dumps(record))
+            else:
+                manifest[record["type"]] = record
+        data = stream.take()
+        if data:
+            yield data
+    if chat_entry is not None:
+        chat_entry[1].close()
+    archive.writestr("manifest.json", _dumps(manifest))
+    archive.close()
+    yield stream.take()
+
+def parse_record(line: bytes, number: int) -> Optional[Dict[str, Any]]:
+    """The record on an NDJSON line (None for a blank line)"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"Line {number} is not valid JSON: {e}")
+    if not isinstance(record, dict) or "type" not in record:
+        raise ValueError(f"Line {number} is not an export record")
+    return record
+
+def ndjson_records(lines: Iterator[bytes]) -> Iterator[Dict[str, Any]]:
+    for number, line in enumerate(lines, 1):
+        record = parse_record(line, number)
+        if record is not None:
+            yield record
+
+def zip_records(file) -> Iterator[Dict[str, Any]]:
+    """Records of a zip export, document by document (each followed by its chat)"""
+    with zipfile.ZipFile(file) as archive:
+        names = set(archive.namelist())
+        if "manifest.json" not in names:
+            raise ValueError("Not an export archive: manifest.json is missing")
+        manifest = json.loads(archive.read("manifest.json"))
+        if "header" in manifest:
+            yield manifest["header"]
+        for name in sorted(names):
+            if not (name.startswith("documents/") and name.endswith(".json")):
+                continue
+            record = json.loads(archive.read(name))
+            yield record
+            chat = f"chat/{record.get('id')}.ndjson"
+            if chat in names:
+                with archive.open(chat) as lines:
+                    yield from ndjson_records(lines)
+
+def _check_header(record: Dict[str, Any]) -> None:
+    if record.get("format") != FORMAT or record.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(f"Unsupported export format {record.get('format')!r} version {record.get('version')!r}")
+
+def _document_fields(record: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields of a document record to store; ValueError if it is malformed"""
+    if not record.get("id"):
+        raise ValueError("Document record without an id")
+    images = record.get("images") or []
+    if not isinstance(images, list) or not all(isinstance(image, dict) for image in images):
+        raise ValueError(f"Document {record['id']} has malformed images")
+    content = record.get("content") or ""
+    if not isinstance(content, str):
+        raise ValueError(f"Document {record['id']} has non-text content")
+    return {
+        "title": record.get("title") or "Untitled",
+        "version": record.get("version") or 0,
+        "created_at": _parse_date(record.get("created_at")),
+        "updated_at": _parse_date(record.get("updated_at")),
+        "images": [{**image, "uploadedAt": _parse_date(image.get("uploadedAt"))} for image in images],
+        "content": content
+    }
+
+def _chat_messages(record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The messages of a chat record to store; ValueError if it is malformed"""
+    messages = record.get("messages") or []
+    if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+        raise ValueError(f"Chat of {record.get('document_id')} has malformed messages")
+    return [
+        {**message, "timestamp": _parse_date(message.get("timestamp"))}
+        for message in messages if isinstance(message.get("seq"), int)
+    ]
+
+def validate_record(record: Dict[str, Any]) -> None:
+    """Raise ValueError if the importer would reject this record"""
+    kind = record.get("type")
+    if kind == "header":
+        _check_header(record)
+    elif kind == "document":
+        _document_fields(record)
+    elif kind == "chat":
+        _chat_messages(record)
+
+class Importer:
+    """
+    Imports export records for a user. Documents are inserted in bulk,
+    `batch_size` at a time, and chat messages with them. Documents get new
+    ids unless `keep_ids`; with `keep_ids`, ids that already exist are skipped.
+    """
+    def __init__(self, user_id: str, keep_ids: bool = False, batch_size: int = 100):
+        self.user_id = user_id
+        self.keep_ids = keep_ids
+        self.batch_size = batch_size
+        # Exported id -> imported id (None when skipped)
+        self.id_map: Dict[str, Optional[str]] = {}
+        self.documents: List[Dict[str, Any]] = []
+        # Content to chunk once its document is inserted, by document id
+        self.large_content: Dict[str, str] = {}
+        self.chat: Dict[str, List[Dict[str, Any]]] = {}
+        self.chat_count = 0
+        self.imported = 0
+        self.skipped = 0
+        self.chat_messages = 0
+
+    async def add(self, record: Dict[str, Any]) -> None:
+        kind = record.get("type")
+        if kind == "header":
+            _check_header(record)
+        elif kind == "document":
+            await self._add_document(record)
+        elif kind == "chat":
+            self._add_chat(record)
+        if len(self.documents) >= self.batch_size or self.chat_count >= self.batch_size * 10:
+            await self.flush()
+
+    async def _add_document(self, record: Dict[str, Any]) -> None:
+        fields = _document_fields(record)
+        exported_id = record["id"]
+        document_id = exported_id if self.keep_ids else str(uuid4())
+        self.id_map[exported_id] = document_id
+        content = fields["content"]
+        now = datetime.utcnow()
+        document = {
+            "_id": document_id,
+            "user_id": self.user_id,
+            "title": fields["title"],
+            "version": fields["version"],
+            "created_at": fields["created_at"] or now,
+            "updated_at": fields["updated_at"] or now,
+            "images": fields["images"],
+            **summarize_content(content),
+            "content": content,
+            "content_chunks": []
+        }
+        if is_large(content):
+            # Chunked after the insert, so an id that turns out to exist
+            # (keep_ids) gets no chunks written under it
+            document["content"] = ""
+            self.large_content[document_id] = content
+        self.documents.append(document)
+
+    def _add_chat(self, record: Dict[str, Any]) -> None:
+        messages = _chat_messages(record)
+        self.chat.setdefault(record.get("document_id"), []).extend(messages)
+        self.chat_count += len(messages)
+
+    async def flush(self) -> None:
+        # Documents first, so chat of a skipped document is known to be skipped
+        if self.documents:
+            documents, self.documents = self.documents, []
+            failed = set()
+            try:
+                await documents_collection.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != 11000 for error in errors):
+                    raise
+                failed = {documents[error["index"]]["_id"] for error in errors}
+            # Only kept ids can collide, and those map to themselves
+            for document_id in failed:
+                self.id_map[document_id] = None
+            large, self.large_content = self.large_content, {}
+            await asyncio.gather(*(self._store_large(document_id, content)
+                                   for document_id, content in large.items() if document_id not in failed))
+            self.imported += len(documents) - len(failed)
+            self.skipped += len(failed)
+            backup_documents_total.inc(len(documents) - len(failed), direction="import")
+
+        chat, self.chat, self.chat_count = self.chat, {}, 0
+        histories = {}
+        for exported_id, messages in chat.items():
+            document_id = self.id_map.get(exported_id)
+            if document_id is not None:
+                histories[document_id] = messages
+        if histories:
+            await import_messages(histories)
+            self.chat_messages += sum(len(messages) for messages in histories.values())
+
+    async def _store_large(self, document_id: str, content: str) -> None:
+        fields = await store_content(document_id, content, previous=[])
+        await documents_collection.update_one({"_id": document_id}, {"$set": fields})
+
+    async def finish(self) -> Dict[str, Any]:
+        await self.flush()
+        if self.imported:
+            # Create the user if it does not exist yet, as create_document does
+            new_user = User(user_id=self.user_id).model_dump(by_alias=True)
+            del new_user["user_id"]
+            await users_collection.update_one({"user_id": self.user_id}, {"$setOnInsert": new_user}, upsert=True)
+        return {
+            "imported": self.imported,
+            "skipped": self.skipped,
+            "chat_messages": self.chat_messages,
+            "id_map": {exported_id: document_id for exported_id, document_id in self.id_map.items() if document_id}
+        }
+
+def _spooled_records(spool, is_zip: bool) -> Iterator[Dict[str, Any]]:
+    spool.seek(0)
+    if not is_zip:
+        yield from ndjson_records(spool)
+        return
+    try:
+        yield from zip_records(spool)
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise ValueError(f"Invalid export archive: {e}")
+
+async def import_stream(importer: Importer, chunks: AsyncIterator[bytes], is_zip: bool) -> None:
+    """
+    Feed an uploaded export (NDJSON, or a zip archive) to the importer. The
+    upload is spooled (to a temporary file above `spool_mb`) and checked in
+    full first, so a malformed record rejects the import before anything is
+    written and a corrected file can simply be sent again.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=int(BACKUP_CONFIG["spool_mb"] * 1024 * 1024)) as spool:
+        async for chunk in chunks:
+            spool.write(chunk)
+        def check() -> None:
+            for record in _spooled_records(spool, is_zip):
+                validate_record(record)
+        await asyncio.to_thread(check)
+        for record in _spooled_records(spool, is_zip):
+            await importer.add(record)
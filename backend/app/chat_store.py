@@ -0,0 +1,202 @@
+# Chat messages stored in fixed-size buckets per document
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.database import chat_history_collection, chat_messages_collection
+from app.metrics import metrics
+
+CHAT_STORE_CONFIG = {
+    # Messages per bucket document; buckets stay far below the 16 MB limit
+    "bucket_size": max(1, int(os.getenv("CHAT_BUCKET_SIZE", "100")))
+}
+
+messages_appended_total = metrics.counter(
+    "chat_messages_appended_total",
+    "Chat messages written to the bucket store"
+)
+legacy_migrations_total = metrics.counter(
+    "chat_history_migrations_total",
+    "Chat histories moved from a single messages array into buckets"
+)
+
+# chat_history holds one small head document per chat: the message counter
+# (the next sequence number) and timestamps. Messages live in chat_messages,
+# `bucket_size` per bucket document, each with its sequence number.
+# Messages from before buckets existed are migrated with sequence numbers
+# -n..-1, so they sort before new messages without touching the counter.
+
+def _bucket(seq: int) -> int:
+    return (seq - 1) // CHAT_STORE_CONFIG["bucket_size"]
+
+def _bucket_id(document_id: str, bucket: int) -> str:
+    return f"{document_id}:{bucket}"
+
+def _bucket_updates(document_id: str, messages: List[Dict[str, Any]], insert_only: bool = False) -> List[UpdateOne]:
+    """One upsert per bucket touched by `messages` (which carry their seq)"""
+    by_bucket: Dict[int, List[Dict[str, Any]]] = {}
+    for message in messages:
+        by_bucket.setdefault(_bucket(message["seq"]), []).append(message)
+    now = datetime.utcnow()
+    updates = []
+    for bucket, bucket_messages in by_bucket.items():
+        on_insert = {"document_id": document_id, "bucket": bucket, "created_at": now}
+        if insert_only:
+            # Idempotent: a bucket already written is left alone
+            update = {"$setOnInsert": {**on_insert, "messages": bucket_messages, "count": len(bucket_messages)}}
+        else:
+            update = {
+                "$push": {"messages": {"$each": bucket_messages}},
+                "$inc": {"count": len(bucket_messages)},
+                "$setOnInsert": on_insert
+            }
+        updates.append(UpdateOne({"_id": _bucket_id(document_id, bucket)}, update, upsert=True))
+    return updates
+
+async def _write_buckets(updates: List[UpdateOne]) -> None:
+    try:
+        await chat_messages_collection.bulk_write(updates, ordered=False)
+    except BulkWriteError as e:
+        # Two writers upserting a new bucket at once: one insert loses the
+        # race on _id. Retry those; the bucket exists now.
+        retry = [updates[error["index"]] for error in e.details.get("writeErrors", []) if error.get("code") == 11000]
+        if len(retry) < len(e.details.get("writeErrors", [])):
+            raise
+        if retry:
+            await chat_messages_collection.bulk_write(retry, ordered=False)
+
+async def reserve_seqs(document_id: str, count: int) -> int:
+    """
+    Reserve `count` consecutive sequence numbers in a document's chat (one
+    atomic write on the head document, created if needed); returns the first
+    """
+    now = datetime.utcnow()
+    def reserve():
+        return chat_history_collection.find_one_and_update(
+            {"document_id": document_id},
+            {
+                "$inc": {"message_count": count},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"_id": document_id, "created_at": now}
+            },
+            projection={"message_count": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    try:
+        head = await reserve()
+    except DuplicateKeyError:
+        # Another append created the head document first
+        head = await reserve()
+    return head["message_count"] - count + 1
+
+def number_messages(messages: List[Dict[str, Any]], first_seq: int) -> List[Dict[str, Any]]:
+    return [{**message, "seq": first_seq + offset} for offset, message in enumerate(messages)]
+
+async def write_messages(numbered: List[Tuple[str, List[Dict[str, Any]]]]) -> None:
+    """Write numbered messages of any number of documents in one bulk write"""
+    updates = [update for document_id, messages in numbered for update in _bucket_updates(document_id, messages)]
+    if updates:
+        await _write_buckets(updates)
+        messages_appended_total.inc(sum(len(messages) for _, messages in numbered))
+
+async def append_messages(document_id: str, messages: List[Dict[str, Any]]) -> List[int]:
+    """
+    Append messages to a document's chat, in order, and return their sequence
+    numbers. Two writes regardless of history length: reserve the numbers on
+    the head document, then push into the bucket(s).
+    """
+    if not messages:
+        return []
+    numbered = number_messages(messages, await reserve_seqs(document_id, len(messages)))
+    await write_messages([(document_id, numbered)])
+    return [message["seq"] for message in numbered]
+
+async def import_messages(histories: Dict[str, List[Dict[str, Any]]]) -> None:
+    """
+    Write messages that already carry their seq (e.g. from an export) for
+    new documents. A document's history may arrive over several calls; the
+    head document's counters only move up.
+    """
+    heads = []
+    updates = []
+    now = datetime.utcnow()
+    for document_id, messages in histories.items():
+        if not messages:
+            continue
+        seqs = [message["seq"] for message in messages]
+        heads.append(UpdateOne(
+            {"_id": document_id},
+            {
+                "$max": {"message_count": max(max(seqs), 0), "legacy_count": max(-min(seqs), 0)},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"document_id": document_id, "created_at": now}
+            },
+            upsert=True
+        ))
+        updates.extend(_bucket_updates(document_id, messages))
+    if heads:
+        await chat_history_collection.bulk_write(heads, ordered=False)
+        await _write_buckets(updates)
+        messages_appended_total.inc(sum(len(messages) for messages in histories.values()))
+
+async def migrate_legacy(head: Dict[str, Any]) -> None:
+    """Move a head document's embedded messages array into buckets"""
+    legacy = head.get("messages") or []
+    numbered = number_messages(legacy, -len(legacy))
+    if numbered:
+        await _write_buckets(_bucket_updates(head["document_id"], numbered, insert_only=True))
+    result = await chat_history_collection.update_one(
+        {"_id": head["_id"], "messages": {"$exists": True}},
+        {"$unset": {"messages": ""}, "$set": {"legacy_count": len(legacy)}}
+    )
+    if result.modified_count:
+        legacy_migrations_total.inc()
+
+async def get_messages(document_id: str, limit: int = 50, before: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Up to `limit` messages before sequence number `before` (the latest if
+    None), oldest first. Returns None if the document has no chat yet.
+    Reads only the buckets that can contain the page.
+    """
+    head = await chat_history_collection.find_one(
+        {"document_id": document_id},
+        {"document_id": 1, "message_count": 1, "legacy_count": 1, "messages": 1}
+    )
+    if head is None:
+        return None
+    if "messages" in head:
+        await migrate_legacy(head)
+        head["legacy_count"] = len(head.pop("messages") or [])
+
+    if before is None:
+        before = head.get("message_count", 0) + 1
+    # Buckets from the one holding `before - 1` down to the one holding
+    # `before - limit` (one further, as seq 0 is never used)
+    newest = _bucket(before - 1)
+    oldest = _bucket(before - limit - 1)
+    cursor = chat_messages_collection.find(
+        {"document_id": document_id, "bucket": {"$gte": oldest, "$lte": newest}},
+        {"messages": 1}
+    ).sort("bucket", -1)
+    page: List[Dict[str, Any]] = []
+    async for bucket in cursor:
+        page.extend(message for message in bucket["messages"] if message["seq"] < before)
+    # A retried bulk write may have stored a message twice; seq identifies it
+    page = sorted({message["seq"]: message for message in page}.values(), key=lambda message: message["seq"])
+    page = page[-limit:]
+
+    first_seq = -head["legacy_count"] if head.get("legacy_count") else 1
+    has_more = bool(page) and page[0]["seq"] > first_seq
+    return {
+        "messages": page,
+        "total": head.get("message_count", 0) + head.get("legacy_count", 0),
+        "next_before": page[0]["seq"] if has_more else None
+    }
+
+async def delete_messages(document_id: str) -> None:
+    await chat_messages_collection.delete_many({"document_id": document_id})
+    await chat_history_collection.delete_one({"document_id": document_id})
@@ -0,0 +1,177 @@
+# Batched persistence of chat turns from the chat endpoints
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.chat_store import number_messages, reserve_seqs, write_messages
+from app.metrics import metrics
+
+CHAT_WRITER_CONFIG = {
+    # Persist turns of chat requests that carry a document_id
+    "enabled": os.getenv("CHAT_PERSIST_ENABLED", "true").lower() == "true",
+    "interval_s": float(os.getenv("CHAT_WRITE_INTERVAL", "0.5")),
+    # Flush early once this many messages are waiting
+    "max_batch": int(os.getenv("CHAT_WRITE_MAX_BATCH", "500")),
+    # Failed writes of a document's messages are retried this many times in
+    # all, then dropped (e.g. a write the database keeps rejecting)
+    "max_attempts": max(1, int(os.getenv("CHAT_WRITE_MAX_ATTEMPTS", "5")))
+}
+
+batches_total = metrics.counter(
+    "chat_writer_batches_total",
+    "Bulk writes of queued chat messages"
+)
+batch_messages = metrics.histogram(
+    "chat_writer_batch_messages",
+    "Chat messages per bulk write",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+write_errors_total = metrics.counter(
+    "chat_writer_errors_total",
+    "Failed chat message writes (retried on the next flush, up to max_attempts)"
+)
+dropped_messages_total = metrics.counter(
+    "chat_writer_dropped_messages_total",
+    "Chat messages given up on after max_attempts failed writes"
+)
+queued_messages = metrics.gauge(
+    "chat_writer_queued_messages",
+    "Chat messages waiting to be written"
+)
+
+class ChatWriter:
+    """
+    Queues chat messages in memory and writes everything queued every
+    `interval_s`: one sequence reservation per document (concurrently) and
+    one bulk write for all of them. Messages of a document keep their order.
+    Whatever is queued is written when the app shuts down. Failed writes are
+    retried one document at a time, so one document the database rejects
+    does not hold up the others, with the same sequence numbers, so a message
+    may be stored twice; chat_store drops the duplicate when reading. After
+    `max_attempts` failures a document's messages are dropped.
+    """
+    def __init__(self, interval_s: float = 0.5, max_batch: int = 500, max_attempts: int = 5):
+        self.interval_s = interval_s
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self._queued: Dict[str, List[Dict[str, Any]]] = {}
+        # Failed sequence reservations per document
+        self._reserve_failures: Dict[str, int] = {}
+        # Messages that have sequence numbers but whose write failed, with
+        # the number of failed attempts
+        self._numbered: List[Tuple[str, List[Dict[str, Any]], int]] = []
+        self._lock = asyncio.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        queued_messages.set_function(lambda: {(): self.queued_count()})
+
+    def queued_count(self) -> int:
+        return (sum(len(messages) for messages in self._queued.values()) +
+                sum(len(messages) for _, messages, _ in self._numbered))
+
+    def add(self, document_id: str, messages: List[Dict[str, Any]]) -> None:
+        """Queue messages for a document; safe to call from a finally block"""
+        self._queued.setdefault(document_id, []).extend(messages)
+        if self._wake is not None and self.queued_count() >= self.max_batch:
+            self._wake.set()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            queued, self._queued = self._queued, {}
+            retries, self._numbered = self._numbered, []
+            if not queued and not retries:
+                return
+
+            documents = list(queued)
+            firsts = await asyncio.gather(
+                *(reserve_seqs(document_id, len(queued[document_id])) for document_id in documents),
+                return_exceptions=True
+            )
+            numbered = []
+            for document_id, first in zip(documents, firsts):
+                if isinstance(first, BaseException):
+                    write_errors_total.inc()
+                    print(f"Warning: Could not reserve chat sequence numbers for {document_id}: {first}")
+                    failures = self._reserve_failures.get(document_id, 0) + 1
+                    if failures >= self.max_attempts:
+                        self._reserve_failures.pop(document_id, None)
+                        self._drop(document_id, queued[document_id])
+                    else:
+                        self._reserve_failures[document_id] = failures
+                        # Back in front of anything queued meanwhile
+                        self._queued[document_id] = queued[document_id] + self._queued.get(document_id, [])
+                else:
+                    self._reserve_failures.pop(document_id, None)
+                    numbered.append((document_id, number_messages(queued[document_id], first)))
+
+            if numbered:
+                try:
+                    await write_messages(numbered)
+                    batches_total.inc()
+                    batch_messages.observe(sum(len(messages) for _, messages in numbered))
+                except Exception as e:
+                    write_errors_total.inc()
+                    print(f"Warning: Could not write {sum(len(m) for _, m in numbered)} chat messages: {e}")
+                    self._numbered.extend((document_id, messages, 1) for document_id, messages in numbered)
+            if retries:
+                await self._retry(retries)
+
+    async def _retry(self, retries: List[Tuple[str, List[Dict[str, Any]], int]]) -> None:
+        """Write messages whose earlier write failed, each document on its own"""
+        results = await asyncio.gather(
+            *(write_messages([(document_id, messages)]) for document_id, messages, _ in retries),
+            return_exceptions=True
+        )
+        for (document_id, messages, attempts), result in zip(retries, results):
+            if not isinstance(result, BaseException):
+                batches_total.inc()
+                batch_messages.observe(len(messages))
+                continue
+            write_errors_total.inc()
+            print(f"Warning: Could not write {len(messages)} chat messages for {document_id} "
+                  f"(attempt {attempts + 1} of {self.max_attempts}): {result}")
+            if attempts + 1 >= self.max_attempts:
+                self._drop(document_id, messages)
+            else:
+                self._numbered.append((document_id, messages, attempts + 1))
+
+    def _drop(self, document_id: str, messages: List[Dict[str, Any]]) -> None:
+        dropped_messages_total.inc(len(messages))
+        print(f"Warning: Dropping {len(messages)} chat messages for {document_id} "
+              f"after {self.max_attempts} failed attempts")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            # Shielded so stopping the loop never abandons a batch half-written
+            await asyncio.shield(self.flush())
+
+    def start(self) -> None:
+        """Start the flush loop; called from the FastAPI lifespan"""
+        self._wake = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flush loop and write out everything still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for _ in range(3):
+            await self.flush()
+            if not self.queued_count():
+                return
+        print(f"Warning: {self.queued_count()} chat messages could not be written at shutdown")
+
+chat_writer = ChatWriter(
+    interval_s=CHAT_WRITER_CONFIG["interval_s"],
+    max_batch=CHAT_WRITER_CONFIG["max_batch"],
+    max_attempts=CHAT_WRITER_CONFIG["max_attempts"]
+)
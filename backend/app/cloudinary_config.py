@@ -1,16 +1,30 @@
 import os
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
+import threading
 from typing import Dict, Any
+from app.tracing import span
 
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"), 
-    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-    secure=True
-)
+_config_lock = threading.Lock()
+_configured = False
+
+def _cloudinary():
+    """The cloudinary package, imported and configured on first use"""
+    global _configured
+    with _config_lock:
+        import cloudinary
+        import cloudinary.uploader
+        import cloudinary.api
+
+        if not _configured:
+            cloudinary.config(
+                cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+                api_key=os.getenv("CLOUDINARY_API_KEY"),
+                api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+                # Override the API host, e.g. to point uploads at llm_stub.py in load tests
+                upload_prefix=os.getenv("CLOUDINARY_UPLOAD_PREFIX"),
+                secure=True
+            )
+            _configured = True
+    return cloudinary
 
 class CloudinaryService:
     """Service for handling Cloudinary image operations"""
@@ -29,14 +43,16 @@ class CloudinaryService:
             Dict containing upload result
         """
         try:
-            upload_result = cloudinary.uploader.upload(
-                file_path,
-                public_id=public_id,
-                folder=folder,
-                resource_type="image",
-                quality="auto",
-                fetch_format="auto"
-            )
+            cloudinary = _cloudinary()
+            with span("cloudinary.upload", folder=folder):
+                upload_result = cloudinary.uploader.upload(
+                    file_path,
+                    public_id=public_id,
+                    folder=folder,
+                    resource_type="image",
+                    quality="auto",
+                    fetch_format="auto"
+                )
             return upload_result
         except Exception as e:
             raise Exception(f"Failed to upload image to Cloudinary: {str(e)}")
@@ -53,7 +69,9 @@ class CloudinaryService:
             Dict containing deletion result
         """
         try:
-            result = cloudinary.uploader.destroy(public_id)
+            cloudinary = _cloudinary()
+            with span("cloudinary.destroy"):
+                result = cloudinary.uploader.destroy(public_id)
             return result
         except Exception as e:
             raise Exception(f"Failed to delete image from Cloudinary: {str(e)}")
@@ -71,6 +89,7 @@ class CloudinaryService:
             Optimized image URL
         """
         try:
+            cloudinary = _cloudinary()
             if transformations:
                 url = cloudinary.CloudinaryImage(public_id).build_url(**transformations)
             else:
@@ -94,7 +113,9 @@ class CloudinaryService:
             Dict containing image information
         """
         try:
-            result = cloudinary.api.resource(public_id)
+            cloudinary = _cloudinary()
+            with span("cloudinary.resource"):
+                result = cloudinary.api.resource(public_id)
             return result
         except Exception as e:
             raise Exception(f"Failed to get image info: {str(e)}")
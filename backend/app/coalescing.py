@@ -0,0 +1,127 @@
+# Coalescing of identical in-flight requests
+import asyncio
+import hashlib
+import json
+from contextlib import nullcontext
+from typing import Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+_END = object()
+
+def request_key(payload: Dict[str, Any]) -> str:
+    """Stable hash of a request payload; identical payloads get identical keys"""
+    encoded = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+class SingleFlight:
+    """
+    Shares one in-flight call among concurrent callers with the same key.
+    The call runs as its own task, so a caller disconnecting does not cancel
+    it for the others. Nothing is cached once the call completes.
+    """
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.coalesced = 0  # callers that joined an existing call
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+class _Broadcast:
+    """One upstream stream, replayed to every subscriber from its first event"""
+    def __init__(self):
+        self.events: List[Any] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+class StreamFanout:
+    """
+    Fans a single upstream stream out to every concurrent subscriber with the
+    same key. The upstream is a blocking iterator, pumped on the threadpool.
+    Subscribers that join late get the events so far, then the live ones, so
+    each sees exactly what a dedicated stream would have produced. If every
+    subscriber leaves, the upstream is closed at its next event.
+    """
+    def __init__(self):
+        self._streams: Dict[str, _Broadcast] = {}
+        self.coalesced = 0
+
+    async def subscribe(self,
+                        key: str,
+                        factory: Callable[[], Iterator[Any]],
+                        slot: Optional[Callable[[], AsyncContextManager[Any]]] = None) -> AsyncIterator[Any]:
+        """
+        Iterate the events of the stream for key, starting it with factory if
+        none is in flight. `slot`, if given, is held while the upstream runs
+        (e.g. a scheduler slot), so coalesced subscribers share one.
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = self._streams[key] = _Broadcast()
+            broadcast.task = asyncio.ensure_future(self._pump(key, broadcast, factory, slot))
+        else:
+            self.coalesced += 1
+
+        broadcast.subscribers += 1
+        position = 0
+        try:
+            while True:
+                async with broadcast.changed:
+                    await broadcast.changed.wait_for(
+                        lambda: position < len(broadcast.events) or broadcast.done
+                    )
+                    pending = broadcast.events[position:]
+                    finished = broadcast.done
+                for event in pending:
+                    yield event
+                position += len(pending)
+                if finished and position == len(broadcast.events):
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+        finally:
+            broadcast.subscribers -= 1
+
+    async def _pump(self,
+                    key: str,
+                    broadcast: _Broadcast,
+                    factory: Callable[[], Iterator[Any]],
+                    slot: Optional[Callable[[], AsyncContextManager[Any]]]) -> None:
+        iterator = None
+        try:
+            async with (slot() if slot is not None else nullcontext()):
+                iterator = await run_in_threadpool(factory)
+                while broadcast.subscribers > 0:
+                    event = await run_in_threadpool(next, iterator, _END)
+                    if event is _END:
+                        break
+                    async with broadcast.changed:
+                        broadcast.events.append(event)
+                        broadcast.changed.notify_all()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            # Stop accepting new subscribers before announcing the end
+            self._streams.pop(key, None)
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                await run_in_threadpool(close)
+            async with broadcast.changed:
+                broadcast.done = True
+                broadcast.changed.notify_all()
+
+    def in_flight(self) -> int:
+        return len(self._streams)
@@ -0,0 +1,274 @@
+# Large document content stored compressed, in paragraph-level chunks
+import asyncio
+import hashlib
+import os
+import re
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.database import content_chunks_collection
+from app.metrics import metrics
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+CONTENT_STORE_CONFIG = {
+    "enabled": os.getenv("CONTENT_CHUNKING_ENABLED", "true").lower() == "true",
+    # Content shorter than this stays inline in the document
+    "threshold_chars": int(os.getenv("CONTENT_CHUNK_THRESHOLD", "32768")),
+    # Target chunk size; chunks end on paragraph boundaries
+    "chunk_chars": max(256, int(os.getenv("CONTENT_CHUNK_CHARS", "8192"))),
+    # zstd when the zstandard package is installed, zlib otherwise
+    "codec": "zstd" if os.getenv("CONTENT_CODEC", "zstd") == "zstd" and ZSTD_AVAILABLE else "zlib",
+    # Chunks no document has referenced for this long may be deleted
+    "gc_grace_s": float(os.getenv("CONTENT_CHUNK_GC_SECONDS", "600"))
+}
+
+# Above this many characters, (de)compression runs in a worker thread
+THREAD_CHARS = 256 * 1024
+
+chunks_written_total = metrics.counter(
+    "content_chunks_written_total",
+    "Content chunks of large documents, by whether a save wrote or reused them",
+    ["result"]
+)
+chunk_bytes_total = metrics.counter(
+    "content_chunk_bytes_total",
+    "Bytes of content chunks written, before (raw) and after (stored) compression",
+    ["stage"]
+)
+
+# A chunked document keeps `content` empty and lists its chunks in order in
+# `content_chunks` ([{"hash", "chars"}]). Chunks live in document_chunks with
+# _id "{document_id}:{hash}", so a save writes only chunks whose text is new
+# and unchanged paragraphs are shared between versions.
+
+_PARAGRAPH = re.compile(r"[^\n]*\n*")
+
+def split_chunks(content: str, chunk_chars: int) -> List[str]:
+    """
+    Split content into chunks of about `chunk_chars` ending on paragraph
+    boundaries. Boundaries depend on paragraph text, not on position, so an
+    edit changes the chunk it falls in and leaves the others as they were.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for match in _PARAGRAPH.finditer(content):
+        paragraph = match.group()
+        if not paragraph:
+            continue
+        # A single huge paragraph (e.g. a pasted source without newlines)
+        while len(paragraph) > chunk_chars * 2:
+            if current:
+                chunks.append("".join(current))
+                current, size = [], 0
+            chunks.append(paragraph[:chunk_chars])
+            paragraph = paragraph[chunk_chars:]
+        current.append(paragraph)
+        size += len(paragraph)
+        if size >= chunk_chars or (size >= chunk_chars // 2 and zlib.crc32(paragraph.encode()) % 4 == 0):
+            chunks.append("".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+def _hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=12).hexdigest()
+
+def _chunk_id(document_id: str, chunk_hash: str) -> str:
+    return f"{document_id}:{chunk_hash}"
+
+def compress(text: str, codec: str) -> bytes:
+    data = text.encode()
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+def decompress(data: bytes, codec: str) -> str:
+    if codec == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("Content is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data).decode()
+    return zlib.decompress(data).decode()
+
+async def _off_loop(function, *args, chars: int):
+    if chars > THREAD_CHARS:
+        return await asyncio.to_thread(function, *args)
+    return function(*args)
+
+def is_chunked(document: Dict[str, Any]) -> bool:
+    return bool(document.get("content_chunks"))
+
+def is_large(content: str) -> bool:
+    """Whether store_content() chunks this content rather than keeping it inline"""
+    return CONTENT_STORE_CONFIG["enabled"] and len(content) >= CONTENT_STORE_CONFIG["threshold_chars"]
+
+async def store_content(document_id: str, content: str,
+                        previous: Optional[List[Dict[str, Any]]] = None,
+                        inserted: Optional[Dict[str, datetime]] = None) -> Dict[str, Any]:
+    """
+    Fields to $set on a document to store `content`. Large content is
+    chunked and compressed; chunks not stored yet are written here, before
+    the document points at them. `previous` is the document's current
+    content_chunks, if known; otherwise the database is asked which chunks exist.
+    Chunks this call inserted are recorded in `inserted`, if given, for
+    discard_chunks() should the document write not go through.
+    """
+    if not is_large(content):
+        return {"content": content, "content_chunks": []}
+
+    pieces = split_chunks(content, CONTENT_STORE_CONFIG["chunk_chars"])
+    refs = [{"hash": _hash(piece), "chars": len(piece)} for piece in pieces]
+    texts = {ref["hash"]: piece for ref, piece in zip(refs, pieces)}
+    if previous is not None:
+        known = {ref["hash"] for ref in previous} & set(texts)
+    else:
+        ids = [_chunk_id(document_id, chunk_hash) for chunk_hash in texts]
+        known = {doc["_id"].rsplit(":", 1)[1]
+                 async for doc in content_chunks_collection.find({"_id": {"$in": ids}}, {"_id": 1})}
+    new = [chunk_hash for chunk_hash in texts if chunk_hash not in known]
+    await _write_chunks(document_id, texts, new, sorted(known), inserted)
+    chunks_written_total.inc(len(new), result="written")
+    chunks_written_total.inc(len(known), result="reused")
+    return {"content": "", "content_chunks": refs}
+
+def _now() -> datetime:
+    # BSON dates keep milliseconds; truncated so seen_at can be matched exactly
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+async def _write_chunks(document_id: str, texts: Dict[str, str], new: List[str], reused: List[str],
+                        inserted: Optional[Dict[str, datetime]] = None) -> None:
+    """
+    Insert the new chunks and mark the reused ones as seen in one bulk
+    write. If a reused chunk has been deleted meanwhile, it is written again.
+    """
+    codec = CONTENT_STORE_CONFIG["codec"]
+    new_chars = sum(len(texts[chunk_hash]) for chunk_hash in new)
+    compressed = await _off_loop(lambda: [compress(texts[chunk_hash], codec) for chunk_hash in new], chars=new_chars)
+    now = _now()
+    operations = []
+    if reused:
+        operations.append(UpdateMany(
+            {"_id": {"$in": [_chunk_id(document_id, chunk_hash) for chunk_hash in reused]}},
+            {"$set": {"seen_at": now}}
+        ))
+    for chunk_hash, data in zip(new, compressed):
+        operations.append(UpdateOne(
+            {"_id": _chunk_id(document_id, chunk_hash)},
+            {
+                "$set": {"seen_at": now},
+                "$setOnInsert": {"document_id": document_id, "codec": codec, "data": data,
+                                 "chars": len(texts[chunk_hash])}
+            },
+            upsert=True
+        ))
+    if not operations:
+        return
+    result = await _bulk_write(operations)
+    chunk_bytes_total.inc(sum(len(texts[chunk_hash].encode()) for chunk_hash in new), stage="raw")
+    chunk_bytes_total.inc(sum(len(data) for data in compressed), stage="stored")
+    if result is not None and inserted is not None:
+        inserted.update((chunk_id, now) for chunk_id in result.upserted_ids.values())
+    # Matches of the reused-chunk update: everything matched minus the new
+    # chunks that turned out to exist already
+    if result is not None and reused and result.matched_count - (len(new) - result.upserted_count) < len(reused):
+        await _write_chunks(document_id, texts, reused, [], inserted)
+
+async def _bulk_write(operations: list):
+    try:
+        return await content_chunks_collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Two saves inserting the same new chunk: one loses the race on _id.
+        # The chunk is there either way.
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in errors):
+            raise
+        return None
+
+async def prune_chunks(document_id: str, fields: Dict[str, Any],
+                       previous: Optional[List[Dict[str, Any]]]) -> None:
+    """
+    Delete chunks the document no longer uses, after `fields` (from
+    store_content) were written. Chunks another save may be about to use
+    were seen within the grace period and are kept.
+    """
+    keep = {ref["hash"] for ref in fields.get("content_chunks") or []}
+    if previous is not None and {ref["hash"] for ref in previous} <= keep:
+        return
+    if previous is None and not keep:
+        # Inline content and nothing known to release; left to the next
+        # chunked save or the document's deletion
+        return
+    cutoff = datetime.utcnow() - timedelta(seconds=CONTENT_STORE_CONFIG["gc_grace_s"])
+    await content_chunks_collection.delete_many({
+        "document_id": document_id,
+        "_id": {"$nin": [_chunk_id(document_id, chunk_hash) for chunk_hash in keep]},
+        "seen_at": {"$lt": cutoff}
+    })
+
+async def discard_chunks(inserted: Dict[str, datetime]) -> None:
+    """
+    Delete the chunks store_content() inserted for a write that did not go
+    through (e.g. it lost a version check). A chunk marked seen since then
+    may be about to be used by another save, and is kept.
+    """
+    if not inserted:
+        return
+    await content_chunks_collection.delete_many({"$or": [
+        {"_id": chunk_id, "seen_at": seen_at} for chunk_id, seen_at in inserted.items()
+    ]})
+
+async def _read_chunks(document_id: str, refs: List[Dict[str, Any]]) -> List[str]:
+    ids = list({_chunk_id(document_id, ref["hash"]) for ref in refs})
+    stored = {doc["_id"]: doc async for doc in content_chunks_collection.find({"_id": {"$in": ids}})}
+    missing = [chunk_id for chunk_id in ids if chunk_id not in stored]
+    if missing:
+        raise RuntimeError(f"Document {document_id} is missing {len(missing)} content chunks")
+    def expand() -> List[str]:
+        texts = {chunk_id: decompress(doc["data"], doc.get("codec", "zlib")) for chunk_id, doc in stored.items()}
+        return [texts[_chunk_id(document_id, ref["hash"])] for ref in refs]
+    return await _off_loop(expand, chars=sum(ref["chars"] for ref in refs))
+
+async def load_content(document: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Fill in `content` of a document read from the database, if chunked"""
+    if document is None or not is_chunked(document):
+        return document
+    document["content"] = "".join(await _read_chunks(document["_id"], document["content_chunks"]))
+    return document
+
+async def read_range(document: Dict[str, Any], start: int, end: Optional[int] = None) -> Tuple[str, int]:
+    """
+    Characters [start, end) of a document's content and its total length,
+    reading only the chunks that overlap the range
+    """
+    if not is_chunked(document) or document.get("content"):
+        # Inline, or already loaded (cached and buffered documents)
+        content = document.get("content", "")
+        return content[start:end], len(content)
+    refs = document["content_chunks"]
+    length = sum(ref["chars"] for ref in refs)
+    end = length if end is None else min(end, length)
+    wanted, offset, first = [], 0, None
+    for ref in refs:
+        if offset < end and offset + ref["chars"] > start:
+            if first is None:
+                first = offset
+            wanted.append(ref)
+        offset += ref["chars"]
+    if not wanted:
+        return "", length
+    text = "".join(await _read_chunks(document["_id"], wanted))
+    return text[start - first:end - first], length
+
+async def delete_chunks(document_id: str) -> None:
+    await content_chunks_collection.delete_many({"document_id": document_id})
@@ -1,51 +1,44 @@
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
-import certifi
-import ssl
+from pymongo.errors import OperationFailure
+from app.storage import STORAGE_CONFIG, MemoryStorage, MotorStorage
+from app.tracing import TracedCollection
 
 load_dotenv()
 
-MONGODB_URL = os.getenv("MONGODB_URL")
-if not MONGODB_URL:
-    raise ValueError("MONGODB_URL environment variable is required")
+# The MongoDB client is created and checked by storage.connect() in the app
+# lifespan, so importing this module does no I/O
+if STORAGE_CONFIG["backend"] == "memory":
+    print("Using in-memory storage: nothing is persisted")
+    storage = MemoryStorage()
+else:
+    storage = MotorStorage(os.getenv("MONGODB_URL"), os.getenv("DATABASE_NAME"))
 
-# Extract database name from connection string
-DATABASE_NAME = os.getenv("DATABASE_NAME")
-if not DATABASE_NAME:
-    raise ValueError("DATABASE_NAME environment variable is required")
+# Collections (each operation is recorded as a tracing span)
+users_collection = TracedCollection(storage.collection("users"))
+documents_collection = TracedCollection(storage.collection("documents"))
+chat_history_collection = TracedCollection(storage.collection("chat_history"))
+chat_messages_collection = TracedCollection(storage.collection("chat_messages"))
+revisions_collection = TracedCollection(storage.collection("revisions"))
+content_chunks_collection = TracedCollection(storage.collection("document_chunks"))
 
-# Create SSL context with certifi certificates
-ssl_context = ssl.create_default_context(cafile=certifi.where())
-
-try:
-    print("Connecting to MongoDB...")
-    client = AsyncIOMotorClient(
-        MONGODB_URL,
-        tlsCAFile=certifi.where(),
-        serverSelectionTimeoutMS=30000,
-        connectTimeoutMS=20000,
-        socketTimeoutMS=20000,
-    )
-    # Test the connection
-    client.admin.command('ping')
-    print("MongoDB connection successful")
-except Exception as e:
-    print(f"MongoDB connection error: {e}")
-    raise
-
-database = client[DATABASE_NAME]
+# Helper functions
+SNIPPET_LENGTH = 200
 
-# Collections
-users_collection = database["users"]
-documents_collection = database["documents"]
-chat_history_collection = database["chat_history"]
+def summarize_content(content: str) -> dict:
+    """Listing fields derived from content, stored alongside it on every write"""
+    return {
+        "snippet": " ".join(content[:SNIPPET_LENGTH * 2].split())[:SNIPPET_LENGTH],
+        "word_count": len(content.split())
+    }
 
-# Helper functions
 async def get_document_content(document_id: str) -> str:
     """Get document content by document ID"""
     try:
-        document = await documents_collection.find_one({"_id": document_id})
+        # Autosave buffer, then cache, then database (imported here to avoid
+        # a circular import)
+        from app.document_cache import get_document
+        document = await get_document(document_id)
         if document:
             return document.get("content", "")
         return ""
@@ -55,7 +48,20 @@ async def get_document_content(document_id: str) -> str:
 
 # Create indexes
 async def create_indexes():
-    # Index for documents by user_id
-    await documents_collection.create_index("user_id")
+    # Index for a user's documents, newest first (_id breaks ties for paging);
+    # it also serves plain user_id lookups
+    await documents_collection.create_index([("user_id", 1), ("updated_at", -1), ("_id", -1)])
+    # The plain user_id index it replaces; dropped so writes stop maintaining it
+    try:
+        await documents_collection.drop_index("user_id_1")
+    except OperationFailure:
+        pass  # Not there (new deployment, or already dropped)
     # Index for chat history by document_id
-    await chat_history_collection.create_index("document_id") 
\ No newline at end of file
+    await chat_history_collection.create_index("document_id")
+    # Chat message buckets, read newest first
+    await chat_messages_collection.create_index([("document_id", 1), ("bucket", -1)])
+    # Revision history: walked by sequence number, looked up by version
+    await revisions_collection.create_index([("document_id", 1), ("seq", 1)], unique=True)
+    await revisions_collection.create_index([("document_id", 1), ("version", 1)])
+    # Content chunks of large documents, pruned and deleted per document
+    await content_chunks_collection.create_index("document_id") 
\ No newline at end of file
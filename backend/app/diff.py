@@ -57,7 +57,9 @@ def compute_exact_diff(old_content: str, new_content: str, granularity: str = "w
         granularity: "word" or "character" level comparison
         
     Returns:
-        List of exact changes with their positions
+        List of exact changes with their positions. Meant for display: at word
+        granularity whitespace is normalised, so apply_changes() does not
+        rebuild new_content from them (use compute_delta for that).
     """
     changes = []
     
@@ -344,6 +346,107 @@ def _get_inline_changes(old_line: str, new_line: str, line_start_pos: int, line_
     
     return changes
 
+def compute_delta(old_content: str, new_content: str) -> List[Dict[str, Any]]:
+    """
+    Compute a compact delta that turns old_content into new_content with
+    apply_changes(). Unlike compute_exact_diff it is exact (whitespace
+    included) and stays fast on long documents: lines are matched first,
+    and only changed blocks are refined character by character. Changes
+    carry no old_text, so they are meant for storage, not display.
+    """
+    # Most saves touch one spot; skip the common prefix and suffix
+    prefix = 0
+    limit = min(len(old_content), len(new_content))
+    while prefix < limit and old_content[prefix] == new_content[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < limit - prefix and
+           old_content[len(old_content) - 1 - suffix] == new_content[len(new_content) - 1 - suffix]):
+        suffix += 1
+    old_middle = old_content[prefix:len(old_content) - suffix]
+    new_middle = new_content[prefix:len(new_content) - suffix]
+    if not old_middle and not new_middle:
+        return []
+
+    changes = []
+    old_lines = old_middle.splitlines(keepends=True)
+    new_lines = new_middle.splitlines(keepends=True)
+    old_offsets = _line_offsets(old_lines, prefix)
+    new_offsets = _line_offsets(new_lines, 0)
+    matcher = difflib.SequenceMatcher(isjunk=None, a=old_lines, b=new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        old_start, old_end = old_offsets[i1], old_offsets[i2]
+        new_text = new_middle[new_offsets[j1]:new_offsets[j2]]
+        old_text = old_content[old_start:old_end]
+        if tag == 'replace' and len(old_text) + len(new_text) <= 4096:
+            # Small block: refine to the characters that actually changed
+            inner = difflib.SequenceMatcher(isjunk=None, a=old_text, b=new_text, autojunk=False)
+            for inner_tag, k1, k2, l1, l2 in inner.get_opcodes():
+                if inner_tag != 'equal':
+                    changes.append(_delta_change(old_start + k1, old_start + k2, new_text[l1:l2]))
+        else:
+            changes.append(_delta_change(old_start, old_end, new_text))
+    return changes
+
+def _line_offsets(lines: List[str], start: int) -> List[int]:
+    offsets = [start]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return offsets
+
+def _delta_change(start_pos: int, end_pos: int, new_text: str) -> Dict[str, Any]:
+    if not new_text:
+        return {"type": ChangeType.DELETE.value, "start_pos": start_pos, "end_pos": end_pos}
+    change_type = ChangeType.INSERT if start_pos == end_pos else ChangeType.REPLACE
+    return {"type": change_type.value, "start_pos": start_pos, "end_pos": end_pos, "new_text": new_text}
+
+def apply_changes(content: str, changes: List[Dict[str, Any]]) -> str:
+    """
+    Apply changes in the shape of Change.to_dict() to a document.
+    
+    Args:
+        content: The document the changes were computed against
+        changes: Insert/delete/replace operations whose positions all refer
+            to `content`, as produced by compute_delta (or compute_exact_diff
+            at character granularity). Word-level diffs normalise whitespace
+            and do not reproduce the new content exactly.
+        
+    Returns:
+        The new document content
+        
+    Raises:
+        ValueError: If a change is out of range, overlaps another change, or
+            its old_text does not match the document
+    """
+    ordered = sorted(enumerate(changes), key=lambda item: (item[1]["start_pos"], item[0]))
+    
+    pieces = []
+    position = 0
+    for index, change in ordered:
+        change_type = change.get("type")
+        start_pos = change["start_pos"]
+        end_pos = start_pos if change_type == ChangeType.INSERT.value else change["end_pos"]
+        
+        if change_type not in (ChangeType.INSERT.value, ChangeType.DELETE.value, ChangeType.REPLACE.value):
+            raise ValueError(f"Change {index}: unknown type {change_type!r}")
+        if start_pos < position or end_pos < start_pos or end_pos > len(content):
+            raise ValueError(f"Change {index}: range {start_pos}-{end_pos} is out of bounds or overlaps another change")
+        old_text = change.get("old_text")
+        if old_text is not None and content[start_pos:end_pos] != old_text:
+            raise ValueError(f"Change {index}: old_text does not match the document at {start_pos}-{end_pos}")
+        if change_type != ChangeType.DELETE.value and change.get("new_text") is None:
+            raise ValueError(f"Change {index}: {change_type} requires new_text")
+        
+        pieces.append(content[position:start_pos])
+        if change_type != ChangeType.DELETE.value:
+            pieces.append(change["new_text"])
+        position = end_pos
+    
+    pieces.append(content[position:])
+    return "".join(pieces)
+
 # Hardcoded example usage and testing
 if __name__ == "__main__":
     # Test with word processor content
@@ -0,0 +1,170 @@
+# Bounded in-process LRU cache of document content, checked against the stored version
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.autosave import autosave_buffer
+from app.content_store import load_content, read_range
+from app.database import documents_collection
+from app.metrics import metrics
+
+DOCUMENT_CACHE_CONFIG = {
+    "enabled": os.getenv("DOCUMENT_CACHE_ENABLED", "true").lower() == "true",
+    "max_entries": int(os.getenv("DOCUMENT_CACHE_SIZE", "1000")),
+    # Total content held, so a few huge documents cannot exhaust memory
+    "max_chars": int(float(os.getenv("DOCUMENT_CACHE_MAX_MB", "64")) * 1024 * 1024)
+}
+
+cache_requests_total = metrics.counter(
+    "document_cache_requests_total",
+    "Document reads served from the cache (hit), or from the database because the entry was missing (miss) or older than the stored version (stale)",
+    ["result"]
+)
+cache_evictions_total = metrics.counter(
+    "document_cache_evictions_total",
+    "Documents evicted from the cache to stay within its bounds"
+)
+cache_entries = metrics.gauge(
+    "document_cache_entries",
+    "Documents currently cached"
+)
+
+class _Entry:
+    __slots__ = ("document", "stamp", "chars")
+
+    def __init__(self, document: Optional[Dict[str, Any]], stamp: int):
+        # document is None for an invalidation marker
+        self.document = document
+        self.stamp = stamp
+        self.chars = len(document.get("content", "")) if document is not None else 0
+
+class DocumentCache:
+    """
+    LRU cache of document records as stored in MongoDB. Every write path
+    calls invalidate(); entries carry the document version, and a fill never
+    replaces a newer version. Invalidation leaves a marker so that a read
+    which started before the write cannot put its stale result back. Writes
+    by other workers are caught by get_stored_document(), which serves an
+    entry only while its version is the stored one.
+    """
+    def __init__(self, max_entries: int = 1000, max_chars: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._chars = 0
+        self._clock = 0
+        cache_entries.set_function(lambda: {(): self.cached_count()})
+
+    def cached_count(self) -> int:
+        return sum(1 for entry in self._entries.values() if entry.document is not None)
+
+    def get(self, document_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(document_id)
+        if entry is None or entry.document is None:
+            return None
+        self._entries.move_to_end(document_id)
+        return dict(entry.document)
+
+    def ticket(self) -> int:
+        """Taken before a database read; pass it to put() with the result"""
+        return self._clock
+
+    def put(self, document: Dict[str, Any], ticket: int) -> None:
+        document_id = document["_id"]
+        current = self._entries.get(document_id)
+        if current is not None:
+            if current.document is None and current.stamp > ticket:
+                # Written since the read began; the result may be stale
+                return
+            if current.document is not None and current.document.get("version", 0) > document.get("version", 0):
+                return
+        self._replace(document_id, _Entry(dict(document), self._clock))
+
+    def invalidate(self, document_id: str) -> None:
+        self._clock += 1
+        self._replace(document_id, _Entry(None, self._clock))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._chars = 0
+
+    def _replace(self, document_id: str, entry: _Entry) -> None:
+        previous = self._entries.pop(document_id, None)
+        if previous is not None:
+            self._chars -= previous.chars
+        self._entries[document_id] = entry
+        self._chars += entry.chars
+        while len(self._entries) > self.max_entries or (self._chars > self.max_chars and len(self._entries) > 1):
+            _, evicted = self._entries.popitem(last=False)
+            self._chars -= evicted.chars
+            if evicted.document is not None:
+                cache_evictions_total.inc()
+
+document_cache = DocumentCache(
+    max_entries=DOCUMENT_CACHE_CONFIG["max_entries"],
+    max_chars=DOCUMENT_CACHE_CONFIG["max_chars"]
+)
+
+async def get_document(document_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Current state of a document: unflushed autosaves first, then the cache,
+    then the database (filling the cache).
+    """
+    document = autosave_buffer.get(document_id)
+    if document is not None:
+        return document
+    return await get_stored_document(document_id)
+
+async def _current_entry(document_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The cached document if its version is still the stored one. Other
+    workers' writes do not invalidate this worker's cache, so every hit is
+    checked with a read of the document without its content: the cache
+    saves reading and decompressing the content, and the other fields
+    (images, whose changes keep the version) come from that read.
+    """
+    cached = document_cache.get(document_id)
+    if cached is None:
+        cache_requests_total.inc(result="miss")
+        return None
+    stored = await documents_collection.find_one({"_id": document_id}, {"content": 0, "content_chunks": 0})
+    if stored is None or stored.get("version", 0) != cached.get("version", 0):
+        cache_requests_total.inc(result="stale")
+        return None
+    cache_requests_total.inc(result="hit")
+    return {**stored, "content": cached.get("content", ""), "content_chunks": cached.get("content_chunks", [])}
+
+async def get_stored_document(document_id: str) -> Optional[Dict[str, Any]]:
+    """
+    A document as stored, without unflushed autosaves: from the cache if
+    still current, else the database (filling the cache). For fields the
+    buffer does not hold.
+    """
+    if not DOCUMENT_CACHE_CONFIG["enabled"]:
+        return await load_content(await documents_collection.find_one({"_id": document_id}))
+
+    ticket = document_cache.ticket()
+    document = await _current_entry(document_id)
+    if document is not None:
+        return document
+    document = await load_content(await documents_collection.find_one({"_id": document_id}))
+    if document is not None:
+        document_cache.put(document, ticket)
+    return document
+
+async def get_content_range(document_id: str, start: int, end: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Characters [start, end) of a document's current content. Unless the
+    document is buffered or cached, only the chunks holding the range are read.
+    """
+    document = autosave_buffer.get(document_id)
+    if document is None and DOCUMENT_CACHE_CONFIG["enabled"]:
+        document = await _current_entry(document_id)
+    if document is None:
+        document = await documents_collection.find_one(
+            {"_id": document_id}, {"content": 1, "content_chunks": 1, "version": 1}
+        )
+        if document is None:
+            return None
+    content, length = await read_range(document, start, end)
+    return {"content": content, "version": document.get("version", 0), "length": length}
@@ -0,0 +1,216 @@
+# Hedged requests across LLM providers
+import contextvars
+import threading
+import queue
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+_DONE = object()
+
+class LatencyTracker:
+    """Rolling window of observed first-token latencies, keyed by provider"""
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def count(self, key: str) -> int:
+        with self._lock:
+            return len(self._samples.get(key, ()))
+
+    def percentile(self, key: str, pct: float) -> Optional[float]:
+        """Nearest-rank percentile of the samples for key, None if there are none"""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples:
+            return None
+        rank = max(0, min(len(samples) - 1, int(round(pct / 100.0 * len(samples))) - 1))
+        return samples[rank]
+
+    def observe_stream(self, key: str, chunks: Iterable[str]) -> Iterator[str]:
+        """Pass chunks through, recording the time to the first one"""
+        started = time.monotonic()
+        first = True
+        for chunk in chunks:
+            if first:
+                self.record(key, time.monotonic() - started)
+                first = False
+            yield chunk
+
+class HedgePolicy:
+    """Decides how long to wait on a provider before hedging to the next one"""
+    def __init__(self,
+                 enabled: bool = False,
+                 percentile: float = 95.0,
+                 min_samples: int = 20,
+                 default_delay_s: float = 4.0,
+                 min_delay_s: float = 0.5,
+                 max_delay_s: float = 15.0):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay_s = default_delay_s
+        self.min_delay_s = min_delay_s
+        self.max_delay_s = max_delay_s
+
+    def delay_for(self, key: str, tracker: LatencyTracker) -> float:
+        """Hedge threshold for key: its p95 once enough samples exist, else the default"""
+        if tracker.count(key) < self.min_samples:
+            return self.default_delay_s
+        observed = tracker.percentile(key, self.percentile)
+        return max(self.min_delay_s, min(self.max_delay_s, observed))
+
+class StreamRunner:
+    """
+    Pumps a blocking chunk iterator on a background thread so several
+    providers can race. Reports to `notify` exactly once: on the first chunk,
+    on an error before the first chunk, or on an empty stream.
+    """
+    def __init__(self,
+                 provider: str,
+                 factory: Callable[[], Iterable[str]],
+                 notify: "queue.Queue[Tuple[StreamRunner, Optional[BaseException]]]"):
+        self.provider = provider
+        self._factory = factory
+        self._notify = notify
+        self._chunks: "queue.Queue[object]" = queue.Queue()
+        self._cancelled = threading.Event()
+        self._error: Optional[BaseException] = None
+        # Run in a copy of the caller's context, so spans opened by the
+        # provider call nest under the request's trace
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=context.run, args=(self._run,), name=f"llm-{provider}", daemon=True)
+
+    def start(self) -> "StreamRunner":
+        self._thread.start()
+        return self
+
+    def cancel(self) -> None:
+        """
+        Stop pumping. The provider stream is closed at its next chunk since a
+        blocking read already in flight cannot be interrupted from outside.
+        """
+        self._cancelled.set()
+
+    def _run(self) -> None:
+        reported = False
+        iterator = None
+        try:
+            iterator = iter(self._factory())
+            for chunk in iterator:
+                if self._cancelled.is_set():
+                    break
+                if not reported:
+                    reported = True
+                    self._notify.put((self, None))
+                self._chunks.put(chunk)
+        except Exception as e:
+            self._error = e
+            if not reported:
+                reported = True
+                self._notify.put((self, e))
+        finally:
+            # Closing the generator releases the provider's HTTP stream
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception:
+                    pass
+            self._chunks.put(_DONE)
+            if not reported:
+                self._notify.put((self, None))
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            chunk = self._chunks.get()
+            if chunk is _DONE:
+                if self._error is not None:
+                    raise self._error
+                return
+            yield chunk
+
+class WinningStream:
+    """
+    The chunks of the runner that won a race. Closing it, or dropping it
+    unfinished, cancels the runner so its thread stops pulling the provider
+    stream, even if iteration never started.
+    """
+    def __init__(self, runner: StreamRunner):
+        self._runner = runner
+        self._chunks = iter(runner)
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        return next(self._chunks)
+
+    def close(self) -> None:
+        self._runner.cancel()
+        self._chunks.close()
+
+    def __del__(self):
+        self._runner.cancel()
+
+def hedged_call(candidates: List[Tuple[str, Callable[[], Iterable[str]]]],
+                policy: HedgePolicy,
+                tracker: LatencyTracker,
+                key_suffix: str = "") -> Tuple[str, Iterator[str]]:
+    """
+    Race providers in order: start the first, and whenever the newest one has
+    not produced a first chunk within its hedge threshold (or fails before
+    producing one), start the next. The first provider to produce a chunk wins
+    and the others are cancelled.
+
+    Thresholds come from tracker under "<provider><key_suffix>"; recording
+    samples is left to the candidates (see LatencyTracker.observe_stream).
+
+    Returns the winning provider name and a WinningStream over its chunks;
+    close it when stopping early. Raises the first error if every candidate
+    fails before producing anything.
+    """
+    notify: "queue.Queue[Tuple[StreamRunner, Optional[BaseException]]]" = queue.Queue()
+    pending = list(candidates)
+    runners: List[StreamRunner] = []
+    errors: List[BaseException] = []
+    active = 0
+
+    def launch() -> float:
+        provider, factory = pending.pop(0)
+        runners.append(StreamRunner(provider, factory, notify).start())
+        return time.monotonic() + policy.delay_for(provider + key_suffix, tracker)
+
+    hedge_at = launch()
+    active += 1
+    while True:
+        timeout = max(0.0, hedge_at - time.monotonic()) if pending else None
+        try:
+            runner, error = notify.get(timeout=timeout)
+        except queue.Empty:
+            hedge_at = launch()
+            active += 1
+            continue
+
+        active -= 1
+        if error is None:
+            for other in runners:
+                if other is not runner:
+                    other.cancel()
+            return runner.provider, WinningStream(runner)
+
+        errors.append(error)
+        if pending:
+            # Failed before its first token: hedge immediately
+            hedge_at = launch()
+            active += 1
+        elif active == 0:
+            raise errors[0]
@@ -1,11 +1,18 @@
 import os
 import json
+import time
+from contextlib import ExitStack
+from functools import partial
 from typing import Dict, Any, Optional, List, Generator, Union
-from groq import Groq
-import anthropic
-import google.generativeai as genai
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from app.llm_clients import llm_clients
+from app.hedging import HedgePolicy, LatencyTracker, hedged_call
+from app.provider_health import ProviderHealthRegistry, failover_call
+from app.scheduler import FairScheduler, ProviderLimiter
+from app.retry import ProviderRetry, RequestPacer, RetryPolicy, estimate_tokens
+from app.llm_stats import RequestStats
+from app.tracing import span, traced_iterator
 
 # Load environment variables
 load_dotenv()
@@ -21,17 +28,71 @@ LLM_CONFIG = {
     },
     "gemini": {
         "model": "gemini-2.5-flash"
-    }
+    },
+    # Hedging: if the preferred complex model has not streamed a first token
+    # within its p95 latency, fire the same request at the other one too
+    "hedging": {
+        "enabled": os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true",
+        "percentile": float(os.getenv("LLM_HEDGING_PERCENTILE", "95")),
+        "min_samples": int(os.getenv("LLM_HEDGING_MIN_SAMPLES", "20")),
+        "default_delay_s": float(os.getenv("LLM_HEDGING_DEFAULT_DELAY", "4.0")),
+        "min_delay_s": float(os.getenv("LLM_HEDGING_MIN_DELAY", "0.5")),
+        "max_delay_s": float(os.getenv("LLM_HEDGING_MAX_DELAY", "15.0"))
+    },
+    # Provider health: error rate / latency EWMAs and circuit breaker settings
+    "health": {
+        "ewma_alpha": float(os.getenv("LLM_HEALTH_EWMA_ALPHA", "0.2")),
+        "failure_threshold": int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+        "error_rate_threshold": float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5")),
+        "min_requests": int(os.getenv("LLM_BREAKER_MIN_REQUESTS", "10")),
+        "open_seconds": float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+    },
+    # Admission control in front of get_llm_response (see app/scheduler.py)
+    "scheduler": {
+        "max_concurrent": int(os.getenv("LLM_MAX_CONCURRENT", "32")),
+        "max_active_per_user": int(os.getenv("LLM_MAX_ACTIVE_PER_USER", "4")),
+        "max_queue": int(os.getenv("LLM_MAX_QUEUE", "200")),
+        "max_queue_per_user": int(os.getenv("LLM_MAX_QUEUE_PER_USER", "10")),
+        "queue_timeout_s": float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+    },
+    # Concurrent calls allowed per provider, to stay within its rate limits
+    "provider_concurrency": {
+        "groq": int(os.getenv("LLM_GROQ_MAX_CONCURRENT", "16")),
+        "claude": int(os.getenv("LLM_CLAUDE_MAX_CONCURRENT", "16")),
+        "gemini": int(os.getenv("LLM_GEMINI_MAX_CONCURRENT", "16"))
+    },
+    # Retries of rate limits (429) and transient errors, honouring Retry-After
+    "retry": {
+        "max_attempts": int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "4")),
+        "base_delay_s": float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),
+        "max_delay_s": float(os.getenv("LLM_RETRY_MAX_DELAY", "20")),
+        "max_elapsed_s": float(os.getenv("LLM_RETRY_MAX_ELAPSED", "60"))
+    },
+    # Client-side pacing, keyed "provider" or "provider/model", e.g.
+    # LLM_RATE_LIMITS='{"groq": {"rpm": 30, "tpm": 6000}, "claude/claude-sonnet-4-20250514": {"rpm": 50}}'
+    "rate_limits": json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
 }
 
 GENERAL_SYSTEM_PROMPT = '''You are a helpful research assistant integrated into a text editor. Your goal is to perform a web search and provide a concise, well-structured summary on the given topic. The summary should be written in clear, professional language, suitable for a research paper or report. Do not include conversational filler. Given that today's date is June 22, 2025, focus on the latest developments. Stick to the undergrad level of writing. DO NOT ADD UNNECESSARY DETAILS. ALWAYS GET STRAIGHT TO THE POINT!'''
 
 EDIT_SYSTEM_PROMPT = """You are a document editor. When given a document and an edit request, you should return ONLY the edited document content. Do not include any explanations, comments, or additional text. Just return the modified document."""
 
-# Initialize clients
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-claude_client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+# Provider clients live in a shared registry (pooled, pre-warmed connections)
+# built on first use or by the FastAPI lifespan
+
+# Hedging state shared across requests
+hedge_policy = HedgePolicy(**LLM_CONFIG["hedging"])
+first_token_latency = LatencyTracker()
+
+# Live health of each provider, used for routing and /api/chat/health
+provider_health = ProviderHealthRegistry(**LLM_CONFIG["health"])
+
+# Request-level fair scheduling (used by the chat router) and provider caps
+llm_scheduler = FairScheduler(**LLM_CONFIG["scheduler"])
+provider_limits = ProviderLimiter(LLM_CONFIG["provider_concurrency"])
+
+# Pacing and retries around each provider request
+provider_retry = ProviderRetry(RetryPolicy(**LLM_CONFIG["retry"]), RequestPacer(LLM_CONFIG["rate_limits"]))
 
 # Response models
 class QueryAnalysis(BaseModel):
@@ -43,6 +104,7 @@ class LLMResponse(BaseModel):
     response: str
     used_model: str
     analysis: Optional[QueryAnalysis] = None
+    stats: Optional[Dict[str, Any]] = None  # timings and token counts (see app/llm_stats.py)
 
 # System prompts
 GROQ_ANALYZER_PROMPT = """You are a query complexity analyzer. Your job is to determine if a query is simple/factual or requires complex reasoning.
@@ -86,13 +148,17 @@ def analyze_query_complexity(message: str, conversation_history: Optional[List[D
                 context += f"{msg['role']}: {msg['content']}\n"
             messages.insert(1, {"role": "system", "content": context})
         
-        # Get Groq's analysis
-        completion = groq_client.chat.completions.create(
-            model=LLM_CONFIG["groq"]["analyzer_model"],  # Use configured analyzer model
-            messages=messages,
-            temperature=0.1,
-            max_tokens=200
-        )
+        # Get Groq's analysis, within Groq's concurrency cap and circuit breaker
+        completion = provider_limits.call("groq", lambda: provider_health.call("groq", lambda: provider_retry.call(
+            "groq", LLM_CONFIG["groq"]["analyzer_model"],
+            lambda: llm_clients.groq.chat.completions.create(
+                model=LLM_CONFIG["groq"]["analyzer_model"],  # Use configured analyzer model
+                messages=messages,
+                temperature=0.1,
+                max_tokens=200
+            ),
+            tokens=estimate_tokens(*(msg["content"] for msg in messages))
+        )))
         
         # Parse the JSON response
         analysis_text = completion.choices[0].message.content
@@ -117,7 +183,7 @@ def analyze_query_complexity(message: str, conversation_history: Optional[List[D
 #     suitable for a research paper or report. Do not include conversational filler. 
 #     Given that today's date is June 22, 2025, focus on the latest developments.'''
 #     try:
-#         response = groq_client.chat.completions.create(
+#         response = llm_clients.groq.chat.completions.create(
 #             messages=[
 #                 {"role": "system", "content": system_prompt},
 #                 {"role": "user", "content": message}
@@ -130,7 +196,7 @@ def analyze_query_complexity(message: str, conversation_history: Optional[List[D
 #     except Exception as e:
 #         return f"Error during internet search: {str(e)}"
 
-def get_groq_response(message: str, conversation_history: Optional[List[Dict[str, str]]] = None, stream: bool = False, document_content: Optional[str] = None, edit_mode: bool = False) -> Union[str, Generator[str, None, None]]:
+def get_groq_response(message: str, conversation_history: Optional[List[Dict[str, str]]] = None, stream: bool = False, document_content: Optional[str] = None, edit_mode: bool = False, usage: Optional[Dict[str, int]] = None) -> Union[str, Generator[str, None, None]]:
     """Get response from Groq for simple queries"""
     try:
         # Use different system prompt for edit mode
@@ -154,12 +220,18 @@ def get_groq_response(message: str, conversation_history: Optional[List[Dict[str
         
         messages.append({"role": "user", "content": message})
         
-        completion = groq_client.chat.completions.create(
-            model=LLM_CONFIG["groq"]["responder_model"],  # Use configured responder model
-            messages=messages,
-            temperature=0.7,
-            max_tokens=8000,
-            stream=stream
+        # Paced and retried on rate limits / transient errors (the stream
+        # itself is not retried once it has started)
+        completion = provider_retry.call(
+            "groq", LLM_CONFIG["groq"]["responder_model"],
+            lambda: llm_clients.groq.chat.completions.create(
+                model=LLM_CONFIG["groq"]["responder_model"],  # Use configured responder model
+                messages=messages,
+                temperature=0.7,
+                max_tokens=8000,
+                stream=stream
+            ),
+            tokens=estimate_tokens(*(msg["content"] for msg in messages))
         )
         
         if stream:
@@ -167,19 +239,20 @@ def get_groq_response(message: str, conversation_history: Optional[List[Dict[str
                 for chunk in completion:
                     if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
                         yield chunk.choices[0].delta.content
+                    # Groq reports usage on the final chunk
+                    if usage is not None and chunk.x_groq and chunk.x_groq.usage:
+                        _record_usage(usage, chunk.x_groq.usage.prompt_tokens, chunk.x_groq.usage.completion_tokens)
             return generate()
         else:
+            if usage is not None and completion.usage:
+                _record_usage(usage, completion.usage.prompt_tokens, completion.usage.completion_tokens)
             return completion.choices[0].message.content
         
     except Exception as e:
-        if stream:
-            def error_generator():
-                yield f"Error: {str(e)}"
-            return error_generator()
-        else:
-            raise Exception(f"Groq response error: {str(e)}")
+        # Raise for streams too, so callers can fail over instead of relaying the error as content
+        raise Exception(f"Groq response error: {str(e)}")
 
-def get_claude_response(message: str, conversation_history: Optional[List[Dict[str, str]]] = None, stream: bool = False, document_content: Optional[str] = None, edit_mode: bool = False) -> Union[str, Generator[str, None, None]]:
+def get_claude_response(message: str, conversation_history: Optional[List[Dict[str, str]]] = None, stream: bool = False, document_content: Optional[str] = None, edit_mode: bool = False, usage: Optional[Dict[str, int]] = None) -> Union[str, Generator[str, None, None]]:
     """Get response from Claude for complex queries"""
     try:
         # Prepare messages in Claude format
@@ -207,10 +280,38 @@ def get_claude_response(message: str, conversation_history: Optional[List[Dict[s
                 })
         
         messages.append({"role": "user", "content": message})
+        tokens = estimate_tokens(system_prompt, *(msg["content"] for msg in messages))
         
         if stream:
             def generate():
-                with claude_client.messages.stream(
+                with ExitStack() as stack:
+                    # Opening the stream sends the request; only that is retried
+                    stream = provider_retry.call(
+                        "claude", LLM_CONFIG["claude"]["model"],
+                        lambda: stack.enter_context(llm_clients.claude.messages.stream(
+                            model=LLM_CONFIG["claude"]["model"],  # Use configured Claude model
+                            system=system_prompt,
+                            messages=messages,
+                            max_tokens=32000,
+                            temperature=0.7,
+                            tools=[{
+                                "type": "web_search_20250305",
+                                "name": "web_search",
+                                "max_uses": 5
+                            }]
+                        )),
+                        tokens=tokens
+                    )
+                    for text in stream.text_stream:
+                        yield text
+                    if usage is not None:
+                        final = stream.get_final_message()
+                        _record_usage(usage, final.usage.input_tokens, final.usage.output_tokens)
+            return generate()
+        else:
+            response = provider_retry.call(
+                "claude", LLM_CONFIG["claude"]["model"],
+                lambda: llm_clients.claude.messages.create(
                     model=LLM_CONFIG["claude"]["model"],  # Use configured Claude model
                     system=system_prompt,
                     messages=messages,
@@ -221,38 +322,22 @@ def get_claude_response(message: str, conversation_history: Optional[List[Dict[s
                         "name": "web_search",
                         "max_uses": 5
                     }]
-                ) as stream:
-                    for text in stream.text_stream:
-                        yield text
-            return generate()
-        else:
-            response = claude_client.messages.create(
-                model=LLM_CONFIG["claude"]["model"],  # Use configured Claude model
-                system=system_prompt,
-                messages=messages,
-                max_tokens=32000,
-                temperature=0.7,
-                tools=[{
-                    "type": "web_search_20250305",
-                    "name": "web_search",
-                    "max_uses": 5
-                }]
+                ),
+                tokens=tokens
             )
+            if usage is not None:
+                _record_usage(usage, response.usage.input_tokens, response.usage.output_tokens)
             return response.content[0].text
         
     except Exception as e:
-        if stream:
-            def error_generator():
-                yield f"Error: {str(e)}"
-            return error_generator()
-        else:
-            raise Exception(f"Claude response error: {str(e)}")
+        # Raise for streams too, so callers can fail over instead of relaying the error as content
+        raise Exception(f"Claude response error: {str(e)}")
 
-def get_gemini_response(message: str, conversation_history: Optional[List[Dict[str, str]]] = None, stream: bool = False, document_content: Optional[str] = None, edit_mode: bool = False) -> Union[str, Generator[str, None, None]]:
+def get_gemini_response(message: str, conversation_history: Optional[List[Dict[str, str]]] = None, stream: bool = False, document_content: Optional[str] = None, edit_mode: bool = False, usage: Optional[Dict[str, int]] = None) -> Union[str, Generator[str, None, None]]:
     """Get response from Gemini for complex queries"""
     try:
-        # Initialize Gemini model
-        model = genai.GenerativeModel(LLM_CONFIG["gemini"]["model"])
+        # Reuse the shared Gemini model (and its channel)
+        model = llm_clients.gemini_model(LLM_CONFIG["gemini"]["model"])
         
         # Prepare context
         full_prompt = ""
@@ -272,24 +357,89 @@ def get_gemini_response(message: str, conversation_history: Optional[List[Dict[s
         
         full_prompt += f"USER: {message}\nASSISTANT:"
         
+        model_name = LLM_CONFIG["gemini"]["model"]
+        tokens = estimate_tokens(full_prompt)
+        
         if stream:
             def generate():
-                response = model.generate_content(full_prompt, stream=True)
+                response = provider_retry.call(
+                    "gemini", model_name,
+                    lambda: model.generate_content(full_prompt, stream=True),
+                    tokens=tokens
+                )
                 for chunk in response:
                     if chunk.text:
                         yield chunk.text
+                if usage is not None:
+                    _record_gemini_usage(usage, response)
             return generate()
         else:
-            response = model.generate_content(full_prompt)
+            response = provider_retry.call(
+                "gemini", model_name,
+                lambda: model.generate_content(full_prompt),
+                tokens=tokens
+            )
+            if usage is not None:
+                _record_gemini_usage(usage, response)
             return response.text
         
     except Exception as e:
+        # Raise for streams too, so callers can fail over instead of relaying the error as content
+        raise Exception(f"Gemini response error: {str(e)}")
+
+def _record_usage(usage: Dict[str, int], input_tokens: Optional[int], output_tokens: Optional[int]) -> None:
+    if input_tokens:
+        usage["input_tokens"] = input_tokens
+    if output_tokens:
+        usage["output_tokens"] = output_tokens
+
+def _record_gemini_usage(usage: Dict[str, int], response: Any) -> None:
+    # usage_metadata is only returned by newer versions of the Gemini SDK
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is not None:
+        _record_usage(usage, metadata.prompt_token_count, metadata.candidates_token_count)
+
+# Providers, keyed by the model name reported to clients
+PROVIDERS = {
+    "groq": get_groq_response,
+    "claude": get_claude_response,
+    "gemini": get_gemini_response
+}
+
+def _complex_model_order(preferred_complex_model: str) -> List[str]:
+    """Preferred complex model first, followed by its alternate"""
+    if preferred_complex_model == "gemini":
+        return ["gemini", "claude"]
+    return ["claude", "gemini"]
+
+def _route_order(use_simple_model: bool, preferred_complex_model: str) -> List[str]:
+    """
+    Providers to try in order: Groq for simple queries, then the preferred
+    complex model and its alternate. Providers with an open circuit are skipped.
+    """
+    order = _complex_model_order(preferred_complex_model)
+    if use_simple_model:
+        order = ["groq"] + order
+    return provider_health.available(order)
+
+def _candidates(order: List[str], stream: bool, stats: RequestStats, **kwargs) -> List[tuple]:
+    """
+    (provider, factory) pairs for hedged_call/failover_call. Each factory runs
+    the provider within its concurrency cap and circuit breaker and records
+    first-chunk latency; non-streaming responses are wrapped as a single chunk.
+    """
+    def factory(name: str):
+        usage = stats.usage_for(name)
         if stream:
-            def error_generator():
-                yield f"Error: {str(e)}"
-            return error_generator()
+            call = partial(PROVIDERS[name], stream=True, usage=usage, **kwargs)
+            key = name
         else:
-            raise Exception(f"Gemini response error: {str(e)}")
+            call = lambda: [PROVIDERS[name](usage=usage, **kwargs)]
+            key = name + ":complete"
+        return lambda: traced_iterator(f"llm.{name}", first_token_latency.observe_stream(
+            key, provider_limits.limited(name, lambda: provider_health.monitored(name, call))
+        ), stream=stream)
+    return [(name, factory(name)) for name in order]
 
 def get_llm_response(
     message: str, 
@@ -297,11 +447,15 @@ def get_llm_response(
     preferred_complex_model: str = "claude",  # "claude" or "gemini"
     stream: bool = False,
     document_content: Optional[str] = None,
-    edit_mode: bool = False
+    edit_mode: bool = False,
+    hedge: Optional[bool] = None,  # None follows LLM_CONFIG["hedging"]
+    include_stats: bool = False  # stream a final "stats" event
 ) -> Union[LLMResponse, Generator[Dict[str, Any], None, None]]:
     """
     Main function to get LLM response with intelligent routing
     """
+    use_hedging = hedge_policy.enabled if hedge is None else hedge
+    stats = RequestStats(stream=stream)
     try:
         # Step 1: Analyze query complexity with Groq (skip for edit mode)
         if edit_mode:
@@ -311,8 +465,29 @@ def get_llm_response(
                 reason="Edit mode requires complex model for accurate document generation",
                 confidence=10
             )
+            route = "edit"
         else:
-            analysis = analyze_query_complexity(message, conversation_history)
+            analyzer_started = time.perf_counter()
+            with span("llm.analyzer") as analyzer_span:
+                analysis = analyze_query_complexity(message, conversation_history)
+                if analyzer_span is not None:
+                    analyzer_span.set(use_simple_model=analysis.use_simple_model, confidence=analysis.confidence)
+            route = "simple" if analysis.use_simple_model else "complex"
+            stats.analyzed(time.perf_counter() - analyzer_started,
+                           "error" if analysis.reason.startswith("Error during analysis") else route)
+        
+        stats.routing(route, estimate_tokens(
+            message, document_content, *(msg["content"] for msg in conversation_history or [])
+        ))
+        order = _route_order(analysis.use_simple_model, preferred_complex_model)
+        # Hedging only applies between the complex models, and needs two of them
+        hedging = use_hedging and not analysis.use_simple_model and len(order) > 1
+        request = dict(
+            message=message,
+            conversation_history=conversation_history,
+            document_content=document_content,
+            edit_mode=edit_mode
+        )
         
         if stream:
             def generate():
@@ -326,72 +501,56 @@ def get_llm_response(
                     }
                 }
                 
-                # Then stream the response
-                if analysis.use_simple_model:
-                    # Simple query - use Groq
-                    response_generator = get_groq_response(message, conversation_history, stream=True, document_content=document_content, edit_mode=edit_mode)
-                    model = "groq"
-                else:
-                    # Complex query - use Claude or Gemini
-                    if preferred_complex_model == "gemini":
-                        try:
-                            response_generator = get_gemini_response(message, conversation_history, stream=True, document_content=document_content, edit_mode=edit_mode)
-                            model = "gemini"
-                        except Exception:
-                            # Fallback to Claude if Gemini fails
-                            response_generator = get_claude_response(message, conversation_history, stream=True, document_content=document_content, edit_mode=edit_mode)
-                            model = "claude"
+                # Then stream the response, failing over to the next provider
+                # if one errors before its first token
+                model = "error"
+                response_generator = None
+                try:
+                    candidates = _candidates(order, stream=True, stats=stats, **request)
+                    if hedging:
+                        model, response_generator = hedged_call(candidates, hedge_policy, first_token_latency)
                     else:
-                        try:
-                            response_generator = get_claude_response(message, conversation_history, stream=True, document_content=document_content, edit_mode=edit_mode)
-                            model = "claude"
-                        except Exception:
-                            # Fallback to Gemini if Claude fails
-                            response_generator = get_gemini_response(message, conversation_history, stream=True, document_content=document_content, edit_mode=edit_mode)
-                            model = "gemini"
-                
-                yield {"type": "model", "model": model}
-                
-                # Stream content chunks
-                for chunk in response_generator:
-                    yield {"type": "content", "content": chunk}
+                        model, response_generator = failover_call(candidates)
+                    
+                    yield {"type": "model", "model": model}
+                    
+                    # Stream content chunks
+                    for chunk in stats.observe_chunks(response_generator):
+                        yield {"type": "content", "content": chunk}
+                except BaseException:
+                    stats.finish(model, outcome="error")
+                    # Stopped early (client gone, fanout closed): release the
+                    # provider stream rather than leaving it to be drained
+                    close = getattr(response_generator, "close", None)
+                    if close is not None:
+                        close()
+                    raise
                 
+                request_stats = stats.finish(model)
+                if include_stats:
+                    yield {"type": "stats", "stats": request_stats}
                 yield {"type": "done"}
             
             return generate()
         else:
             # Step 2: Route to appropriate model
-            if analysis.use_simple_model:
-                # Simple query - use Groq
-                response = get_groq_response(message, conversation_history, document_content=document_content, edit_mode=edit_mode)
-                model = "groq"
+            candidates = _candidates(order, stream=False, stats=stats, **request)
+            if hedging:
+                model, responses = hedged_call(candidates, hedge_policy, first_token_latency, key_suffix=":complete")
             else:
-                # Complex query - use Claude or Gemini
-                if preferred_complex_model == "gemini":
-                    try:
-                        response = get_gemini_response(message, conversation_history, document_content=document_content, edit_mode=edit_mode)
-                        model = "gemini"
-                    except Exception as e:
-                        # Fallback to Claude if Gemini fails
-                        response = get_claude_response(message, conversation_history, document_content=document_content, edit_mode=edit_mode)
-                        model = "claude"
-                else:
-                    try:
-                        response = get_claude_response(message, conversation_history, document_content=document_content, edit_mode=edit_mode)
-                        model = "claude"
-                    except Exception as e:
-                        # Fallback to Gemini if Claude fails
-                        response = get_gemini_response(message, conversation_history, document_content=document_content, edit_mode=edit_mode)
-                        model = "gemini"
+                model, responses = failover_call(candidates)
+            response = "".join(stats.observe_chunks(responses))
             
             return LLMResponse(
                 response=response,
                 used_model=model,
-                analysis=analysis
+                analysis=analysis,
+                stats=stats.finish(model)
             )
         
     except Exception as e:
         if stream:
+            stats.finish("error", outcome="error")
             def error_generator():
                 yield {"type": "error", "error": str(e)}
             return error_generator()
@@ -400,7 +559,8 @@ def get_llm_response(
             return LLMResponse(
                 response=f"I apologize, but I encountered an error processing your request: {str(e)}",
                 used_model="error",
-                analysis=None
+                analysis=None,
+                stats=stats.finish("error", outcome="error")
             )
 
 # Helper function to validate API keys
@@ -0,0 +1,229 @@
+# Shared, pre-warmed LLM provider clients
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+# The provider SDKs (and httpx) take a large share of the app's import time,
+# so they are imported when a client is first built, not with this module
+if TYPE_CHECKING:
+    import anthropic
+    import google.generativeai as genai
+    import httpx
+    from groq import Groq
+
+load_dotenv()
+
+# h2 enables HTTP/2 in httpx
+HTTP2_AVAILABLE = find_spec("h2") is not None
+
+def _setting(provider: str, key: str, default: str) -> str:
+    """Read LLM_<PROVIDER>_<KEY>, falling back to LLM_<KEY> and then the default"""
+    return os.getenv(f"LLM_{provider.upper()}_{key}", os.getenv(f"LLM_{key}", default))
+
+def _transport_config(provider: str) -> Dict[str, Any]:
+    return {
+        "max_connections": int(_setting(provider, "MAX_CONNECTIONS", "20")),
+        "max_keepalive_connections": int(_setting(provider, "MAX_KEEPALIVE", "10")),
+        "keepalive_expiry": float(_setting(provider, "KEEPALIVE_EXPIRY", "300")),
+        "connect_timeout": float(_setting(provider, "CONNECT_TIMEOUT", "5")),
+        "read_timeout": float(_setting(provider, "READ_TIMEOUT", "120")),
+        "http2": _setting(provider, "HTTP2", "true").lower() == "true",
+        "warm_connections": int(_setting(provider, "WARM_CONNECTIONS", "2")),
+        # Override to target a local stub (see llm_stub.py) instead of the real API
+        "base_url": _setting(provider, "BASE_URL", "") or None
+    }
+
+# Transport settings per provider (Gemini's SDK manages its own gRPC channel)
+CLIENT_CONFIG = {
+    "groq": _transport_config("groq"),
+    "claude": _transport_config("claude"),
+    "gemini": {
+        "warm_connections": int(_setting("gemini", "WARM_CONNECTIONS", "1")),
+        # A base URL switches the SDK to its REST transport, pointed there
+        "base_url": _setting("gemini", "BASE_URL", "") or None
+    },
+    "warm_on_startup": os.getenv("LLM_WARM_ON_STARTUP", "true").lower() == "true",
+    # Re-warm idle pools this often so connections never expire (0 disables)
+    "keep_warm_interval_s": float(os.getenv("LLM_KEEP_WARM_INTERVAL", "60"))
+}
+
+class ProviderClientRegistry:
+    """
+    Owns one client per provider for the life of the process, each on a tuned
+    httpx connection pool. Clients (and their SDKs) are loaded on first use,
+    or eagerly by start() from the FastAPI lifespan, which also pre-warms
+    their connections.
+    """
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self._lock = threading.Lock()
+        self._http_clients: Dict[str, "httpx.Client"] = {}
+        self._groq: Optional["Groq"] = None
+        self._claude: Optional["anthropic.Anthropic"] = None
+        self._gemini_configured = False
+        self._gemini_models: Dict[str, "genai.GenerativeModel"] = {}
+        self._keep_warm_task: Optional[asyncio.Task] = None
+
+    def _http_client(self, provider: str) -> "httpx.Client":
+        import httpx
+
+        settings = self.config[provider]
+        client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=settings["max_connections"],
+                max_keepalive_connections=settings["max_keepalive_connections"],
+                keepalive_expiry=settings["keepalive_expiry"]
+            ),
+            timeout=self._timeout(provider),
+            http2=settings["http2"] and HTTP2_AVAILABLE,
+            follow_redirects=True
+        )
+        self._http_clients[provider] = client
+        return client
+
+    def _timeout(self, provider: str) -> "httpx.Timeout":
+        import httpx
+
+        settings = self.config[provider]
+        return httpx.Timeout(settings["read_timeout"], connect=settings["connect_timeout"])
+
+    @property
+    def groq(self) -> "Groq":
+        with self._lock:
+            if self._groq is None:
+                from groq import Groq
+
+                self._groq = Groq(
+                    api_key=os.getenv("GROQ_API_KEY"),
+                    base_url=self.config["groq"]["base_url"],
+                    timeout=self._timeout("groq"),
+                    max_retries=0,  # retried (and paced) by app.retry instead
+                    http_client=self._http_client("groq")
+                )
+            return self._groq
+
+    @property
+    def claude(self) -> "anthropic.Anthropic":
+        with self._lock:
+            if self._claude is None:
+                import anthropic
+
+                self._claude = anthropic.Anthropic(
+                    api_key=os.getenv("ANTHROPIC_API_KEY"),
+                    base_url=self.config["claude"]["base_url"],
+                    timeout=self._timeout("claude"),
+                    max_retries=0,  # retried (and paced) by app.retry instead
+                    http_client=self._http_client("claude")
+                )
+            return self._claude
+
+    def gemini_model(self, model_name: str) -> "genai.GenerativeModel":
+        """Cached GenerativeModel, so every call reuses the same gRPC channel"""
+        import google.generativeai as genai
+
+        with self._lock:
+            if not self._gemini_configured:
+                base_url = self.config["gemini"]["base_url"]
+                if base_url:
+                    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"), transport="rest",
+                                    client_options={"api_endpoint": base_url})
+                else:
+                    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+                self._gemini_configured = True
+            model = self._gemini_models.get(model_name)
+            if model is None:
+                model = self._gemini_models[model_name] = genai.GenerativeModel(model_name)
+            return model
+
+    def warm_up(self, gemini_model: Optional[str] = None) -> Dict[str, bool]:
+        """
+        Open connections ahead of the first real request so it does not pay
+        for DNS, TCP and TLS setup. Returns which providers warmed successfully;
+        failures are reported but never fatal.
+        """
+        jobs = []
+        if os.getenv("GROQ_API_KEY"):
+            jobs += [("groq", self._warm_http, "groq", self.groq.base_url)] * self.config["groq"]["warm_connections"]
+        if os.getenv("ANTHROPIC_API_KEY"):
+            jobs += [("claude", self._warm_http, "claude", self.claude.base_url)] * self.config["claude"]["warm_connections"]
+        if os.getenv("GOOGLE_API_KEY") and gemini_model:
+            jobs += [("gemini", self._warm_gemini, gemini_model, None)] * self.config["gemini"]["warm_connections"]
+        if not jobs:
+            return {}
+
+        results: Dict[str, bool] = {}
+        # Concurrent requests so each warm connection is a distinct pooled socket
+        with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="llm-warm") as pool:
+            futures = [(name, pool.submit(fn, arg, extra)) for name, fn, arg, extra in jobs]
+            for name, future in futures:
+                try:
+                    future.result()
+                    results[name] = results.get(name, True)
+                except Exception as e:
+                    print(f"Warning: Could not warm {name} connection: {e}")
+                    results[name] = False
+        return results
+
+    def _warm_http(self, provider: str, base_url: Any) -> None:
+        # Any response will do; the point is the pooled keep-alive connection
+        self._http_clients[provider].head(str(base_url))
+
+    def _warm_gemini(self, model_name: str, _: Any) -> None:
+        import google.generativeai as genai
+
+        self.gemini_model(model_name)
+        genai.get_model(f"models/{model_name}")
+
+    async def start(self, gemini_model: Optional[str] = None) -> None:
+        """Start loading and pre-warming the clients; called from the FastAPI lifespan"""
+        if not self.config["warm_on_startup"]:
+            return
+        # In the background, so startup does not wait for the SDK imports and
+        # handshakes: document and diff requests are served meanwhile, and a
+        # chat request arriving first builds the client it needs itself
+        self._keep_warm_task = asyncio.create_task(self._keep_warm(self.config["keep_warm_interval_s"], gemini_model))
+
+    async def _keep_warm(self, interval: float, gemini_model: Optional[str]) -> None:
+        # Touch the pools more often than keepalive_expiry so idle periods
+        # never leave the next request to pay for a fresh handshake
+        first = True
+        while True:
+            try:
+                results = await asyncio.to_thread(self.warm_up, gemini_model)
+                if first and results:
+                    print(f"LLM connections warmed: {results}")
+            except Exception as e:
+                print(f"Warning: LLM keep-warm failed: {e}")
+            first = False
+            if interval <= 0:
+                return
+            await asyncio.sleep(interval)
+
+    async def stop(self) -> None:
+        """Stop re-warming and close connections; called from the FastAPI lifespan"""
+        if self._keep_warm_task is not None:
+            self._keep_warm_task.cancel()
+            try:
+                await self._keep_warm_task
+            except asyncio.CancelledError:
+                pass
+            self._keep_warm_task = None
+        await asyncio.to_thread(self.close)
+
+    def close(self) -> None:
+        """Close all pooled connections"""
+        with self._lock:
+            for client in self._http_clients.values():
+                client.close()
+            self._http_clients.clear()
+            self._groq = None
+            self._claude = None
+            self._gemini_models.clear()
+
+# Shared registry used by app.llm
+llm_clients = ProviderClientRegistry(CLIENT_CONFIG)
@@ -0,0 +1,139 @@
+# Per-request LLM latency and token instrumentation
+import time
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from app.metrics import metrics
+
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+RATE_BUCKETS = (5, 10, 25, 50, 100, 200, 400, 800, 1600)
+
+analyzer_seconds = metrics.histogram(
+    "llm_analyzer_seconds",
+    "Time spent in the Groq query complexity analyzer",
+    ["outcome"]
+)
+routing_total = metrics.counter(
+    "llm_routing_decisions_total",
+    "Routing decisions, by route taken and the model that answered",
+    ["route", "model"]
+)
+time_to_first_token_seconds = metrics.histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from routing to the first streamed chunk, including failover",
+    ["model"]
+)
+request_seconds = metrics.histogram(
+    "llm_request_seconds",
+    "Total time of an LLM request, analyzer included",
+    ["model", "stream", "outcome"],
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+)
+input_tokens = metrics.histogram(
+    "llm_input_tokens",
+    "Input tokens per LLM request",
+    ["model"],
+    buckets=TOKEN_BUCKETS
+)
+output_tokens = metrics.histogram(
+    "llm_output_tokens",
+    "Output tokens per LLM request",
+    ["model"],
+    buckets=TOKEN_BUCKETS
+)
+output_tokens_per_second = metrics.histogram(
+    "llm_output_tokens_per_second",
+    "Generation throughput, output tokens over time after the first token",
+    ["model"],
+    buckets=RATE_BUCKETS
+)
+
+class RequestStats:
+    """
+    Timings and token counts of one get_llm_response call. Provider calls
+    fill `usage[provider]` with what the API reports; counts the provider
+    does not report are estimated from the text.
+    """
+    def __init__(self, stream: bool):
+        self.stream = stream
+        self.started = time.perf_counter()
+        self.analyzer_s: Optional[float] = None
+        self.route: Optional[str] = None
+        self.model: Optional[str] = None
+        self.routed_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.usage: Dict[str, Dict[str, int]] = {}
+        self.output_chars = 0
+        self.input_estimate = 0
+
+    def analyzed(self, seconds: float, outcome: str) -> None:
+        self.analyzer_s = seconds
+        analyzer_seconds.observe(seconds, outcome=outcome)
+
+    def routing(self, route: str, input_estimate: int) -> None:
+        self.route = route
+        self.input_estimate = input_estimate
+        self.routed_at = time.perf_counter()
+
+    def usage_for(self, provider: str) -> Dict[str, int]:
+        return self.usage.setdefault(provider, {})
+
+    def observe_chunks(self, chunks: Iterable[str]) -> Iterator[str]:
+        """Pass chunks through, noting the first one and the output length"""
+        for chunk in chunks:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.output_chars += len(chunk)
+            yield chunk
+
+    def tokens(self) -> Dict[str, Any]:
+        usage = self.usage.get(self.model or "", {})
+        return {
+            "input": usage.get("input_tokens") or self.input_estimate,
+            "output": usage.get("output_tokens") or max(1, self.output_chars // 4),
+            "estimated": not usage.get("output_tokens")
+        }
+
+    def finish(self, model: str, outcome: str = "ok") -> Dict[str, Any]:
+        """Record the request in the metrics and return its stats"""
+        self.model = model
+        self.finished_at = time.perf_counter()
+        stats = self.to_dict()
+        labels = {"model": model}
+        routing_total.inc(route=self.route or "none", model=model)
+        request_seconds.observe(stats["total_s"], stream=str(self.stream).lower(), outcome=outcome, **labels)
+        if outcome == "ok":
+            if stats["ttft_s"] is not None:
+                time_to_first_token_seconds.observe(stats["ttft_s"], **labels)
+            input_tokens.observe(stats["input_tokens"], **labels)
+            output_tokens.observe(stats["output_tokens"], **labels)
+            if stats["tokens_per_s"] is not None:
+                output_tokens_per_second.observe(stats["tokens_per_s"], **labels)
+        return stats
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.perf_counter()
+        tokens = self.tokens()
+        ttft = None
+        if self.stream and self.first_token_at is not None and self.routed_at is not None:
+            ttft = self.first_token_at - self.routed_at
+        # Throughput over the generation phase: after the first token for
+        # streams, the whole provider call otherwise
+        generation_start = self.first_token_at if self.stream else self.routed_at
+        tokens_per_s = None
+        if generation_start is not None and end - generation_start > 0 and self.output_chars:
+            tokens_per_s = tokens["output"] / (end - generation_start)
+        return {
+            "model": self.model,
+            "route": self.route,
+            "analyzer_s": _round(self.analyzer_s),
+            "ttft_s": _round(ttft),
+            "total_s": _round(end - self.started),
+            "input_tokens": tokens["input"],
+            "output_tokens": tokens["output"],
+            "tokens_estimated": tokens["estimated"],
+            "tokens_per_s": _round(tokens_per_s, 1)
+        }
+
+def _round(value: Optional[float], digits: int = 4) -> Optional[float]:
+    return None if value is None else round(value, digits)
@@ -0,0 +1,111 @@
+# Event-loop lag monitoring with a watchdog that reports what is blocking
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+from app.metrics import metrics
+
+LOOP_MONITOR_CONFIG = {
+    "enabled": os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true",
+    # Heartbeat period of the loop, and the stall length that triggers a stack dump
+    "interval_s": float(os.getenv("LOOP_MONITOR_INTERVAL", "0.05")),
+    "threshold_ms": float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100")),
+    # Stall reports kept for /debug/loop
+    "history": int(os.getenv("LOOP_MONITOR_HISTORY", "20"))
+}
+
+loop_lag_seconds = metrics.histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a scheduled heartbeat",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+loop_stalls_total = metrics.counter(
+    "event_loop_stalls_total",
+    "Times the event loop was blocked for longer than the threshold"
+)
+
+class LoopMonitor:
+    """
+    A heartbeat task on the event loop plus a watchdog thread. The task
+    records how late each heartbeat runs; the watchdog notices when no
+    heartbeat has run for `threshold_ms` and logs the loop thread's stack at
+    that moment, i.e. the code that is blocking it.
+    """
+    def __init__(self, interval_s: float = 0.05, threshold_ms: float = 100.0, history: int = 20):
+        self.interval_s = interval_s
+        self.threshold_s = threshold_ms / 1000.0
+        self.history = history
+        self.stalls: List[Dict[str, Any]] = []
+        self.max_lag_s = 0.0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval_s
+            await asyncio.sleep(self.interval_s)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._last_beat = now
+            self.max_lag_s = max(self.max_lag_s, lag)
+            loop_lag_seconds.observe(lag)
+
+    def _watch(self) -> None:
+        reported_beat = None
+        while not self._stopping.wait(self.interval_s / 2):
+            last_beat = self._last_beat
+            blocked_for = time.monotonic() - last_beat - self.interval_s
+            # One report per stall: wait for a new heartbeat before reporting again
+            if blocked_for < self.threshold_s or last_beat == reported_beat:
+                continue
+            reported_beat = last_beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>"
+            loop_stalls_total.inc()
+            self.stalls.append({
+                "at": time.time(),
+                "blocked_ms": round(blocked_for * 1000, 1),
+                "stack": stack
+            })
+            del self.stalls[:-self.history]
+            print(f"Warning: Event loop blocked for {blocked_for * 1000:.0f}ms, currently in:\n{stack}")
+
+    def start(self) -> None:
+        """Start monitoring the running loop; called from the FastAPI lifespan"""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": self.threshold_s * 1000,
+            "max_lag_ms": round(self.max_lag_s * 1000, 1),
+            "stalls": int(loop_stalls_total.value()),
+            "recent_stalls": self.stalls[-5:]
+        }
+
+loop_monitor = LoopMonitor(
+    interval_s=LOOP_MONITOR_CONFIG["interval_s"],
+    threshold_ms=LOOP_MONITOR_CONFIG["threshold_ms"],
+    history=LOOP_MONITOR_CONFIG["history"]
+)
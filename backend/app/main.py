@@ -1,15 +1,36 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pymongo.errors import PyMongoError
 from contextlib import asynccontextmanager
-from app.routers import chat, diff, documents, images
-from app.database import create_indexes
+from app.routers import chat, debug, diff, documents, images
+from app.database import create_indexes, storage
+from app.llm import LLM_CONFIG
+from app.llm_clients import llm_clients
+from app.metrics import metrics
+from app.tracing import TracingMiddleware
+from app.loop_monitor import LOOP_MONITOR_CONFIG, loop_monitor
+from app.profiling import ProfilingMiddleware
+from app.autosave import autosave_buffer
+from app.chat_writer import chat_writer
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
+    # Startup: connect (and fail startup if the database does not answer)
+    await storage.connect()
     await create_indexes()
+    await llm_clients.start(gemini_model=LLM_CONFIG["gemini"]["model"])
+    if LOOP_MONITOR_CONFIG["enabled"]:
+        loop_monitor.start()
+    autosave_buffer.start()
+    chat_writer.start()
     yield
-    # Shutdown
+    # Shutdown: write out buffered autosaves and chat messages before anything else stops
+    await autosave_buffer.stop()
+    await chat_writer.stop()
+    await loop_monitor.stop()
+    await llm_clients.stop()
+    storage.close()
 
 app = FastAPI(title="Writing Tool API", version="1.0.0", lifespan=lifespan)
 
@@ -20,13 +41,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "traceparent", "X-Profile-Id"],
 )
 
+# Per-request spans, Server-Timing header and trace export (see app/tracing.py)
+app.add_middleware(TracingMiddleware)
+# Opt-in cProfile of single requests (X-Profile admin header, see app/profiling.py)
+app.add_middleware(ProfilingMiddleware)
+
+@app.exception_handler(PyMongoError)
+async def database_error_handler(request: Request, exc: PyMongoError):
+    """A database operation that ran out of its budget is a 503, not a hang"""
+    if exc.timeout:
+        return JSONResponse(status_code=503, content={"detail": "Database did not respond in time"},
+                            headers={"Retry-After": "1"})
+    return JSONResponse(status_code=500, content={"detail": "Database error"})
+
 # Include routers
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 app.include_router(documents.router, prefix="/api/documents", tags=["documents"])
 app.include_router(diff.router, prefix="/api/diff", tags=["diff"])
 app.include_router(images.router, prefix="/api/images", tags=["images"])
+app.include_router(debug.router, prefix="/debug", tags=["debug"], include_in_schema=False)
 
 @app.get("/")
 async def root():
@@ -34,4 +70,9 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"} 
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus-style metrics for this worker"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional, List, Annotated
+from typing import Optional, List, Annotated, Literal
 from datetime import datetime
 from uuid import uuid4
 
@@ -39,6 +39,10 @@ class Document(BaseModel):
     user_id: str
     title: str
     content: str = ""
+    version: int = 0  # incremented on every save
+    # Maintained on write for listings, which do not load content
+    snippet: str = ""
+    word_count: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -55,7 +59,8 @@ class ChatHistory(BaseModel):
     
     id: Optional[str] = Field(alias="_id", default_factory=lambda: str(uuid4()))
     document_id: str
-    messages: List[ChatMessage] = []
+    # Messages are stored in buckets (app.chat_store); this counts them
+    message_count: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -73,5 +78,78 @@ class DocumentResponse(BaseModel):
     user_id: str
     title: str
     content: str
+    version: int = 0
     created_at: datetime
-    updated_at: datetime 
\ No newline at end of file
+    updated_at: datetime
+
+class DocumentListItem(BaseModel):
+    id: str
+    title: str
+    snippet: str = ""
+    word_count: int = 0
+    version: int = 0
+    created_at: datetime
+    updated_at: datetime
+
+class DocumentListResponse(BaseModel):
+    documents: List[DocumentListItem]
+    next_cursor: Optional[str] = None  # pass as `cursor` for the next page
+
+class SearchHit(BaseModel):
+    type: Literal["document", "chat"]
+    document_id: str
+    title: str
+    score: float
+    snippet: str
+    highlights: List[List[int]]  # [start, end) offsets of matches within snippet
+    seq: Optional[int] = None  # chat hits: the message's sequence number
+    role: Optional[str] = None
+
+class SearchResponse(BaseModel):
+    query: str
+    total: int
+    hits: List[SearchHit]
+    next_offset: Optional[int] = None  # pass as `offset` for the next page
+
+class ContentChange(BaseModel):
+    """A ranged edit, in the shape of diff.Change.to_dict()"""
+    type: Literal["insert", "delete", "replace"]
+    start_pos: int = Field(ge=0)
+    end_pos: int = Field(ge=0)
+    old_text: Optional[str] = None  # checked against the document when given
+    new_text: Optional[str] = None
+    line_number: Optional[int] = None
+    word_index: Optional[int] = None
+
+class DocumentPatch(BaseModel):
+    base_version: int  # version the changes were computed against
+    changes: List[ContentChange]
+
+class DocumentPatchResponse(BaseModel):
+    id: str
+    version: int
+    updated_at: datetime
+
+class RevisionSummary(BaseModel):
+    version: int
+    created_at: datetime
+    size: int  # characters of content
+    stored_bytes: int  # what the revision takes in the revisions collection
+    snapshot: bool  # stored in full rather than as a delta
+
+class RevisionListResponse(BaseModel):
+    document_id: str
+    revisions: List[RevisionSummary]
+
+class RevisionResponse(BaseModel):
+    document_id: str
+    version: int
+    created_at: datetime
+    size: int
+    content: str
+
+class RevisionDiffResponse(BaseModel):
+    document_id: str
+    from_version: int
+    to_version: int
+    changes: List[dict]
@@ -0,0 +1,141 @@
+# On-demand per-request profiling, triggered by an admin-only header
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from fastapi import HTTPException, Request
+
+PROFILING_CONFIG = {
+    # Profiling is off unless a token is set; requests opt in with "X-Profile: <token>"
+    "admin_token": os.getenv("PROFILE_ADMIN_TOKEN", ""),
+    "dir": os.getenv("PROFILE_DIR", "profiles"),
+    "sample_interval_s": float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000.0
+}
+
+PROFILE_FORMATS = {
+    "pstats": (".prof", "application/octet-stream"),   # snakeviz, gprof2dot, pstats
+    "folded": (".folded", "text/plain"),               # flamegraph.pl, speedscope
+    "text": (".txt", "text/plain")                     # top functions by cumulative time
+}
+
+# One profile at a time: cProfile cannot nest, and the profile covers the
+# whole event loop thread, so concurrent ones would measure each other
+_profile_lock = threading.Lock()
+
+def is_admin(token: Optional[str]) -> bool:
+    configured = PROFILING_CONFIG["admin_token"]
+    return bool(configured) and token is not None and secrets.compare_digest(token, configured)
+
+def require_admin(request: Request) -> None:
+    """Dependency for admin-only debug endpoints"""
+    if not is_admin(request.headers.get("x-profile")):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+class StackSampler:
+    """Samples one thread's stack at a fixed interval into folded (flamegraph) stacks"""
+    def __init__(self, thread_id: int, interval_s: float):
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.stacks: Counter = Counter()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+def _save(profile_id: str, profiler: cProfile.Profile, sampler: StackSampler, target: str, elapsed: float) -> None:
+    os.makedirs(PROFILING_CONFIG["dir"], exist_ok=True)
+    base = os.path.join(PROFILING_CONFIG["dir"], profile_id)
+    profiler.dump_stats(base + ".prof")
+    with open(base + ".folded", "w") as f:
+        f.write(sampler.folded())
+    summary = io.StringIO()
+    summary.write(f"{target} took {elapsed * 1000:.1f}ms\n\n")
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(40)
+    with open(base + ".txt", "w") as f:
+        f.write(summary.getvalue())
+
+def profile_path(profile_id: str, fmt: str) -> str:
+    if fmt not in PROFILE_FORMATS or not profile_id.isalnum():
+        raise HTTPException(status_code=400, detail="Invalid profile ID or format")
+    path = os.path.join(PROFILING_CONFIG["dir"], profile_id + PROFILE_FORMATS[fmt][0])
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return path
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles a request sent with the admin header
+    "X-Profile: <PROFILE_ADMIN_TOKEN>". The event loop thread is profiled with
+    cProfile and a stack sampler until the response body is complete, and
+    the dumps are stored under PROFILE_DIR. The response carries an
+    X-Profile-Id header for fetching them from /debug/profiles/{id}.
+    Note the profile includes anything else the loop ran meanwhile.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILING_CONFIG["admin_token"]:
+            await self.app(scope, receive, send)
+            return
+        token = next((value.decode("latin-1") for key, value in scope.get("headers", []) if key == b"x-profile"), None)
+        if not is_admin(token) or scope["path"].startswith("/debug/"):
+            await self.app(scope, receive, send)
+            return
+        if not _profile_lock.acquire(blocking=False):
+            await self.app(scope, receive, self._with_headers(send, [(b"x-profile-status", b"busy")]))
+            return
+
+        profile_id = secrets.token_hex(8)
+        profiler = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident(), PROFILING_CONFIG["sample_interval_s"])
+        started = time.perf_counter()
+        try:
+            sampler.start()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, self._with_headers(send, [(b"x-profile-id", profile_id.encode())]))
+            finally:
+                profiler.disable()
+                sampler.stop()
+            elapsed = time.perf_counter() - started
+            target = f"{scope['method']} {scope['path']}"
+            await asyncio.to_thread(_save, profile_id, profiler, sampler, target, elapsed)
+            print(f"Saved profile {profile_id} for {target} ({elapsed * 1000:.0f}ms)")
+        finally:
+            _profile_lock.release()
+
+    @staticmethod
+    def _with_headers(send, headers):
+        async def wrapped(message: Dict) -> None:
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + headers}
+            await send(message)
+        return wrapped
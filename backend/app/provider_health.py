@@ -0,0 +1,226 @@
+# Per-provider health tracking, circuit breaking and failover
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+class CircuitOpenError(Exception):
+    """Raised when a provider is skipped because its circuit breaker is open"""
+
+class ProviderHealth:
+    """
+    Error rate and latency EWMAs for one provider plus a circuit breaker.
+
+    The breaker opens after `failure_threshold` consecutive failures, or when
+    the error rate EWMA passes `error_rate_threshold` once `min_requests` have
+    been seen. After `open_seconds` it lets a single probe through
+    (half-open); the probe's outcome closes or re-opens it.
+    """
+    def __init__(self,
+                 name: str,
+                 ewma_alpha: float = 0.2,
+                 failure_threshold: int = 5,
+                 error_rate_threshold: float = 0.5,
+                 min_requests: int = 10,
+                 open_seconds: float = 30.0):
+        self.name = name
+        self.ewma_alpha = ewma_alpha
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+
+        self.state = "closed"  # "closed", "open" or "half_open"
+        self.error_rate = 0.0
+        self.latency_ewma: Optional[float] = None
+        self.ttft_ewma: Optional[float] = None
+        self.consecutive_failures = 0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        if current is None:
+            return sample
+        return self.ewma_alpha * sample + (1 - self.ewma_alpha) * current
+
+    def _cooled_down(self) -> bool:
+        return self.opened_at is not None and time.monotonic() - self.opened_at >= self.open_seconds
+
+    def is_available(self) -> bool:
+        """Whether a request could be sent now, without claiming the half-open probe"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and not self._cooled_down():
+                return False
+            return not self._probe_in_flight
+
+    def acquire(self) -> None:
+        """Claim permission to send a request, raising CircuitOpenError if refused"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open":
+                if not self._cooled_down():
+                    raise CircuitOpenError(f"{self.name} circuit is open")
+                self.state = "half_open"
+            if self._probe_in_flight:
+                raise CircuitOpenError(f"{self.name} circuit is half-open with a probe in flight")
+            self._probe_in_flight = True
+
+    def release(self) -> None:
+        """Give back a claimed request slot without recording an outcome (e.g. cancelled)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self, latency: float, ttft: Optional[float] = None) -> None:
+        with self._lock:
+            self.total_requests += 1
+            self.consecutive_failures = 0
+            self.error_rate = self._ewma(self.error_rate, 0.0)
+            self.latency_ewma = self._ewma(self.latency_ewma, latency)
+            if ttft is not None:
+                self.ttft_ewma = self._ewma(self.ttft_ewma, ttft)
+            if self.state == "half_open":
+                self.state = "closed"
+                self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self, error: BaseException) -> None:
+        with self._lock:
+            self.total_requests += 1
+            self.total_failures += 1
+            self.consecutive_failures += 1
+            self.error_rate = self._ewma(self.error_rate, 1.0)
+            self.last_error = str(error)
+            sustained = (self.total_requests >= self.min_requests
+                         and self.error_rate >= self.error_rate_threshold)
+            if (self.state == "half_open"
+                    or self.consecutive_failures >= self.failure_threshold
+                    or sustained):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = None
+            if self.state == "open" and self.opened_at is not None:
+                retry_in = max(0.0, self.open_seconds - (time.monotonic() - self.opened_at))
+            return {
+                "state": self.state,
+                "error_rate": round(self.error_rate, 4),
+                "latency_ewma_s": None if self.latency_ewma is None else round(self.latency_ewma, 4),
+                "ttft_ewma_s": None if self.ttft_ewma is None else round(self.ttft_ewma, 4),
+                "consecutive_failures": self.consecutive_failures,
+                "total_requests": self.total_requests,
+                "total_failures": self.total_failures,
+                "retry_in_s": None if retry_in is None else round(retry_in, 2),
+                "last_error": self.last_error
+            }
+
+class ProviderHealthRegistry:
+    """Health state for every provider, created on first use"""
+    def __init__(self, **settings):
+        self._settings = settings
+        self._providers: Dict[str, ProviderHealth] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> ProviderHealth:
+        with self._lock:
+            health = self._providers.get(name)
+            if health is None:
+                health = self._providers[name] = ProviderHealth(name, **self._settings)
+            return health
+
+    def is_available(self, name: str) -> bool:
+        return self.get(name).is_available()
+
+    def available(self, names: Iterable[str]) -> List[str]:
+        """Filter names down to providers whose circuit currently admits requests"""
+        return [name for name in names if self.is_available(name)]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            providers = list(self._providers.values())
+        return {health.name: health.snapshot() for health in providers}
+
+    def monitored(self, name: str, factory: Callable[[], Iterable[str]]) -> Iterator[str]:
+        """
+        Run factory's chunks through the provider's circuit breaker, recording
+        latency, time to first chunk and the outcome. A stream closed early by
+        its consumer (e.g. a cancelled hedge) records nothing.
+        """
+        health = self.get(name)
+        health.acquire()
+        started = time.monotonic()
+        ttft = None
+        try:
+            for chunk in factory():
+                if ttft is None:
+                    ttft = time.monotonic() - started
+                yield chunk
+        except GeneratorExit:
+            health.release()
+            raise
+        except Exception as e:
+            health.record_failure(e)
+            raise
+        health.record_success(time.monotonic() - started, ttft)
+
+    def call(self, name: str, fn: Callable[[], Any]) -> Any:
+        """Run a single non-streaming call through the provider's circuit breaker"""
+        [result] = self.monitored(name, lambda: [fn()])
+        return result
+
+class FailoverStream:
+    """
+    The chunks of the provider that failover_call settled on, starting with
+    the first one it already read. Closing it closes the provider's stream,
+    releasing its HTTP response and limiter slot, even if iteration never
+    started (a plain generator would not run its cleanup then).
+    """
+    def __init__(self, first: Optional[str], chunks: Iterator[str]):
+        self._pending = [] if first is None else [first]
+        self._chunks = chunks
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        if self._pending:
+            return self._pending.pop()
+        return next(self._chunks)
+
+    def close(self) -> None:
+        self._pending = []
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+
+def failover_call(candidates: List[Tuple[str, Callable[[], Iterable[str]]]]) -> Tuple[str, FailoverStream]:
+    """
+    Try providers in order until one produces its first chunk. A provider that
+    fails (or is refused by its breaker) before that is skipped in favour of
+    the next; failures after the first chunk propagate to the caller.
+
+    Returns the provider name and a FailoverStream over all of its chunks;
+    close it when stopping early.
+    """
+    errors: List[BaseException] = []
+    for provider, factory in candidates:
+        chunks = iter(factory())
+        try:
+            first = next(chunks)
+        except StopIteration:
+            return provider, FailoverStream(None, chunks)
+        except Exception as e:
+            errors.append(e)
+            continue
+        return provider, FailoverStream(first, chunks)
+    if errors:
+        raise errors[0]
+    raise CircuitOpenError("No healthy LLM provider is available")
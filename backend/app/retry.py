@@ -0,0 +1,209 @@
+# Rate-limit-aware retries and client-side pacing for provider calls
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.metrics import metrics
+
+# HTTP statuses worth retrying: rate limited, timeouts and transient server errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+# Transport-level SDK errors, matched by class name across Groq/Anthropic/httpx
+RETRYABLE_ERROR_NAMES = {
+    "APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout",
+    "ReadTimeout", "RemoteProtocolError", "ServiceUnavailable", "ResourceExhausted",
+    "DeadlineExceeded", "InternalServerError", "TooManyRequests"
+}
+
+retries_total = metrics.counter(
+    "llm_provider_retries_total",
+    "Provider calls retried after a rate limit or transient error",
+    ["provider", "reason"]
+)
+pacing_wait_seconds = metrics.histogram(
+    "llm_provider_pacing_wait_seconds",
+    "Time provider calls waited on the client-side token bucket",
+    ["provider"]
+)
+
+def estimate_tokens(*texts: Optional[str]) -> int:
+    """Rough token count for pacing (about four characters per token)"""
+    return max(1, sum(len(text) for text in texts if text) // 4)
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        # google.api_core errors carry the HTTP status as .code
+        code = getattr(error, "code", None)
+        status = code if isinstance(code, int) else None
+    return status
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait, from Retry-After(-ms) headers"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+def retry_reason(error: BaseException) -> Optional[str]:
+    """Why error is worth retrying ("429", "503", "connection", ...), or None"""
+    status = _status_code(error)
+    if status is not None:
+        return str(status) if status in RETRYABLE_STATUS else None
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & RETRYABLE_ERROR_NAMES:
+        return "connection"
+    return None
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: refills at `rate` tokens per second up to
+    `capacity`. Callers block until their cost is available.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, cost: float = 1.0, timeout: Optional[float] = None) -> float:
+        """Take cost tokens, waiting as needed; returns seconds waited"""
+        # A single call may cost more than the bucket holds; let it through
+        # once the bucket is full rather than waiting forever
+        cost = min(cost, self.capacity)
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._blocked_until and self._tokens >= cost:
+                    self._tokens -= cost
+                    return now - started
+                wait = max(self._blocked_until - now, (cost - self._tokens) / self.rate)
+            if timeout is not None and now - started + wait > timeout:
+                raise TimeoutError("Timed out waiting for provider rate limit budget")
+            time.sleep(wait)
+
+    def block_for(self, seconds: float) -> None:
+        """Hold every caller back, e.g. after the provider sent Retry-After"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+class RequestPacer:
+    """
+    Token buckets per provider and model, sized from configured limits so we
+    stay under quota instead of bouncing off it. Limits are keyed "provider"
+    or "provider/model" (the more specific wins), each with optional "rpm"
+    (requests per minute) and "tpm" (input tokens per minute).
+    """
+    def __init__(self, limits: Dict[str, Dict[str, float]], burst_seconds: float = 10.0):
+        self.limits = limits
+        self.burst_seconds = burst_seconds
+        self._buckets: Dict[Tuple[str, str], Dict[str, TokenBucket]] = {}
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, provider: str, model: str) -> Dict[str, TokenBucket]:
+        key = (provider, model)
+        with self._lock:
+            buckets = self._buckets.get(key)
+            if buckets is None:
+                limit = self.limits.get(f"{provider}/{model}") or self.limits.get(provider) or {}
+                buckets = {}
+                for unit in ("rpm", "tpm"):
+                    per_minute = limit.get(unit)
+                    if per_minute:
+                        rate = per_minute / 60.0
+                        buckets[unit] = TokenBucket(rate, max(1.0, rate * self.burst_seconds))
+                self._buckets[key] = buckets
+            return buckets
+
+    def acquire(self, provider: str, model: str, tokens: int = 1, timeout: Optional[float] = None) -> float:
+        buckets = self._buckets_for(provider, model)
+        waited = 0.0
+        if "rpm" in buckets:
+            waited += buckets["rpm"].acquire(1, timeout)
+        if "tpm" in buckets:
+            waited += buckets["tpm"].acquire(tokens, timeout)
+        if waited > 0:
+            pacing_wait_seconds.observe(waited, provider=provider)
+        return waited
+
+    def back_off(self, provider: str, model: str, seconds: float) -> None:
+        for bucket in self._buckets_for(provider, model).values():
+            bucket.block_for(seconds)
+
+class RetryPolicy:
+    """Jittered exponential backoff that honours the provider's Retry-After"""
+    def __init__(self,
+                 max_attempts: int = 4,
+                 base_delay_s: float = 0.5,
+                 max_delay_s: float = 20.0,
+                 max_elapsed_s: float = 60.0):
+        self.max_attempts = max_attempts
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.max_elapsed_s = max_elapsed_s
+
+    def delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            # Spread callers out a little so they do not return in lockstep
+            return min(self.max_delay_s, retry_after) + random.uniform(0, self.base_delay_s)
+        # "Full jitter": uniform over the exponential window
+        return random.uniform(0, min(self.max_delay_s, self.base_delay_s * (2 ** attempt)))
+
+class ProviderRetry:
+    """Paces and retries blocking provider calls (run on worker threads)"""
+    def __init__(self, policy: RetryPolicy, pacer: RequestPacer):
+        self.policy = policy
+        self.pacer = pacer
+
+    def call(self, provider: str, model: str, fn: Callable[[], Any], tokens: int = 1) -> Any:
+        """
+        Call fn once the pacer allows it, retrying rate limits and transient
+        errors. Only wrap the call that opens a request: a stream that has
+        started yielding must not be retried.
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            remaining = self.policy.max_elapsed_s - (time.monotonic() - started)
+            self.pacer.acquire(provider, model, tokens, timeout=max(0.0, remaining))
+            try:
+                return fn()
+            except Exception as e:
+                reason = retry_reason(e)
+                attempt += 1
+                if reason is None or attempt >= self.policy.max_attempts:
+                    raise
+                retry_after = _retry_after(e)
+                if retry_after is not None:
+                    self.pacer.back_off(provider, model, retry_after)
+                delay = self.policy.delay(attempt, retry_after)
+                if time.monotonic() - started + delay > self.policy.max_elapsed_s:
+                    raise
+                retries_total.inc(provider=provider, reason=reason)
+                time.sleep(delay)
@@ -0,0 +1,141 @@
+# Document revision history stored as reverse deltas with periodic snapshots
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from app.database import revisions_collection
+from app.diff import apply_changes, compute_delta
+from app.metrics import metrics
+
+REVISIONS_CONFIG = {
+    "enabled": os.getenv("REVISIONS_ENABLED", "true").lower() == "true",
+    # Every Nth revision of a document keeps its full content, so
+    # materializing any revision applies at most N - 1 deltas
+    "snapshot_every": max(1, int(os.getenv("REVISION_SNAPSHOT_EVERY", "20")))
+}
+
+revisions_total = metrics.counter(
+    "document_revisions_total",
+    "Document revisions recorded, by how the previous revision ended up stored",
+    ["previous"]
+)
+revision_deltas_applied = metrics.histogram(
+    "document_revision_deltas_applied",
+    "Deltas applied to materialize a revision",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100)
+)
+
+# Fields returned when listing revisions
+SUMMARY_FIELDS = {"_id": 0, "version": 1, "created_at": 1, "size": 1, "stored_bytes": 1, "snapshot": 1}
+
+def _stored_bytes(value: Any) -> int:
+    return len(json.dumps(value).encode())
+
+async def record_revision(document_id: str, version: int, content: str,
+                          created_at: Optional[datetime] = None) -> None:
+    """
+    Record `content` as revision `version` of a document. The newest revision
+    always holds its full content; the one it replaces is rewritten as a
+    reverse delta (newer content -> its content) unless it is a snapshot.
+    Recording is best-effort and never fails the save that triggered it.
+    """
+    if not REVISIONS_CONFIG["enabled"]:
+        return
+    try:
+        for _ in range(3):
+            head = await revisions_collection.find_one({"document_id": document_id}, sort=[("seq", -1)])
+            if head is not None and (head["version"] >= version or head.get("content") == content):
+                # Already recorded, older than what we have, or a title-only save
+                return
+            seq = head["seq"] + 1 if head is not None else 0
+            try:
+                await revisions_collection.insert_one({
+                    "_id": f"{document_id}:{seq}",
+                    "document_id": document_id,
+                    "seq": seq,
+                    "version": version,
+                    "created_at": created_at or datetime.utcnow(),
+                    "size": len(content),
+                    "stored_bytes": _stored_bytes(content),
+                    "snapshot": True,
+                    "content": content
+                })
+                break
+            except DuplicateKeyError:
+                # A concurrent save took this sequence number; re-read the head
+                continue
+        else:
+            return
+
+        if head is None:
+            revisions_total.inc(previous="none")
+            return
+        if head["seq"] % REVISIONS_CONFIG["snapshot_every"] == 0:
+            revisions_total.inc(previous="snapshot")
+            return
+        # Until this update, the previous revision simply stays a full copy
+        delta = await asyncio.to_thread(compute_delta, content, head["content"])
+        stored_bytes = _stored_bytes(delta)
+        if stored_bytes >= head["stored_bytes"]:
+            # A near-total rewrite; the full copy is smaller
+            revisions_total.inc(previous="snapshot")
+            return
+        await revisions_collection.update_one(
+            {"_id": head["_id"], "content": {"$exists": True}},
+            {"$set": {"delta": delta, "stored_bytes": stored_bytes, "snapshot": False}, "$unset": {"content": ""}}
+        )
+        revisions_total.inc(previous="delta")
+    except Exception as e:
+        print(f"Warning: Could not record revision {version} of {document_id}: {e}")
+
+async def list_revisions(document_id: str, limit: int = 50, before: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Revision summaries, newest first, optionally only versions below `before`"""
+    query: Dict[str, Any] = {"document_id": document_id}
+    if before is not None:
+        query["version"] = {"$lt": before}
+    cursor = revisions_collection.find(query, SUMMARY_FIELDS).sort("seq", -1).limit(limit)
+    return await cursor.to_list(length=limit)
+
+async def get_revision(document_id: str, version: int) -> Optional[Dict[str, Any]]:
+    """
+    A revision with its full content, or None if that version was not
+    recorded. Reads at most `snapshot_every` revisions.
+    """
+    target = await revisions_collection.find_one({"document_id": document_id, "version": version})
+    if target is None:
+        return None
+    deltas = []
+    content = target.get("content")
+    if content is None:
+        # The nearest full copy is the next snapshot, or the newest revision
+        upper = (target["seq"] // REVISIONS_CONFIG["snapshot_every"] + 1) * REVISIONS_CONFIG["snapshot_every"]
+        cursor = revisions_collection.find(
+            {"document_id": document_id, "seq": {"$gt": target["seq"], "$lte": upper}},
+            {"seq": 1, "content": 1, "delta": 1}
+        ).sort("seq", 1)
+        async for revision in cursor:
+            if revision.get("content") is not None:
+                content = revision["content"]
+                break
+            deltas.append(revision["delta"])
+        if content is None:
+            raise ValueError(f"Revision history of {document_id} is missing a full copy after version {version}")
+        # Walk back from the full copy to the target
+        for delta in reversed([target["delta"]] + deltas):
+            content = apply_changes(content, delta)
+        revision_deltas_applied.observe(len(deltas) + 1)
+    else:
+        revision_deltas_applied.observe(0)
+    return {
+        "version": target["version"],
+        "created_at": target["created_at"],
+        "size": target["size"],
+        "content": content
+    }
+
+async def delete_revisions(document_id: str) -> None:
+    await revisions_collection.delete_many({"document_id": document_id})
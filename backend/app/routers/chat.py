@@ -1,14 +1,24 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, AsyncGenerator
 from datetime import datetime
 import json
 import asyncio
-from app.llm import get_llm_response, validate_api_keys
+from starlette.concurrency import run_in_threadpool
+from app.llm import get_llm_response, validate_api_keys, provider_health, llm_scheduler
+from app.coalescing import SingleFlight, StreamFanout, request_key
+from app.scheduler import PRIORITY_DIAGRAM, PRIORITY_INTERACTIVE, SchedulerRejected
+from app.tracing import accumulate, span
+from app.chat_writer import CHAT_WRITER_CONFIG, chat_writer
 
 router = APIRouter()
 
+# Identical concurrent requests (double-clicks, several tabs) share one
+# upstream provider call; streams are fanned out to every subscriber
+llm_requests = SingleFlight()
+llm_streams = StreamFanout()
+
 # Pydantic models
 class ChatMessage(BaseModel):
     content: str
@@ -23,15 +33,57 @@ class ChatRequest(BaseModel):
     document_id: Optional[str] = None  # Document ID for context
     selected_text: Optional[str] = None  # Selected text for Command+K interface
     edit_mode: Optional[bool] = False  # Edit mode for document generation
+    user_id: Optional[str] = None  # Requesting user, for fair scheduling
+    include_stats: Optional[bool] = False  # Return latency/token stats (a final "stats" event when streaming)
+    save_to_history: Optional[bool] = True  # Store the turn in the document's chat history (needs document_id)
 
 class ChatResponse(BaseModel):
     response: str
     timestamp: datetime
     model: str
     analysis: Optional[dict] = None
+    stats: Optional[dict] = None
+
+def _scheduling_key(user_id: Optional[str], document_id: Optional[str], http_request: Request) -> str:
+    """Who a request is queued as: the user if known, else the document, else the client address"""
+    if user_id:
+        return f"user:{user_id}"
+    if document_id:
+        return f"document:{document_id}"
+    return f"client:{http_request.client.host if http_request.client else 'unknown'}"
+
+def _save_turn(request: ChatRequest, response: str, model: Optional[str], complete: bool = True) -> None:
+    """Queue the user message and the reply for the document's chat history"""
+    if not (CHAT_WRITER_CONFIG["enabled"] and request.document_id and request.save_to_history):
+        return
+    if not response and not complete:
+        # Failed before any reply; the client shows an error, not a turn
+        return
+    messages = [{"role": "user", "content": request.message, "timestamp": datetime.utcnow()}]
+    if response:
+        reply = {"role": "assistant", "content": response, "timestamp": datetime.utcnow(), "model": model}
+        if not complete:
+            # The client went away or the stream failed part way
+            reply["partial"] = True
+        messages.append(reply)
+    chat_writer.add(request.document_id, messages)
+
+def _busy(e: SchedulerRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def _scheduled_llm_call(user: str, priority: int, llm_kwargs: dict):
+    """Run get_llm_response on the threadpool once the scheduler grants a slot"""
+    with span("llm.request") as request_span:
+        async with llm_scheduler.slot(user, priority) as waited:
+            if request_span is not None:
+                request_span.set(queue_wait_ms=round(waited * 1000, 3))
+            llm_response = await run_in_threadpool(get_llm_response, **llm_kwargs)
+    if llm_response.stats is not None:
+        llm_response.stats["queue_wait_s"] = round(waited, 4)
+    return llm_response
 
 @router.post("/message", response_model=ChatResponse)
-async def send_message(request: ChatRequest):
+async def send_message(request: ChatRequest, http_request: Request):
     """
     Send a message to the AI assistant and receive a response
     Uses intelligent routing between Groq, Claude, and Gemini
@@ -65,14 +117,19 @@ async def send_message(request: ChatRequest):
             else:
                 document_content = context_prefix
         
-        # Get LLM response with intelligent routing
-        llm_response = get_llm_response(
+        # Get LLM response with intelligent routing, off the event loop
+        llm_kwargs = dict(
             message=request.message,
             conversation_history=conversation_history,
             preferred_complex_model=request.preferred_complex_model,
             document_content=document_content,
             edit_mode=request.edit_mode
         )
+        user = _scheduling_key(request.user_id, request.document_id, http_request)
+        llm_response = await llm_requests.do(
+            request_key(llm_kwargs),
+            lambda: _scheduled_llm_call(user, PRIORITY_INTERACTIVE, llm_kwargs)
+        )
         
         # Prepare analysis data if available
         analysis_data = None
@@ -83,21 +140,39 @@ async def send_message(request: ChatRequest):
                 "confidence": llm_response.analysis.confidence
             }
         
+        if llm_response.used_model != "error":
+            # A failed call answers with an apology; like a failed stream, it is not a turn
+            _save_turn(request, llm_response.response, llm_response.used_model)
+        
         return ChatResponse(
             response=llm_response.response,
             timestamp=datetime.now(),
             model=llm_response.used_model,
-            analysis=analysis_data
+            analysis=analysis_data,
+            stats=llm_response.stats if request.include_stats else None
         )
+    except SchedulerRejected as e:
+        raise _busy(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/message/stream")
-async def stream_message(request: ChatRequest):
+async def stream_message(request: ChatRequest, http_request: Request):
     """
     Stream a message response from the AI assistant using Server-Sent Events
     """
+    # Reject before the stream starts if the user's queue is already full
+    user = _scheduling_key(request.user_id, request.document_id, http_request)
+    try:
+        llm_scheduler.check_capacity(user)
+    except SchedulerRejected as e:
+        raise _busy(e)
+    
     async def generate():
+        # What has been streamed so far, saved however the stream ends
+        reply_parts = []
+        model = None
+        complete = False
         try:
             # Convert conversation history to the format expected by llm.py
             conversation_history = []
@@ -127,20 +202,34 @@ async def stream_message(request: ChatRequest):
                 else:
                     document_content = context_prefix
             
-            # Get streaming LLM response
-            response_generator = get_llm_response(
+            # Get streaming LLM response, shared with identical in-flight streams
+            llm_kwargs = dict(
                 message=request.message,
                 conversation_history=conversation_history,
                 preferred_complex_model=request.preferred_complex_model,
                 stream=True,
                 document_content=document_content,
-                edit_mode=request.edit_mode
+                edit_mode=request.edit_mode,
+                include_stats=bool(request.include_stats)
+            )
+            response_generator = llm_streams.subscribe(
+                request_key(llm_kwargs),
+                lambda: get_llm_response(**llm_kwargs),
+                slot=lambda: llm_scheduler.slot(user, PRIORITY_INTERACTIVE)
             )
             
             # Stream each chunk as Server-Sent Events
-            for chunk in response_generator:
+            async for chunk in response_generator:
+                if chunk.get("type") == "content":
+                    reply_parts.append(chunk["content"])
+                elif chunk.get("type") == "model":
+                    model = chunk["model"]
+                elif chunk.get("type") == "done":
+                    complete = True
+                
                 # Format as SSE
-                data = json.dumps(chunk)
+                with accumulate("sse.encode"):
+                    data = json.dumps(chunk)
                 yield f"data: {data}\n\n"
                 
                 # Small delay to prevent overwhelming the client
@@ -150,6 +239,8 @@ async def stream_message(request: ChatRequest):
             # Send error as SSE
             error_data = json.dumps({"type": "error", "error": str(e)})
             yield f"data: {error_data}\n\n"
+        finally:
+            _save_turn(request, "".join(reply_parts), model, complete)
     
     return StreamingResponse(
         generate(),
@@ -164,27 +255,35 @@ async def stream_message(request: ChatRequest):
 @router.get("/health")
 async def health_check():
     """
-    Check the health of the chat service and API key configuration
+    Check the health of the chat service: API key configuration plus the live
+    circuit breaker state, error rate and latency of each provider
     """
     api_keys = validate_api_keys()
+    providers = provider_health.snapshot()
     
     # Check if at least Groq is configured (minimum requirement)
     if not api_keys["groq"]:
         return {
             "status": "unhealthy",
             "message": "Groq API key is required for basic functionality",
-            "api_keys": api_keys
+            "api_keys": api_keys,
+            "providers": providers,
+            "scheduler": llm_scheduler.snapshot()
         }
     
+    available_models = [
+        name for name in ("groq", "claude", "gemini")
+        if api_keys[name] and provider_health.is_available(name)
+    ]
+    degraded = any(state["state"] != "closed" for state in providers.values())
+    
     return {
-        "status": "healthy",
-        "message": "Chat service is operational",
+        "status": "degraded" if degraded else "healthy",
+        "message": "Some providers are failing and being routed around" if degraded else "Chat service is operational",
         "api_keys": api_keys,
-        "available_models": [
-            "groq" if api_keys["groq"] else None,
-            "claude" if api_keys["claude"] else None,
-            "gemini" if api_keys["gemini"] else None
-        ]
+        "available_models": available_models,
+        "providers": providers,
+        "scheduler": llm_scheduler.snapshot()
     }
 
 @router.get("/history")
@@ -204,12 +303,13 @@ async def clear_chat_history():
 
 class MermaidRequest(BaseModel):
     query: str
+    user_id: Optional[str] = None  # Requesting user, for fair scheduling
 
 class MermaidResponse(BaseModel):
     diagram: str
     
 @router.post("/mermaid", response_model=MermaidResponse)
-async def generate_mermaid_diagram(request: MermaidRequest):
+async def generate_mermaid_diagram(request: MermaidRequest, http_request: Request):
     """
     Generate a Mermaid diagram based on the query using Claude Opus
     """
@@ -222,12 +322,17 @@ Start directly with the diagram type (e.g., 'graph TD', 'flowchart LR', 'sequenc
 Make sure the diagram is syntactically correct."""
 
         # Get response from Claude (force complex model)
-        llm_response = get_llm_response(
+        llm_kwargs = dict(
             message=mermaid_prompt,
             conversation_history=[],
             preferred_complex_model="claude",
             stream=False
         )
+        user = _scheduling_key(request.user_id, None, http_request)
+        llm_response = await llm_requests.do(
+            request_key(llm_kwargs),
+            lambda: _scheduled_llm_call(user, PRIORITY_DIAGRAM, llm_kwargs)
+        )
         
         # Clean up the response to ensure it's valid Mermaid syntax
         diagram_code = llm_response.response.strip()
@@ -244,5 +349,7 @@ Make sure the diagram is syntactically correct."""
         
         return MermaidResponse(diagram=diagram_code)
         
+    except SchedulerRejected as e:
+        raise _busy(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import FileResponse
+
+from app.loop_monitor import loop_monitor
+from app.profiling import PROFILE_FORMATS, profile_path, require_admin
+
+# Admin-only diagnostics; every endpoint needs the X-Profile admin header
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("/loop")
+async def get_loop_stats():
+    """Event-loop lag and the stacks of recent stalls"""
+    return loop_monitor.snapshot()
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "text"):
+    """
+    Download a stored request profile: "text" (top functions), "pstats"
+    (cProfile dump) or "folded" (stacks for flamegraph tools)
+    """
+    path = profile_path(profile_id, format)
+    return FileResponse(path, media_type=PROFILE_FORMATS[format][1], filename=path.rsplit("/", 1)[-1])
@@ -3,6 +3,7 @@ from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import sys
 import os
+from app.tracing import span
 
 # Add the parent directory to the path so we can import the diff module
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -24,11 +25,13 @@ async def compute_diff(request: DiffRequest):
     Compute the diff between two texts
     """
     try:
-        changes = compute_exact_diff(
-            request.old_content, 
-            request.new_content, 
-            request.granularity
-        )
+        with span("diff.compute", granularity=request.granularity,
+                  chars=len(request.old_content) + len(request.new_content)):
+            changes = compute_exact_diff(
+                request.old_content, 
+                request.new_content, 
+                request.granularity
+            )
         return DiffResponse(changes=changes)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -39,10 +42,11 @@ async def compute_line_based_diff(request: DiffRequest):
     Compute line-based diff between two texts
     """
     try:
-        changes = compute_line_based_exact_diff(
-            request.old_content, 
-            request.new_content
-        )
+        with span("diff.compute_line_based", chars=len(request.old_content) + len(request.new_content)):
+            changes = compute_line_based_exact_diff(
+                request.old_content, 
+                request.new_content
+            )
         return DiffResponse(changes=changes)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -1,12 +1,28 @@
-from fastapi import APIRouter, HTTPException, status
-from typing import List
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
 from datetime import datetime
 from uuid import UUID
+import asyncio
+import base64
+import json
+from pymongo import ReturnDocument, UpdateOne
 
-from app.database import users_collection, documents_collection, chat_history_collection
+from app.database import users_collection, documents_collection, summarize_content
+from app.autosave import AUTOSAVE_CONFIG, autosave_buffer
+from app.document_cache import document_cache, get_document, get_content_range
+from app.content_store import store_content, prune_chunks, load_content, delete_chunks, discard_chunks
+from app.diff import apply_changes, compute_exact_diff
+from app.revisions import record_revision, list_revisions, get_revision, delete_revisions
+from app.chat_store import append_messages, get_messages, delete_messages
+from app.search import search_user
+from app.backup import BACKUP_CONFIG, Importer, export_ndjson, export_zip, import_stream
 from app.models import (
     Document, DocumentCreate, DocumentUpdate, DocumentResponse,
-    User, ChatHistory, ChatMessage
+    DocumentListItem, DocumentListResponse, DocumentPatch, DocumentPatchResponse,
+    SearchResponse,
+    RevisionListResponse, RevisionResponse, RevisionDiffResponse,
+    User, ChatMessage
 )
 
 router = APIRouter()
@@ -22,31 +38,29 @@ def validate_uuid(document_id: str) -> bool:
 @router.post("/", response_model=DocumentResponse)
 async def create_document(document: DocumentCreate):
     """Create a new document for a user"""
-    # Check if user exists, if not create one
-    user = await users_collection.find_one({"user_id": document.user_id})
-    if not user:
-        new_user = User(user_id=document.user_id)
-        await users_collection.insert_one(new_user.model_dump(by_alias=True))
+    # Create the user if it does not exist yet (a no-op upsert otherwise)
+    new_user = User(user_id=document.user_id).model_dump(by_alias=True)
+    del new_user["user_id"]
     
-    # Create new document
+    # Create new document; its chat history is created with the first message
     new_document = Document(
         user_id=document.user_id,
         title=document.title
     )
-    doc_dict = new_document.model_dump(by_alias=True)
+    created_document = new_document.model_dump(by_alias=True)
     
-    await documents_collection.insert_one(doc_dict)
-    created_document = await documents_collection.find_one({"_id": doc_dict["_id"]})
-    
-    # Initialize chat history for the document
-    chat_history = ChatHistory(document_id=doc_dict["_id"])
-    await chat_history_collection.insert_one(chat_history.model_dump(by_alias=True))
+    # Independent writes, sent concurrently: one round trip of latency
+    await asyncio.gather(
+        users_collection.update_one({"user_id": document.user_id}, {"$setOnInsert": new_user}, upsert=True),
+        documents_collection.insert_one(created_document)
+    )
     
     return DocumentResponse(
         id=created_document["_id"],
         user_id=created_document["user_id"],
         title=created_document["title"],
         content=created_document["content"],
+        version=created_document.get("version", 0),
         created_at=created_document["created_at"],
         updated_at=created_document["updated_at"]
     )
@@ -57,37 +71,153 @@ async def get_document_title(document_id: str):
     if not validate_uuid(document_id):
         raise HTTPException(status_code=400, detail="Invalid document ID format")
     
-    document = await documents_collection.find_one({"_id": document_id})
+    # Buffered autosaves are newer than the database; otherwise usually cached
+    document = await get_document(document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
     return {"title": document["title"]}
 
-@router.get("/user/{user_id}")
-async def get_user_documents(user_id: str):
-    """Get all document IDs for a user"""
-    documents = []
-    async for doc in documents_collection.find({"user_id": user_id}):
-        documents.append({
-            "id": doc["_id"],
-            "title": doc["title"],
-            "created_at": doc["created_at"],
-            "updated_at": doc["updated_at"]
-        })
+# Fields shown in document listings; content and images stay in the database
+LISTING_FIELDS = {"title": 1, "snippet": 1, "word_count": 1, "version": 1, "created_at": 1, "updated_at": 1}
+
+def _encode_cursor(document: dict) -> str:
+    position = json.dumps([document["updated_at"].isoformat(), document["_id"]])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+def _decode_cursor(cursor: str) -> dict:
+    """Query for documents after the cursor in (updated_at, _id) descending order"""
+    try:
+        updated_at, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        updated_at = datetime.fromisoformat(updated_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"updated_at": {"$lt": updated_at}},
+        {"updated_at": updated_at, "_id": {"$lt": document_id}}
+    ]}
+
+async def _backfill_summaries(documents: List[dict]) -> None:
+    """Add snippet/word_count to documents written before they were maintained"""
+    missing = [doc["_id"] for doc in documents if "word_count" not in doc]
+    if not missing:
+        return
+    summaries = {}
+    async for doc in documents_collection.find({"_id": {"$in": missing}}, {"content": 1}):
+        summaries[doc["_id"]] = summarize_content(doc.get("content", ""))
+    if summaries:
+        await documents_collection.bulk_write(
+            [UpdateOne({"_id": document_id}, {"$set": summary}) for document_id, summary in summaries.items()],
+            ordered=False
+        )
+    for doc in documents:
+        doc.update(summaries.get(doc["_id"], {}))
+
+@router.get("/user/{user_id}", response_model=DocumentListResponse)
+async def get_user_documents(user_id: str,
+                             limit: int = Query(50, ge=1, le=200),
+                             cursor: Optional[str] = None):
+    """
+    Get a page of a user's documents, most recently updated first. Follow
+    `next_cursor` for the next page; it is null on the last one.
+    """
+    query = {"user_id": user_id}
+    if cursor:
+        query.update(_decode_cursor(cursor))
+    documents = await documents_collection.find(query, LISTING_FIELDS) \
+        .sort([("updated_at", -1), ("_id", -1)]) \
+        .limit(limit) \
+        .to_list(length=limit)
+    await _backfill_summaries(documents)
+    next_cursor = _encode_cursor(documents[-1]) if len(documents) == limit else None
+    
+    # Unflushed autosaves keep their place until flushed, but show their latest state
+    buffered = autosave_buffer.buffered_for_user(user_id)
+    items = []
+    for doc in documents:
+        if doc["_id"] in buffered:
+            latest = buffered[doc["_id"]]
+            doc = {**doc, **summarize_content(latest["content"]),
+                   "title": latest["title"], "version": latest["version"], "updated_at": latest["updated_at"]}
+        items.append(DocumentListItem(id=doc["_id"], **{field: doc[field] for field in LISTING_FIELDS if field in doc}))
     
-    return {"documents": documents}
+    return DocumentListResponse(documents=items, next_cursor=next_cursor)
+
+@router.get("/user/{user_id}/search", response_model=SearchResponse)
+async def search_user_documents(user_id: str,
+                                q: str = Query(..., min_length=1, max_length=500),
+                                limit: int = Query(20, ge=1, le=100),
+                                offset: int = Query(0, ge=0)):
+    """
+    Search a user's document titles, content and chat messages. Hits are
+    ranked by relevance and carry a snippet with the offsets of each match.
+    """
+    return await search_user(user_id, q, limit=limit, offset=offset)
+
+@router.get("/user/{user_id}/export")
+async def export_user_documents(user_id: str,
+                                format: str = Query("ndjson", pattern="^(ndjson|zip)$"),
+                                include_chat: bool = True):
+    """
+    Stream all of a user's documents, with chat history and image
+    references, as NDJSON or a zip archive. Memory use does not depend on
+    the number of documents.
+    """
+    filename = f"documents-{user_id}-{datetime.utcnow():%Y%m%d}"
+    if format == "zip":
+        return StreamingResponse(
+            export_zip(user_id, include_chat),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.zip"'}
+        )
+    return StreamingResponse(
+        export_ndjson(user_id, include_chat),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.ndjson"'}
+    )
+
+@router.post("/user/{user_id}/import")
+async def import_user_documents(user_id: str, request: Request, keep_ids: bool = False):
+    """
+    Import an export (the request body: NDJSON, or a zip archive sent as
+    application/zip) into a user's documents. Documents get new ids unless
+    `keep_ids`, in which case existing ids are skipped; `id_map` maps
+    exported ids to imported ones. The whole upload is checked before
+    anything is written: a malformed record rejects it with a 400 and
+    nothing is imported.
+    """
+    importer = Importer(user_id, keep_ids=keep_ids, batch_size=BACKUP_CONFIG["batch_size"])
+    is_zip = request.headers.get("content-type", "").startswith(("application/zip", "application/x-zip"))
+    try:
+        await import_stream(importer, request.stream(), is_zip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await importer.finish()
 
 @router.get("/{document_id}/content")
-async def get_document_content(document_id: str):
-    """Get document content by ID"""
+async def get_document_content(document_id: str,
+                               start: Optional[int] = Query(None, ge=0),
+                               end: Optional[int] = Query(None, ge=0)):
+    """
+    Get document content by ID. With `start`/`end`, only those characters
+    are returned (and only the chunks holding them are read); `length` is
+    the length of the whole content.
+    """
     if not validate_uuid(document_id):
         raise HTTPException(status_code=400, detail="Invalid document ID format")
     
-    document = await documents_collection.find_one({"_id": document_id})
+    if start is not None or end is not None:
+        page = await get_content_range(document_id, start or 0, end)
+        if page is None:
+            raise HTTPException(status_code=404, detail="Document not found")
+        return page
+    
+    document = await get_document(document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    return {"content": document["content"]}
+    return {"content": document["content"], "version": document.get("version", 0),
+            "length": len(document["content"])}
 
 @router.delete("/{document_id}")
 async def delete_document(document_id: str):
@@ -95,30 +225,41 @@ async def delete_document(document_id: str):
     if not validate_uuid(document_id):
         raise HTTPException(status_code=400, detail="Invalid document ID format")
     
-    # Delete document
+    # Delete document, along with any saves still buffered
+    autosave_buffer.discard(document_id)
     result = await documents_collection.delete_one({"_id": document_id})
+    document_cache.invalidate(document_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Delete associated chat history
-    await chat_history_collection.delete_one({"document_id": document_id})
+    # Delete associated chat history, revisions and content chunks
+    await asyncio.gather(
+        delete_messages(document_id),
+        delete_revisions(document_id),
+        delete_chunks(document_id)
+    )
     
     return {"message": "Document deleted successfully"}
 
 @router.get("/{document_id}/chat-history")
-async def get_chat_history(document_id: str):
-    """Get chat history for a document"""
+async def get_chat_history(document_id: str,
+                           limit: int = Query(50, ge=1, le=500),
+                           before: Optional[int] = None):
+    """
+    Get the latest chat messages for a document, oldest first. Each message
+    has a `seq`; pass `next_before` as `before` to load older messages.
+    """
     if not validate_uuid(document_id):
         raise HTTPException(status_code=400, detail="Invalid document ID format")
     
-    chat_history = await chat_history_collection.find_one({"document_id": document_id})
-    if not chat_history:
-        raise HTTPException(status_code=404, detail="Chat history not found")
+    page = await get_messages(document_id, limit=limit, before=before)
+    if page is None:
+        # Created lazily with the first message
+        if not await get_document(document_id):
+            raise HTTPException(status_code=404, detail="Document not found")
+        page = {"messages": [], "total": 0, "next_before": None}
     
-    return {
-        "document_id": document_id,
-        "messages": chat_history.get("messages", [])
-    }
+    return {"document_id": document_id, **page}
 
 @router.put("/{document_id}")
 async def update_document_content(document_id: str, update: DocumentUpdate):
@@ -131,6 +272,9 @@ async def update_document_content(document_id: str, update: DocumentUpdate):
     
     if update.content is not None:
         update_fields["content"] = update.content
+        if not AUTOSAVE_CONFIG["enabled"]:
+            # The buffer adds these when it flushes
+            update_fields.update(summarize_content(update.content))
     
     if update.title is not None:
         update_fields["title"] = update.title
@@ -142,26 +286,180 @@ async def update_document_content(document_id: str, update: DocumentUpdate):
             detail="At least one of 'content' or 'title' must be provided"
         )
     
-    # Update document
-    result = await documents_collection.update_one(
-        {"_id": document_id},
-        {"$set": update_fields}
-    )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Document not found")
-    
-    updated_document = await documents_collection.find_one({"_id": document_id})
+    if AUTOSAVE_CONFIG["enabled"]:
+        # Acknowledge from the write-behind buffer; flushed to the database later
+        updated_document = await autosave_buffer.save(document_id, update_fields)
+        if updated_document is None:
+            raise HTTPException(status_code=404, detail="Document not found")
+        document_cache.invalidate(document_id)
+    else:
+        if update.content is not None:
+            # Large content is stored as compressed chunks, written first
+            update_fields.update(await store_content(document_id, update.content))
+        # Update document and read back its previous state in the same round
+        # trip (without the content being replaced)
+        previous_document = await documents_collection.find_one_and_update(
+            {"_id": document_id},
+            {"$set": update_fields, "$inc": {"version": 1}},
+            projection={"content": 0} if update.content is not None else None,
+            return_document=ReturnDocument.BEFORE
+        )
+        # Invalidate once the write is done, so no read can re-cache the old state
+        document_cache.invalidate(document_id)
+        
+        if previous_document is None:
+            if update_fields.get("content_chunks"):
+                await delete_chunks(document_id)
+            raise HTTPException(status_code=404, detail="Document not found")
+        
+        updated_document = {**previous_document, **update_fields,
+                            "version": previous_document.get("version", 0) + 1}
+        if update.content is not None:
+            updated_document["content"] = update.content
+            await asyncio.gather(
+                prune_chunks(document_id, update_fields, previous_document.get("content_chunks", [])),
+                record_revision(document_id, updated_document["version"],
+                                update.content, updated_document["updated_at"])
+            )
+        else:
+            updated_document = await load_content(updated_document)
     
     return DocumentResponse(
         id=updated_document["_id"],
         user_id=updated_document["user_id"],
         title=updated_document["title"],
         content=updated_document["content"],
+        version=updated_document.get("version", 0),
         created_at=updated_document["created_at"],
         updated_at=updated_document["updated_at"]
     )
 
+def _patched_fields(document: dict, patch: DocumentPatch) -> dict:
+    """New content for a patch, or an HTTPException if it cannot be applied"""
+    current_version = document.get("version", 0)
+    if current_version != patch.base_version:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": "Document has changed since base_version; reload and retry",
+                "current_version": current_version
+            }
+        )
+    try:
+        content = apply_changes(
+            document.get("content", ""),
+            [change.model_dump(exclude_none=True) for change in patch.changes]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"content": content, "updated_at": datetime.utcnow()}
+
+@router.patch("/{document_id}", response_model=DocumentPatchResponse)
+async def patch_document_content(document_id: str, patch: DocumentPatch):
+    """
+    Apply ranged insert/delete/replace changes to the document content.
+    Changes are applied atomically, and only if the document is still at
+    base_version (409 otherwise).
+    """
+    if not validate_uuid(document_id):
+        raise HTTPException(status_code=400, detail="Invalid document ID format")
+    
+    if AUTOSAVE_CONFIG["enabled"]:
+        # Applied to the buffered state, without yielding in between
+        updated_document = await autosave_buffer.apply(document_id, lambda document: _patched_fields(document, patch))
+        if updated_document is None:
+            raise HTTPException(status_code=404, detail="Document not found")
+        document_cache.invalidate(document_id)
+    else:
+        # A cached copy is fine: the write below is conditional on its version
+        document = await get_document(document_id)
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+        fields = _patched_fields(document, patch)
+        fields.update(summarize_content(fields["content"]))
+        # Only chunks the patch changed are written
+        previous = document.get("content_chunks", [])
+        inserted = {}
+        stored = {**fields, **await store_content(document_id, fields["content"], previous, inserted)}
+        
+        # Conditional on the version we read, so concurrent saves cannot interleave
+        version_filter = {"version": patch.base_version}
+        if patch.base_version == 0:
+            version_filter = {"$or": [version_filter, {"version": {"$exists": False}}]}
+        result = await documents_collection.update_one(
+            {"_id": document_id, **version_filter},
+            {"$set": stored, "$inc": {"version": 1}}
+        )
+        if result.matched_count == 0:
+            # Nothing points at the chunks written for this patch
+            await discard_chunks(inserted)
+            raise HTTPException(status_code=409, detail="Document has changed since base_version; reload and retry")
+        document_cache.invalidate(document_id)
+        updated_document = {"version": patch.base_version + 1, **fields}
+        await asyncio.gather(
+            prune_chunks(document_id, stored, previous),
+            record_revision(document_id, updated_document["version"], fields["content"], fields["updated_at"])
+        )
+    
+    return DocumentPatchResponse(
+        id=document_id,
+        version=updated_document["version"],
+        updated_at=updated_document["updated_at"]
+    )
+
+@router.get("/{document_id}/revisions", response_model=RevisionListResponse)
+async def get_document_revisions(document_id: str,
+                                 limit: int = Query(50, ge=1, le=500),
+                                 before: Optional[int] = None):
+    """List recorded revisions, newest first; pass `before` to page back"""
+    if not validate_uuid(document_id):
+        raise HTTPException(status_code=400, detail="Invalid document ID format")
+    
+    revisions = await list_revisions(document_id, limit=limit, before=before)
+    return RevisionListResponse(document_id=document_id, revisions=revisions)
+
+async def _revision_content(document_id: str, version: int) -> dict:
+    revision = await get_revision(document_id, version)
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    return revision
+
+@router.get("/{document_id}/revisions/{version}", response_model=RevisionResponse)
+async def get_document_revision(document_id: str, version: int):
+    """Get the full content of a recorded revision"""
+    if not validate_uuid(document_id):
+        raise HTTPException(status_code=400, detail="Invalid document ID format")
+    
+    revision = await _revision_content(document_id, version)
+    return RevisionResponse(document_id=document_id, **revision)
+
+@router.get("/{document_id}/revisions/{version}/diff", response_model=RevisionDiffResponse)
+async def diff_document_revision(document_id: str, version: int,
+                                 against: Optional[int] = None,
+                                 granularity: str = "word"):
+    """
+    Changes from a revision to another revision (`against`) or, by default,
+    to the current content
+    """
+    if not validate_uuid(document_id):
+        raise HTTPException(status_code=400, detail="Invalid document ID format")
+    
+    old = await _revision_content(document_id, version)
+    if against is not None:
+        new = await _revision_content(document_id, against)
+    else:
+        new = await get_document(document_id)
+        if not new:
+            raise HTTPException(status_code=404, detail="Document not found")
+    
+    changes = compute_exact_diff(old["content"], new["content"], granularity)
+    return RevisionDiffResponse(
+        document_id=document_id,
+        from_version=old["version"],
+        to_version=new.get("version", 0),
+        changes=changes
+    )
+
 @router.post("/{document_id}/chat-message")
 async def add_chat_message(document_id: str, message: ChatMessage):
     """Add a message to document's chat history"""
@@ -169,25 +467,11 @@ async def add_chat_message(document_id: str, message: ChatMessage):
         raise HTTPException(status_code=400, detail="Invalid document ID format")
     
     # Check if document exists
-    document = await documents_collection.find_one({"_id": document_id})
+    document = await get_document(document_id)
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Update chat history
-    result = await chat_history_collection.update_one(
-        {"document_id": document_id},
-        {
-            "$push": {"messages": message.model_dump()},
-            "$set": {"updated_at": datetime.utcnow()}
-        }
-    )
-    
-    if result.matched_count == 0:
-        # Create chat history if it doesn't exist
-        chat_history = ChatHistory(
-            document_id=document_id,
-            messages=[message]
-        )
-        await chat_history_collection.insert_one(chat_history.model_dump(by_alias=True))
+    # Append to the chat history, creating it with the first message
+    seq, = await append_messages(document_id, [message.model_dump()])
     
-    return {"message": "Chat message added successfully"} 
\ No newline at end of file
+    return {"message": "Chat message added successfully", "seq": seq} 
\ No newline at end of file
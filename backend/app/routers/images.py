@@ -7,6 +7,7 @@ import tempfile
 
 from app.cloudinary_config import cloudinary_service
 from app.database import documents_collection
+from app.document_cache import document_cache, get_stored_document
 
 router = APIRouter()
 
@@ -159,6 +160,7 @@ async def save_image_to_document(document_id: str, image_data: Dict[str, Any]):
                 }
             }
         )
+        document_cache.invalidate(document_id)
         
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Document not found")
@@ -174,7 +176,8 @@ async def get_document_images(document_id: str):
     Get all images associated with a document
     """
     try:
-        document = await documents_collection.find_one({"_id": document_id})
+        # Images are not buffered by autosave, so read the stored document
+        document = await get_stored_document(document_id)
         
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
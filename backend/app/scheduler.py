@@ -0,0 +1,236 @@
+# Fair-share concurrency scheduling for LLM calls
+import asyncio
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Iterable, Iterator, Optional
+
+from app.metrics import metrics
+
+# Priorities, lower runs first
+PRIORITY_INTERACTIVE = 0  # chat and Command+K
+PRIORITY_DIAGRAM = 1      # Mermaid generation
+PRIORITY_BULK = 2         # background and batch jobs
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_DIAGRAM: "diagram",
+    PRIORITY_BULK: "bulk"
+}
+
+queue_wait_seconds = metrics.histogram(
+    "llm_scheduler_queue_wait_seconds",
+    "Time LLM requests spent queued before running",
+    ["priority"]
+)
+rejected_total = metrics.counter(
+    "llm_scheduler_rejected_total",
+    "LLM requests rejected by the scheduler",
+    ["reason"]
+)
+queue_depth = metrics.gauge(
+    "llm_scheduler_queue_depth",
+    "LLM requests waiting for a slot",
+    ["priority"]
+)
+active_requests = metrics.gauge(
+    "llm_scheduler_active",
+    "LLM requests currently holding a slot"
+)
+provider_in_flight = metrics.gauge(
+    "llm_provider_in_flight",
+    "Calls currently in flight per provider",
+    ["provider"]
+)
+
+class SchedulerRejected(Exception):
+    """Raised when a request cannot be queued or waited too long for a slot"""
+    def __init__(self, reason: str, retry_after: int = 1):
+        super().__init__(f"LLM service is busy ({reason}), please retry shortly")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class ProviderBusyError(Exception):
+    """Raised when a provider stays at its concurrency cap for too long"""
+
+class _Waiter:
+    def __init__(self, user: str, priority: int):
+        self.user = user
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+class FairScheduler:
+    """
+    Admission control in front of the LLM providers.
+
+    At most `max_concurrent` requests run at once, and at most
+    `max_active_per_user` of them for any one user. Waiting requests are
+    served by priority, and round-robin across users within a priority, so a
+    user firing many requests only delays their own. Queues are bounded (in
+    total and per user) and full queues reject immediately rather than pile up.
+    """
+    def __init__(self,
+                 max_concurrent: int = 32,
+                 max_active_per_user: int = 4,
+                 max_queue: int = 200,
+                 max_queue_per_user: int = 10,
+                 queue_timeout_s: float = 30.0):
+        self.max_concurrent = max_concurrent
+        self.max_active_per_user = max_active_per_user
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout_s = queue_timeout_s
+
+        self._active = 0
+        self._active_by_user: Dict[str, int] = defaultdict(int)
+        # priority -> user -> that user's waiters, users in round-robin order
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Waiter]]"] = {}
+        self._queued = 0
+        self._queued_by_user: Dict[str, int] = defaultdict(int)
+
+        queue_depth.set_function(self._depth_by_priority)
+        active_requests.set_function(lambda: {(): self._active})
+
+    def _depth_by_priority(self) -> Dict[tuple, float]:
+        return {
+            (PRIORITY_NAMES.get(priority, str(priority)),): sum(len(waiters) for waiters in users.values())
+            for priority, users in self._queues.items()
+        }
+
+    def check_capacity(self, user: str) -> None:
+        """Raise SchedulerRejected now if a request from user could not be queued"""
+        if self._queued >= self.max_queue:
+            rejected_total.inc(reason="queue_full")
+            raise SchedulerRejected("queue full", retry_after=max(1, int(self.queue_timeout_s / 4)))
+        if self._queued_by_user.get(user, 0) >= self.max_queue_per_user:
+            rejected_total.inc(reason="user_queue_full")
+            raise SchedulerRejected("too many pending requests for this user", retry_after=2)
+
+    async def acquire(self, user: str, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """Wait for a slot and return how long that took; pair with release()"""
+        self.check_capacity(user)
+        waiter = _Waiter(user, priority)
+        users = self._queues.setdefault(priority, OrderedDict())
+        users.setdefault(user, deque()).append(waiter)
+        self._queued += 1
+        self._queued_by_user[user] += 1
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout_s)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done():
+                # Granted just as we gave up: hand the slot back
+                self.release(user)
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                rejected_total.inc(reason="timeout")
+                raise SchedulerRejected("timed out waiting for a slot", retry_after=5)
+            raise
+
+        waited = time.monotonic() - waiter.enqueued_at
+        queue_wait_seconds.observe(waited, priority=PRIORITY_NAMES.get(priority, str(priority)))
+        return waited
+
+    def release(self, user: str) -> None:
+        self._active -= 1
+        self._active_by_user[user] -= 1
+        if self._active_by_user[user] <= 0:
+            del self._active_by_user[user]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user: str, priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[float]:
+        """Hold a slot for the duration of the block"""
+        waited = await self.acquire(user, priority)
+        try:
+            yield waited
+        finally:
+            self.release(user)
+
+    def _remove(self, waiter: _Waiter) -> None:
+        users = self._queues.get(waiter.priority)
+        waiters = users.get(waiter.user) if users else None
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del users[waiter.user]
+        self._dequeued(waiter)
+
+    def _dequeued(self, waiter: _Waiter) -> None:
+        self._queued -= 1
+        self._queued_by_user[waiter.user] -= 1
+        if self._queued_by_user[waiter.user] <= 0:
+            del self._queued_by_user[waiter.user]
+
+    def _dispatch(self) -> None:
+        while self._active < self.max_concurrent:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._dequeued(waiter)
+            self._active += 1
+            self._active_by_user[waiter.user] += 1
+            waiter.future.set_result(None)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            for _ in range(len(users)):
+                user, waiters = next(iter(users.items()))
+                users.move_to_end(user)
+                if self._active_by_user.get(user, 0) >= self.max_active_per_user:
+                    continue
+                waiter = waiters.popleft()
+                if not waiters:
+                    del users[user]
+                return waiter
+        return None
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "queued_by_priority": {key[0]: value for key, value in self._depth_by_priority().items()},
+            "max_concurrent": self.max_concurrent
+        }
+
+class ProviderLimiter:
+    """
+    Per-provider concurrency caps, enforced around the blocking provider calls
+    (which run on worker threads). A provider at its cap for longer than
+    `wait_s` raises ProviderBusyError, which routing treats like any other
+    failure before the first token and fails over to the next provider.
+    """
+    def __init__(self, limits: Dict[str, int], wait_s: float = 10.0):
+        self.limits = limits
+        self.wait_s = wait_s
+        self._semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in limits.items()}
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        provider_in_flight.set_function(lambda: {(name,): count for name, count in self._in_flight.items()})
+
+    def limited(self, name: str, factory: Callable[[], Iterable[str]]) -> Iterator[str]:
+        """Hold one of the provider's slots while factory's chunks are consumed"""
+        semaphore = self._semaphores.get(name)
+        if semaphore is not None and not semaphore.acquire(timeout=self.wait_s):
+            raise ProviderBusyError(f"{name} is at its concurrency limit")
+        with self._lock:
+            self._in_flight[name] += 1
+        try:
+            yield from factory()
+        finally:
+            with self._lock:
+                self._in_flight[name] -= 1
+            if semaphore is not None:
+                semaphore.release()
+
+    def call(self, name: str, fn: Callable[[], object]) -> object:
+        """Run a single blocking call within the provider's concurrency cap"""
+        [result] = self.limited(name, lambda: [fn()])
+        return result
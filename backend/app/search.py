@@ -0,0 +1,350 @@
+# Full-text search over a user's documents and chat messages (in-process BM25)
+import asyncio
+import math
+import os
+import re
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.autosave import autosave_buffer
+from app.chat_store import migrate_legacy
+from app.content_store import load_content
+from app.document_cache import get_document
+from app.database import chat_history_collection, chat_messages_collection, documents_collection
+from app.metrics import metrics
+
+SEARCH_CONFIG = {
+    # Users whose index is kept in memory (least recently searched are dropped)
+    "max_users": int(os.getenv("SEARCH_INDEX_USERS", "200")),
+    # Estimated memory for all users' indexes together; least recently
+    # searched users are dropped to stay within it
+    "max_bytes": int(float(os.getenv("SEARCH_INDEX_MAX_MB", "256")) * 1024 * 1024),
+    "snippet_chars": int(os.getenv("SEARCH_SNIPPET_CHARS", "160")),
+    # Each sync re-checks documents updated this long before the previous
+    # one, to cover clock skew and autosaves flushed by other workers
+    "sync_window_s": float(os.getenv("SEARCH_SYNC_WINDOW_SECONDS", "300"))
+}
+
+# BM25 parameters, and how much a title match counts relative to content
+K1 = 1.2
+B = 0.75
+TITLE_WEIGHT = 3
+# Approximate memory per (term, unit) pair, counting both the unit's term
+# tuple and the posting entry; used to keep the indexes within max_bytes
+BYTES_PER_POSTING = 150
+
+search_seconds = metrics.histogram(
+    "search_seconds",
+    "Search latency, including bringing the user's index up to date",
+    ["phase"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+indexed_units_total = metrics.counter(
+    "search_indexed_total",
+    "Documents and chat messages (re)indexed",
+    ["type"]
+)
+index_evictions_total = metrics.counter(
+    "search_index_evictions_total",
+    "User indexes dropped to stay within SEARCH_INDEX_USERS or SEARCH_INDEX_MAX_MB"
+)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text: str) -> List[str]:
+    return [token.lower() for token in _TOKEN.findall(text)]
+
+class _Unit:
+    """
+    One searchable thing: a document (title + content) or a chat message.
+    Only the term counts BM25 needs are kept; the text itself is read again
+    for the hits a search returns.
+    """
+    __slots__ = ("kind", "document_id", "seq", "role", "title", "counts", "length")
+
+    def __init__(self, kind: str, document_id: str, text: str, title: str = "",
+                 seq: Optional[int] = None, role: Optional[str] = None):
+        self.kind = kind
+        self.document_id = document_id
+        self.seq = seq
+        self.role = role
+        self.title = title
+        # Handed to the postings by UserIndex._add, then dropped
+        self.counts: Optional[Counter] = Counter(tokenize(text))
+        for term in tokenize(title):
+            self.counts[term] += TITLE_WEIGHT
+        self.length = sum(self.counts.values())
+
+class UserIndex:
+    """
+    Inverted index of one user's documents and chat messages. sync() brings
+    it up to date with the database: it looks only at documents and chats
+    updated since the previous sync, re-reads only documents whose version or
+    title changed and fetches only chat messages not yet indexed. Deletions
+    are noticed by the user's document count.
+    """
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.units: Dict[Tuple, _Unit] = {}
+        self.postings: Dict[str, Dict[Tuple, int]] = {}
+        # Terms of each unit, to remove its postings
+        self.unit_terms: Dict[Tuple, Tuple[str, ...]] = {}
+        self.total_length = 0
+        self.posting_count = 0
+        # document_id -> (version, title) indexed, and highest chat seq indexed
+        self.document_versions: Dict[str, Tuple[int, str]] = {}
+        self.chat_seqs: Dict[str, int] = {}
+        self.synced_at: Optional[datetime] = None
+        self.lock = asyncio.Lock()
+
+    def _add(self, key: Tuple, unit: _Unit) -> None:
+        self._remove(key)
+        self.units[key] = unit
+        self.total_length += unit.length
+        for term, count in unit.counts.items():
+            self.postings.setdefault(term, {})[key] = count
+        self.unit_terms[key] = tuple(unit.counts)
+        self.posting_count += len(unit.counts)
+        unit.counts = None
+
+    def _remove(self, key: Tuple) -> None:
+        unit = self.units.pop(key, None)
+        if unit is None:
+            return
+        self.total_length -= unit.length
+        terms = self.unit_terms.pop(key)
+        self.posting_count -= len(terms)
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self.postings[term]
+
+    def _remove_document(self, document_id: str) -> None:
+        for key in [key for key in self.units if key[1] == document_id]:
+            self._remove(key)
+        self.document_versions.pop(document_id, None)
+        self.chat_seqs.pop(document_id, None)
+
+    async def sync(self) -> None:
+        started = datetime.utcnow()
+        since = None
+        if self.synced_at is not None:
+            since = self.synced_at - timedelta(seconds=SEARCH_CONFIG["sync_window_s"])
+        query: Dict[str, Any] = {"user_id": self.user_id}
+        if since is not None:
+            query["updated_at"] = {"$gte": since}
+        recent = {
+            doc["_id"]: (doc.get("version", 0), doc["title"])
+            async for doc in documents_collection.find(query, {"version": 1, "title": 1})
+        }
+        buffered = autosave_buffer.buffered_for_user(self.user_id)
+        for document_id, document in buffered.items():
+            recent[document_id] = (document["version"], document["title"])
+
+        changed = [document_id for document_id, version in recent.items()
+                   if self.document_versions.get(document_id) != version]
+        stale = [document_id for document_id in changed if document_id not in buffered]
+        documents = {document_id: buffered[document_id] for document_id in changed if document_id in buffered}
+        if stale:
+            async for doc in documents_collection.find(
+                {"_id": {"$in": stale}}, {"version": 1, "title": 1, "content": 1, "content_chunks": 1}
+            ):
+                documents[doc["_id"]] = await load_content(doc)
+        def build() -> List[_Unit]:
+            return [_Unit("document", document_id, doc.get("content", ""), title=doc["title"])
+                    for document_id, doc in documents.items()]
+        # A first build over thousands of documents is tokenized off the event loop
+        units = await asyncio.to_thread(build) if len(documents) > 50 else build()
+        for unit in units:
+            self._add(("document", unit.document_id), unit)
+            self.document_versions[unit.document_id] = (documents[unit.document_id].get("version", 0), unit.title)
+            indexed_units_total.inc(type="document")
+        # Keep chat hits' titles current
+        if documents:
+            for unit in self.units.values():
+                if unit.kind == "chat" and unit.document_id in documents:
+                    unit.title = self.document_versions[unit.document_id][1]
+
+        if since is None:
+            current = set(recent)
+        elif await documents_collection.count_documents({"user_id": self.user_id}) != len(self.document_versions):
+            current = {doc["_id"] async for doc in documents_collection.find({"user_id": self.user_id}, {"_id": 1})}
+        else:
+            current = None
+        if current is not None:
+            for document_id in set(self.document_versions) - current:
+                self._remove_document(document_id)
+
+        await self._sync_chats(since)
+        self.synced_at = started
+
+    async def _sync_chats(self, since: Optional[datetime]) -> None:
+        if not self.document_versions:
+            return
+        query: Dict[str, Any] = {"document_id": {"$in": list(self.document_versions)}}
+        if since is not None:
+            query["updated_at"] = {"$gte": since}
+        pending = []
+        async for head in chat_history_collection.find(
+            query,
+            {"document_id": 1, "message_count": 1, "legacy_count": 1, "messages": 1}
+        ):
+            if "messages" in head:
+                await migrate_legacy(head)
+                head["legacy_count"] = len(head.pop("messages") or [])
+            document_id = head["document_id"]
+            if document_id not in self.chat_seqs:
+                # Nothing indexed yet, legacy messages (seq below 1) included
+                pending.append({"document_id": document_id})
+            elif head.get("message_count", 0) > self.chat_seqs[document_id]:
+                pending.append({"document_id": document_id, "messages.seq": {"$gt": self.chat_seqs[document_id]}})
+            self.chat_seqs.setdefault(document_id, -head.get("legacy_count", 0))
+        if not pending:
+            return
+        async for bucket in chat_messages_collection.find({"$or": pending}, {"document_id": 1, "messages": 1}):
+            document_id = bucket["document_id"]
+            title = self.document_versions.get(document_id, (0, ""))[1]
+            for message in bucket["messages"]:
+                if ("chat", document_id, message["seq"]) in self.units:
+                    continue
+                self._add(("chat", document_id, message["seq"]), _Unit(
+                    "chat", document_id, message.get("content", ""), seq=message["seq"],
+                    role=message.get("role"), title=title
+                ))
+                self.chat_seqs[document_id] = max(self.chat_seqs[document_id], message["seq"])
+                indexed_units_total.inc(type="chat")
+
+    def search(self, query: str) -> List[Tuple[float, _Unit]]:
+        """All matching units, best first (BM25)"""
+        terms = set(tokenize(query))
+        if not terms or not self.units:
+            return []
+        unit_count = len(self.units)
+        average_length = self.total_length / unit_count or 1.0
+        scores: Dict[Tuple, float] = {}
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (unit_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, count in postings.items():
+                length = self.units[key].length
+                scores[key] = scores.get(key, 0.0) + idf * count * (K1 + 1) / (
+                    count + K1 * (1 - B + B * length / average_length))
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [(score, self.units[key]) for key, score in ranked]
+
+    def estimated_bytes(self) -> int:
+        return self.posting_count * BYTES_PER_POSTING
+
+def highlight(text: str, query: str, width: int) -> Tuple[str, List[List[int]]]:
+    """
+    A window of `text` around the first query term match, and the [start, end)
+    offsets of every match inside that window
+    """
+    terms = set(tokenize(query))
+    matches = [match for match in _TOKEN.finditer(text) if match.group().lower() in terms]
+    if not matches:
+        snippet = text[:width]
+        return snippet, []
+    start = max(0, matches[0].start() - width // 4)
+    # Start on a word boundary
+    if start > 0:
+        space = text.find(" ", start, matches[0].start())
+        start = space + 1 if space != -1 else start
+    snippet = text[start:start + width]
+    highlights = [[match.start() - start, match.end() - start] for match in matches
+                  if match.end() - start <= len(snippet)]
+    return snippet, highlights
+
+class SearchIndexes:
+    """
+    Per-user indexes, built on first search and kept for the most recently
+    searched users, within a user count and an estimated memory budget
+    """
+    def __init__(self, max_users: int = 200, max_bytes: int = 256 * 1024 * 1024):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._indexes: "OrderedDict[str, UserIndex]" = OrderedDict()
+
+    def get(self, user_id: str) -> UserIndex:
+        index = self._indexes.get(user_id)
+        if index is None:
+            index = self._indexes[user_id] = UserIndex(user_id)
+        self._indexes.move_to_end(user_id)
+        self.enforce()
+        return index
+
+    def estimated_bytes(self) -> int:
+        return sum(index.estimated_bytes() for index in self._indexes.values())
+
+    def enforce(self) -> None:
+        """
+        Drop least recently searched indexes until within bounds. The most
+        recent one goes last: an index larger than the whole budget is
+        dropped after its search and rebuilt by the next one.
+        """
+        total = self.estimated_bytes()
+        while self._indexes and (len(self._indexes) > self.max_users or total > self.max_bytes):
+            _, evicted = self._indexes.popitem(last=False)
+            total -= evicted.estimated_bytes()
+            index_evictions_total.inc()
+
+search_indexes = SearchIndexes(max_users=SEARCH_CONFIG["max_users"], max_bytes=SEARCH_CONFIG["max_bytes"])
+
+async def _hit_texts(units: List[_Unit]) -> Dict[Tuple, str]:
+    """Current text of the given units, read from the buffer, cache or database"""
+    texts: Dict[Tuple, str] = {}
+    document_ids = list(dict.fromkeys(unit.document_id for unit in units if unit.kind == "document"))
+    for document_id, document in zip(document_ids, await asyncio.gather(
+            *(get_document(document_id) for document_id in document_ids))):
+        texts[("document", document_id)] = (document or {}).get("content", "")
+    seqs: Dict[str, List[int]] = {}
+    for unit in units:
+        if unit.kind == "chat":
+            seqs.setdefault(unit.document_id, []).append(unit.seq)
+    if seqs:
+        async for bucket in chat_messages_collection.find(
+            {"$or": [{"document_id": document_id, "messages.seq": {"$in": wanted}}
+                     for document_id, wanted in seqs.items()]},
+            {"document_id": 1, "messages": 1}
+        ):
+            for message in bucket["messages"]:
+                texts[("chat", bucket["document_id"], message["seq"])] = message.get("content", "")
+    return texts
+
+async def search_user(user_id: str, query: str, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+    """Ranked hits for `query` across the user's documents and chat messages"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    index = search_indexes.get(user_id)
+    async with index.lock:
+        await index.sync()
+        synced = loop.time()
+        ranked = index.search(query)
+    search_indexes.enforce()
+    search_seconds.observe(synced - started, phase="sync")
+    search_seconds.observe(loop.time() - synced, phase="query")
+
+    page = ranked[offset:offset + limit]
+    texts = await _hit_texts([unit for _, unit in page])
+    hits = []
+    for score, unit in page:
+        key = ("document", unit.document_id) if unit.kind == "document" else ("chat", unit.document_id, unit.seq)
+        snippet, highlights = highlight(texts.get(key, ""), query, SEARCH_CONFIG["snippet_chars"])
+        hit = {
+            "type": unit.kind,
+            "document_id": unit.document_id,
+            "title": unit.title,
+            "score": round(score, 4),
+            "snippet": snippet,
+            "highlights": highlights
+        }
+        if unit.kind == "chat":
+            hit.update(seq=unit.seq, role=unit.role)
+        hits.append(hit)
+    next_offset = offset + limit if offset + limit < len(ranked) else None
+    return {"query": query, "total": len(ranked), "hits": hits, "next_offset": next_offset}
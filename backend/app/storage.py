@@ -0,0 +1,745 @@
+# Storage backends: MongoDB through Motor, or an in-process in-memory store
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+from itertools import count
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import certifi
+import pymongo
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReturnDocument, UpdateMany, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.results import (
+    BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+)
+
+from app.metrics import metrics
+
+load_dotenv()
+
+STORAGE_CONFIG = {
+    # "mongodb" (MONGODB_URL) or "memory" (nothing persisted; for tests,
+    # benchmarks and offline development)
+    "backend": os.getenv("STORAGE_BACKEND", "mongodb").lower()
+}
+
+MONGO_CONFIG = {
+    "max_pool_size": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    "min_pool_size": int(os.getenv("MONGO_MIN_POOL_SIZE", "5")),
+    "max_idle_time_ms": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+    "connect_timeout_ms": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "server_selection_timeout_ms": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    # Default budget of any operation (each batch of a cursor, pings); an
+    # operation that runs out, waiting for a connection included, fails
+    # with a timeout error instead of hanging
+    "timeout_ms": int(os.getenv("MONGO_TIMEOUT_MS", "10000")),
+    # Budgets per kind of operation (see OPERATION_BUDGETS)
+    "read_timeout_ms": int(os.getenv("MONGO_READ_TIMEOUT_MS", "3000")),
+    "write_timeout_ms": int(os.getenv("MONGO_WRITE_TIMEOUT_MS", "5000")),
+    "bulk_timeout_ms": int(os.getenv("MONGO_BULK_TIMEOUT_MS", "30000")),
+    # Connections opened at startup, so the first requests do not pay for them
+    "warm_connections": int(os.getenv("MONGO_WARM_CONNECTIONS", os.getenv("MONGO_MIN_POOL_SIZE", "5")))
+}
+
+OPERATION_BUDGETS = {
+    "find_one": "read_timeout_ms",
+    "count_documents": "read_timeout_ms",
+    "insert_one": "write_timeout_ms",
+    "update_one": "write_timeout_ms",
+    "delete_one": "write_timeout_ms",
+    "find_one_and_update": "write_timeout_ms",
+    "insert_many": "bulk_timeout_ms",
+    "update_many": "bulk_timeout_ms",
+    "delete_many": "bulk_timeout_ms",
+    "bulk_write": "bulk_timeout_ms",
+    "create_index": "bulk_timeout_ms"
+}
+if STORAGE_CONFIG["backend"] not in ("mongodb", "memory"):
+    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_CONFIG['backend']!r} (expected 'mongodb' or 'memory')")
+
+# The app uses a subset of the Motor collection API (see app/database.py
+# for the collections). MemoryCollection implements that subset with the
+# same semantics and result types, so the rest of the app does not know
+# which backend it runs on.
+
+operation_timeouts_total = metrics.counter(
+    "mongo_operation_timeouts_total",
+    "Database operations that ran out of their time budget",
+    ["operation"]
+)
+checkout_wait_seconds = metrics.histogram(
+    "mongo_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+checkouts_total = metrics.counter(
+    "mongo_pool_checkouts_total",
+    "Connection checkouts, by result (ok, timeout, connectionError, poolClosed)",
+    ["result"]
+)
+pool_connections = metrics.gauge(
+    "mongo_pool_connections",
+    "Pooled connections, open and checked out",
+    ["state"]
+)
+pool_cleared_total = metrics.counter(
+    "mongo_pool_cleared_total",
+    "Times a connection pool was cleared (e.g. after a network error)"
+)
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool events as metrics; called from Motor's worker threads"""
+    def __init__(self):
+        self.open = 0
+        self.in_use = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        pool_connections.set_function(lambda: {("open",): self.open, ("in_use",): self.in_use})
+
+    def connection_check_out_started(self, event) -> None:
+        # A checkout runs start to finish on the thread that started it
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event) -> None:
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            checkout_wait_seconds.observe(time.perf_counter() - started)
+        checkouts_total.inc(result="ok")
+        with self._lock:
+            self.in_use += 1
+
+    def connection_check_out_failed(self, event) -> None:
+        checkouts_total.inc(result=str(event.reason))
+
+    def connection_checked_in(self, event) -> None:
+        with self._lock:
+            self.in_use -= 1
+
+    def connection_created(self, event) -> None:
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event) -> None:
+        with self._lock:
+            self.open -= 1
+
+    def pool_cleared(self, event) -> None:
+        pool_cleared_total.inc()
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_ready(self, event) -> None:
+        pass
+
+class MotorCollection:
+    """
+    A Motor collection whose operations each run within their time budget
+    (OPERATION_BUDGETS). Resolved on use, as the client is only created when
+    the app starts.
+    """
+    def __init__(self, storage: "MotorStorage", name: str):
+        self._storage = storage
+        self.name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        if self._storage.database is None:
+            raise RuntimeError("MongoDB is not connected yet (storage.connect() runs in the app lifespan)")
+        value = getattr(self._storage.database[self.name], attr)
+        if attr not in OPERATION_BUDGETS:
+            return value
+
+        budget = MONGO_CONFIG[OPERATION_BUDGETS[attr]] / 1000
+
+        async def budgeted(*args, **kwargs):
+            try:
+                with pymongo.timeout(budget):
+                    return await value(*args, **kwargs)
+            except PyMongoError as e:
+                if e.timeout:
+                    operation_timeouts_total.inc(operation=attr)
+                raise
+        return budgeted
+
+class MotorStorage:
+    """MongoDB through Motor; the client is created by connect()"""
+    name = "mongodb"
+
+    def __init__(self, url: Optional[str], database_name: Optional[str]):
+        self.url = url
+        self.database_name = database_name
+        self.client = None
+        self.database = None
+        self.pool_metrics = PoolMetrics()
+
+    def collection(self, name: str) -> MotorCollection:
+        return MotorCollection(self, name)
+
+    async def connect(self) -> None:
+        """Create the client, check the server answers and open warm connections"""
+        # Imported here so the in-memory backend never loads Motor
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        if not self.url:
+            raise ValueError("MONGODB_URL environment variable is required")
+        if not self.database_name:
+            raise ValueError("DATABASE_NAME environment variable is required")
+        print("Connecting to MongoDB...")
+        self.client = AsyncIOMotorClient(
+            self.url,
+            tlsCAFile=certifi.where(),
+            maxPoolSize=MONGO_CONFIG["max_pool_size"],
+            minPoolSize=MONGO_CONFIG["min_pool_size"],
+            maxIdleTimeMS=MONGO_CONFIG["max_idle_time_ms"],
+            connectTimeoutMS=MONGO_CONFIG["connect_timeout_ms"],
+            serverSelectionTimeoutMS=MONGO_CONFIG["server_selection_timeout_ms"],
+            timeoutMS=MONGO_CONFIG["timeout_ms"],
+            event_listeners=[self.pool_metrics]
+        )
+        self.database = self.client[self.database_name]
+        started = time.perf_counter()
+        try:
+            # The client's timeoutMS would override serverSelectionTimeoutMS
+            with pymongo.timeout(MONGO_CONFIG["server_selection_timeout_ms"] / 1000):
+                await self.ping()
+            # Concurrent pings each check out a connection, opening up to
+            # warm_connections of them now rather than on the first requests
+            warm = min(MONGO_CONFIG["warm_connections"], MONGO_CONFIG["max_pool_size"])
+            if warm > 1:
+                await asyncio.gather(*(self.ping() for _ in range(warm)), return_exceptions=True)
+        except Exception as e:
+            print(f"MongoDB connection error: {e}")
+            self.close()
+            raise
+        print(f"MongoDB connection successful ({self.pool_metrics.open} connections warm, "
+              f"{(time.perf_counter() - started) * 1000:.0f} ms)")
+
+    async def ping(self) -> None:
+        await self.client.admin.command("ping")
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+        self.client = None
+        self.database = None
+
+class MemoryStorage:
+    """Collections held in process memory"""
+    name = "memory"
+
+    def __init__(self):
+        self._collections: Dict[str, "MemoryCollection"] = {}
+
+    def collection(self, name: str) -> "MemoryCollection":
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    async def connect(self) -> None:
+        return None
+
+    async def ping(self) -> None:
+        return None
+
+    def close(self) -> None:
+        return None
+
+# Query matching
+
+_MISSING = object()
+
+def _copy(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+def _values(document: Any, path: List[str]) -> List[Any]:
+    """Values at a dotted path, descending into arrays as MongoDB does"""
+    if not path:
+        return [document]
+    if isinstance(document, dict):
+        if path[0] not in document:
+            return [_MISSING]
+        return _values(document[path[0]], path[1:])
+    if isinstance(document, list):
+        found = []
+        for item in document:
+            found.extend(value for value in _values(item, path) if value is not _MISSING)
+        return found or [_MISSING]
+    return [_MISSING]
+
+def _type_rank(value: Any) -> int:
+    if value is None or value is _MISSING:
+        return 0
+    if isinstance(value, bool):
+        return 4
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, datetime):
+        return 5
+    return 3
+
+def _comparable(a: Any, b: Any) -> bool:
+    return a is not _MISSING and b is not None and _type_rank(a) == _type_rank(b)
+
+def _equals(value: Any, expected: Any) -> bool:
+    if expected is None:
+        return value is None or value is _MISSING
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value is not _MISSING and value == expected
+
+def _match_operators(values: List[Any], condition: Dict[str, Any]) -> bool:
+    for operator, operand in condition.items():
+        if operator == "$exists":
+            if any(value is not _MISSING for value in values) != bool(operand):
+                return False
+        elif operator == "$in":
+            if not any(_equals(value, option) for value in values for option in operand):
+                return False
+        elif operator == "$nin":
+            if any(_equals(value, option) for value in values for option in operand):
+                return False
+        elif operator == "$ne":
+            if any(_equals(value, operand) for value in values):
+                return False
+        elif operator == "$eq":
+            if not any(_equals(value, operand) for value in values):
+                return False
+        elif operator in ("$gt", "$gte", "$lt", "$lte"):
+            def compare(value: Any) -> bool:
+                if isinstance(value, list):
+                    return any(compare(item) for item in value)
+                if not _comparable(value, operand):
+                    return False
+                return {"$gt": value > operand, "$gte": value >= operand,
+                        "$lt": value < operand, "$lte": value <= operand}[operator]
+            if not any(compare(value) for value in values):
+                return False
+        else:
+            raise NotImplementedError(f"Query operator {operator} is not supported by the memory backend")
+    return True
+
+def matches(document: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, option) for option in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, option) for option in condition):
+                return False
+        else:
+            values = _values(document, key.split("."))
+            if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+                if not _match_operators(values, condition):
+                    return False
+            elif not any(_equals(value, condition) for value in values):
+                return False
+    return True
+
+# Updates
+
+def _parent(document: Dict[str, Any], path: str, create: bool) -> Tuple[Optional[Dict[str, Any]], str]:
+    *parents, field = path.split(".")
+    for name in parents:
+        if name not in document:
+            if not create:
+                return None, field
+            document[name] = {}
+        document = document[name]
+    return document, field
+
+def apply_update(document: Dict[str, Any], update: Dict[str, Any], inserting: bool = False) -> None:
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            parent, field = _parent(document, path, create=operator != "$unset")
+            if operator in ("$set", "$setOnInsert"):
+                parent[field] = _copy(value)
+            elif operator == "$unset":
+                if parent is not None:
+                    parent.pop(field, None)
+            elif operator == "$inc":
+                parent[field] = parent.get(field, 0) + value
+            elif operator == "$max":
+                if field not in parent or parent[field] is None or value > parent[field]:
+                    parent[field] = value
+            elif operator == "$push":
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                parent.setdefault(field, []).extend(_copy(items))
+            else:
+                raise NotImplementedError(f"Update operator {operator} is not supported by the memory backend")
+
+def _project(document: Dict[str, Any], projection: Optional[Any]) -> Dict[str, Any]:
+    if not projection:
+        return _copy(document)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include = {field for field, flag in projection.items() if flag and field != "_id"}
+    if include:
+        result = {field: _copy(document[field]) for field in include if field in document}
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+    excluded = {field for field, flag in projection.items() if not flag}
+    return {field: _copy(value) for field, value in document.items() if field not in excluded}
+
+def _sort_key(spec: List[Tuple[str, int]]):
+    class Key:
+        __slots__ = ("values",)
+
+        def __init__(self, document: Dict[str, Any]):
+            self.values = []
+            for field, _ in spec:
+                value = _values(document, field.split("."))[0]
+                self.values.append((_type_rank(value), None if value is _MISSING else value))
+
+        def __lt__(self, other: "Key") -> bool:
+            for (field, direction), mine, theirs in zip(spec, self.values, other.values):
+                if mine == theirs:
+                    continue
+                less = mine[0] < theirs[0] if mine[0] != theirs[0] else mine[1] < theirs[1]
+                return less if direction > 0 else not less
+            return False
+    return Key
+
+def _sort_spec(key_or_list: Any, direction: int = 1) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction)]
+    return list(key_or_list)
+
+class MemoryCursor:
+    def __init__(self, collection: "MemoryCollection", query: Dict[str, Any], projection: Optional[Any]):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: Optional[List[Tuple[str, int]]] = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list: Any, direction: int = 1) -> "MemoryCursor":
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> "MemoryCursor":
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> "MemoryCursor":
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int) -> "MemoryCursor":
+        return self
+
+    def max_time_ms(self, max_time_ms: Optional[int]) -> "MemoryCursor":
+        return self
+
+    def _results(self) -> List[Dict[str, Any]]:
+        documents = self._collection._find(self._query, self._sort)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [_project(document, self._projection) for document in documents]
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        results = self._results()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._results():
+            yield document
+
+class MemoryCollection:
+    """
+    The Motor collection operations the app uses, over documents in a dict.
+    Indexes declared with create_index() become hash lookups on their first
+    field, and unique indexes are enforced.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._documents: Dict[Any, Dict[str, Any]] = {}
+        self._order: Dict[Any, int] = {}
+        self._sequence = count()
+        # field -> value -> _ids, for the first field of each index
+        self._lookup: Dict[str, Dict[Any, Set[Any]]] = {}
+        self._unique: List[Tuple[str, ...]] = []
+        self._indexes: Dict[str, Dict[str, Any]] = {}
+
+    # Indexes
+
+    async def create_index(self, keys: Any, unique: bool = False, **kwargs) -> str:
+        fields = tuple(field for field, _ in _sort_spec(keys))
+        if fields[0] not in self._lookup and fields[0] != "_id":
+            self._lookup[fields[0]] = {}
+            for document_id, document in self._documents.items():
+                self._index(document_id, document)
+        if unique and fields not in self._unique:
+            self._unique.append(fields)
+        name = "_".join(f"{field}_{direction}" for field, direction in _sort_spec(keys))
+        self._indexes[name] = {"key": _sort_spec(keys), "v": 2, **({"unique": True} if unique else {})}
+        return name
+
+    async def drop_index(self, name: str) -> None:
+        index = self._indexes.pop(name, None)
+        if index is None:
+            raise OperationFailure(f"index not found with name [{name}]", code=27)
+        fields = tuple(field for field, _ in index["key"])
+        if fields in self._unique:
+            self._unique.remove(fields)
+
+    async def index_information(self) -> Dict[str, Any]:
+        return {"_id_": {"key": [("_id", 1)], "v": 2}, **self._indexes}
+
+    def _index_values(self, field: str, document: Dict[str, Any]) -> List[Any]:
+        values = []
+        for value in _values(document, field.split(".")):
+            for item in value if isinstance(value, list) else [value]:
+                try:
+                    hash(item)
+                except TypeError:
+                    continue
+                values.append(None if item is _MISSING else item)
+        return values
+
+    def _index(self, document_id: Any, document: Dict[str, Any]) -> None:
+        for field, lookup in self._lookup.items():
+            for value in self._index_values(field, document):
+                lookup.setdefault(value, set()).add(document_id)
+
+    def _unindex(self, document_id: Any, document: Dict[str, Any]) -> None:
+        for field, lookup in self._lookup.items():
+            for value in self._index_values(field, document):
+                ids = lookup.get(value)
+                if ids is not None:
+                    ids.discard(document_id)
+                    if not ids:
+                        del lookup[value]
+
+    def _check_unique(self, document: Dict[str, Any], exclude: Any = _MISSING) -> None:
+        if "_id" not in document:
+            return
+        if exclude is _MISSING and document["_id"] in self._documents:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_",
+                                    11000, {"code": 11000, "keyValue": {"_id": document["_id"]}})
+        for fields in self._unique:
+            key = tuple(_values(document, field.split("."))[0] for field in fields)
+            if _MISSING in key:
+                continue
+            for other_id in self._candidates({fields[0]: key[0]}):
+                other = self._documents[other_id]
+                if other_id != exclude and other_id != document["_id"] and \
+                        tuple(_values(other, field.split("."))[0] for field in fields) == key:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {fields}",
+                                            11000, {"code": 11000, "keyValue": dict(zip(fields, key))})
+
+    # Reads
+
+    def _candidates(self, query: Dict[str, Any]) -> Iterable[Any]:
+        """_ids worth matching against the query, using _id or an index"""
+        for field, condition in query.items():
+            if field.startswith("$"):
+                continue
+            if field == "_id":
+                lookup_values = None
+            elif field in self._lookup:
+                lookup_values = self._lookup[field]
+            else:
+                continue
+            if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+                if set(condition) != {"$in"}:
+                    continue
+                options = condition["$in"]
+            else:
+                options = [condition]
+            ids: Set[Any] = set()
+            for option in options:
+                try:
+                    hash(option)
+                except TypeError:
+                    return self._documents.keys()
+                if lookup_values is None:
+                    if option in self._documents:
+                        ids.add(option)
+                else:
+                    ids.update(lookup_values.get(option, ()))
+            return ids
+        return self._documents.keys()
+
+    def _find(self, query: Dict[str, Any], sort: Optional[List[Tuple[str, int]]] = None) -> List[Dict[str, Any]]:
+        query = query or {}
+        candidates = self._candidates(query)
+        if candidates is not self._documents.keys():
+            candidates = sorted(candidates, key=self._order.__getitem__)
+        documents = [self._documents[document_id] for document_id in candidates
+                     if matches(self._documents[document_id], query)]
+        if sort:
+            documents.sort(key=_sort_key(sort))
+        return documents
+
+    def find(self, filter: Optional[Dict[str, Any]] = None, projection: Optional[Any] = None, **kwargs) -> MemoryCursor:
+        cursor = MemoryCursor(self, filter or {}, projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        return cursor
+
+    async def find_one(self, filter: Optional[Dict[str, Any]] = None, projection: Optional[Any] = None,
+                       sort: Optional[Any] = None, **kwargs) -> Optional[Dict[str, Any]]:
+        documents = self._find(filter or {}, _sort_spec(sort) if sort else None)
+        return _project(documents[0], projection) if documents else None
+
+    async def count_documents(self, filter: Dict[str, Any], **kwargs) -> int:
+        return len(self._find(filter))
+
+    # Writes
+
+    def _insert(self, document: Dict[str, Any]) -> Any:
+        document.setdefault("_id", ObjectId())
+        self._check_unique(document)
+        stored = _copy(document)
+        self._documents[stored["_id"]] = stored
+        self._order[stored["_id"]] = next(self._sequence)
+        self._index(stored["_id"], stored)
+        return stored["_id"]
+
+    def _replace(self, document_id: Any, updated: Dict[str, Any]) -> None:
+        self._check_unique(updated, exclude=document_id)
+        self._unindex(document_id, self._documents[document_id])
+        self._documents[document_id] = updated
+        self._index(document_id, updated)
+
+    def _upsert_document(self, query: Dict[str, Any]) -> Dict[str, Any]:
+        document = {}
+        for field, condition in query.items():
+            if field.startswith("$") or (isinstance(condition, dict) and any(op.startswith("$") for op in condition)):
+                continue
+            parent, name = _parent(document, field, create=True)
+            parent[name] = _copy(condition)
+        return document
+
+    def _update(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool,
+                many: bool, sort: Optional[List[Tuple[str, int]]] = None) -> Tuple[int, Any, Any, Any]:
+        """(matched, upserted _id, document before, document after)"""
+        documents = self._find(query, sort)
+        if not many:
+            documents = documents[:1]
+        if not documents:
+            if not upsert:
+                return 0, None, None, None
+            document = self._upsert_document(query)
+            apply_update(document, update, inserting=True)
+            self._insert(document)
+            return 0, document["_id"], None, self._documents[document["_id"]]
+        before = after = None
+        for document in documents:
+            updated = _copy(document)
+            apply_update(updated, update)
+            before, after = document, updated
+            self._replace(document["_id"], updated)
+        return len(documents), None, before, after
+
+    async def insert_one(self, document: Dict[str, Any], **kwargs) -> InsertOneResult:
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True, **kwargs) -> InsertManyResult:
+        errors = []
+        inserted = []
+        for index, document in enumerate(documents):
+            try:
+                inserted.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nInserted": len(inserted),
+                                  "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []})
+        return InsertManyResult(inserted, True)
+
+    async def update_one(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        matched, upserted_id, _, _ = self._update(filter, update, upsert, many=False)
+        return self._update_result(matched, upserted_id)
+
+    async def update_many(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        matched, upserted_id, _, _ = self._update(filter, update, upsert, many=True)
+        return self._update_result(matched, upserted_id)
+
+    @staticmethod
+    def _update_result(matched: int, upserted_id: Any) -> UpdateResult:
+        raw = {"n": matched + (1 if upserted_id is not None else 0), "nModified": matched, "ok": 1.0,
+               "updatedExisting": bool(matched)}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    async def find_one_and_update(self, filter: Dict[str, Any], update: Dict[str, Any],
+                                  projection: Optional[Any] = None, sort: Optional[Any] = None,
+                                  upsert: bool = False, return_document: bool = ReturnDocument.BEFORE,
+                                  **kwargs) -> Optional[Dict[str, Any]]:
+        _, _, before, after = self._update(filter, update, upsert, many=False,
+                                           sort=_sort_spec(sort) if sort else None)
+        document = after if return_document == ReturnDocument.AFTER else before
+        return _project(document, projection) if document is not None else None
+
+    async def delete_one(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, many=False), "ok": 1.0}, True)
+
+    async def delete_many(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, many=True), "ok": 1.0}, True)
+
+    def _delete(self, query: Dict[str, Any], many: bool) -> int:
+        documents = self._find(query)
+        if not many:
+            documents = documents[:1]
+        for document in documents:
+            self._unindex(document["_id"], document)
+            del self._documents[document["_id"]]
+            del self._order[document["_id"]]
+        return len(documents)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+                  "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany)):
+                    matched, upserted_id, _, _ = self._update(
+                        request._filter, request._doc, bool(request._upsert), many=isinstance(request, UpdateMany)
+                    )
+                    result["nMatched"] += matched
+                    result["nModified"] += matched
+                    if upserted_id is not None:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": upserted_id})
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    result["nRemoved"] += self._delete(request._filter, many=isinstance(request, DeleteMany))
+                else:
+                    raise NotImplementedError(f"{type(request).__name__} is not supported by the memory backend")
+            except DuplicateKeyError as e:
+                result["writeErrors"].append({"index": index, "code": 11000, "errmsg": str(e), "op": request})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
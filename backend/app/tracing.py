@@ -0,0 +1,368 @@
+# Lightweight request tracing: nested spans, Server-Timing and OTLP/JSON export
+import contextvars
+import json
+import os
+import queue
+import random
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+TRACING_CONFIG = {
+    # Where sampled traces go: "none", "console" or "file"
+    "export": os.getenv("TRACE_EXPORT", "none").lower(),
+    "file": os.getenv("TRACE_FILE", "traces.jsonl"),
+    # Fraction of requests exported; slow requests are always exported
+    "sample_rate": float(os.getenv("TRACE_SAMPLE_RATE", "0.01")),
+    "slow_ms": float(os.getenv("TRACE_SLOW_MS", "2000")),
+    "server_timing": os.getenv("TRACE_SERVER_TIMING", "true").lower() == "true",
+    "service_name": os.getenv("TRACE_SERVICE_NAME", "writing-tool-api")
+}
+
+class Span:
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any], kind: int = 1):
+        self.trace = trace
+        self.name = name
+        self.kind = kind  # OTLP SpanKind: 1 internal, 2 server
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self.end_ns is not None:
+            return
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+class _Accumulator:
+    """One span summarising many short, repeated operations (e.g. SSE encoding)"""
+    def __init__(self, span: Span):
+        self.span = span
+        self.count = 0
+        self.busy_ns = 0
+
+class Trace:
+    """Spans of one request. Spans may finish on worker threads."""
+    def __init__(self, trace_id: Optional[str] = None, remote_parent_id: Optional[str] = None, sampled: bool = False):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.remote_parent_id = remote_parent_id
+        self.sampled = sampled
+        self.spans: List[Span] = []
+        self.accumulators: Dict[str, _Accumulator] = {}
+        self._lock = threading.Lock()
+
+    def new_span(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any], kind: int = 1) -> Span:
+        span = Span(self, name, parent_id, attributes, kind)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def server_timing(self, root: Span) -> str:
+        """Server-Timing header: total time spent per span name, root excluded"""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            spans = [span for span in self.spans if span is not root and span.end_ns is not None]
+        for span in spans:
+            # Accumulated spans count their busy time, not their wall-clock extent
+            duration = span.attributes.get("busy_ms", span.duration_ms)
+            totals[span.name] = totals.get(span.name, 0.0) + duration
+        entries = [f"{_token(name)};dur={duration:.1f}" for name, duration in totals.items()]
+        entries.append(f"total;dur={root.duration_ms:.1f}")
+        return ", ".join(entries)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [span.to_otlp() for span in self.spans]
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", TRACING_CONFIG["service_name"])]},
+            "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": spans}]
+        }]}
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("span", default=None)
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+def _token(name: str) -> str:
+    # Server-Timing metric names are HTTP tokens
+    return "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in name)
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+def start_span(name: str, **attributes: Any) -> Optional[Span]:
+    """
+    Start a span under the current one without making it current, for work
+    that outlives a block (e.g. a stream consumed elsewhere). End it yourself.
+    Returns None outside a traced request.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    parent = _current_span.get()
+    return trace.new_span(name, parent.span_id if parent else trace.remote_parent_id, attributes)
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Time a block as a child of the current span; a no-op outside a traced request"""
+    current = start_span(name, **attributes)
+    if current is None:
+        yield None
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+@contextmanager
+def accumulate(name: str) -> Iterator[None]:
+    """
+    Add the block's time to a single span per request named `name`, for
+    operations repeated too often to trace one by one
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter_ns() - started
+        accumulator = trace.accumulators.get(name)
+        if accumulator is None:
+            accumulator = trace.accumulators[name] = _Accumulator(start_span(name))
+        accumulator.count += 1
+        accumulator.busy_ns += elapsed
+        accumulator.span.set(count=accumulator.count, busy_ms=round(accumulator.busy_ns / 1e6, 3))
+        accumulator.span.end_ns = time.time_ns()
+
+def traced_iterator(name: str, iterable: Iterable[Any], **attributes: Any) -> Iterator[Any]:
+    """Span covering the consumption of an iterator, noting when the first item arrived"""
+    current = start_span(name, **attributes)
+    if current is None:
+        yield from iterable
+        return
+    items = 0
+    try:
+        for item in iterable:
+            if items == 0:
+                current.set(first_item_ms=round(current.duration_ms, 3))
+            items += 1
+            yield item
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        current.set(items=items)
+        current.end()
+
+# Traced Motor collections
+
+_COLLECTION_OPS = {
+    "find_one", "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "find_one_and_update", "find_one_and_replace",
+    "find_one_and_delete", "count_documents", "bulk_write", "create_index", "distinct"
+}
+
+class TracedCursor:
+    """Motor cursor whose iteration is recorded as one span"""
+    def __init__(self, cursor: Any, name: str):
+        self._cursor = cursor
+        self._name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        value = getattr(self._cursor, attr)
+        if not callable(value):
+            return value
+
+        def chained(*args, **kwargs):
+            result = value(*args, **kwargs)
+            # Builder methods (sort, limit, skip, ...) return the cursor itself
+            return self if result is self._cursor else result
+        return chained
+
+    async def to_list(self, *args, **kwargs):
+        with span(self._name, **{"db.operation": "find"}):
+            return await self._cursor.to_list(*args, **kwargs)
+
+    async def __aiter__(self):
+        current = start_span(self._name, **{"db.operation": "find"})
+        documents = 0
+        try:
+            async for document in self._cursor:
+                documents += 1
+                yield document
+        finally:
+            if current is not None:
+                current.set(documents=documents)
+                current.end()
+
+class TracedCollection:
+    """Wraps a Motor collection so each operation becomes a span"""
+    def __init__(self, collection: Any):
+        self._collection = collection
+        self._prefix = f"db.{collection.name}"
+
+    def __getattr__(self, attr: str) -> Any:
+        value = getattr(self._collection, attr)
+        if attr in ("find", "aggregate"):
+            return lambda *args, **kwargs: TracedCursor(value(*args, **kwargs), f"{self._prefix}.{attr}")
+        if attr not in _COLLECTION_OPS:
+            return value
+
+        async def traced(*args, **kwargs):
+            with span(f"{self._prefix}.{attr}", **{"db.operation": attr}):
+                return await value(*args, **kwargs)
+        return traced
+
+# Export
+
+_export_queue: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
+_exporter: Optional[threading.Thread] = None
+_exporter_lock = threading.Lock()
+
+def _export_worker() -> None:
+    while True:
+        payload = _export_queue.get()
+        line = json.dumps(payload, default=str)
+        try:
+            if TRACING_CONFIG["export"] == "file":
+                with open(TRACING_CONFIG["file"], "a") as f:
+                    f.write(line + "\n")
+            else:
+                print(line, file=sys.stderr)
+        except Exception as e:
+            print(f"Warning: Could not export trace: {e}")
+
+def export(trace: Trace) -> None:
+    """Queue a finished trace for export on a background thread"""
+    global _exporter
+    if TRACING_CONFIG["export"] not in ("console", "file"):
+        return
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = threading.Thread(target=_export_worker, name="trace-export", daemon=True)
+            _exporter.start()
+    _export_queue.put(trace.to_otlp())
+
+_HEX_DIGITS = frozenset("0123456789abcdef")
+
+def _is_hex(value: str, length: int) -> bool:
+    return len(value) == length and set(value) <= _HEX_DIGITS
+
+def _parse_traceparent(value: Optional[str]):
+    """
+    (trace_id, parent_span_id, sampled) from a W3C traceparent header, or
+    Nones if it is missing or malformed, so a new trace is started
+    """
+    if not value:
+        return None, None, None
+    parts = value.strip().split("-")
+    if len(parts) < 4:
+        return None, None, None
+    version, trace_id, parent_id, flags = parts[:4]
+    # Version ff is invalid; version 00 has exactly four fields, later
+    # versions may append more
+    if not _is_hex(version, 2) or version == "ff" or (version == "00" and len(parts) != 4):
+        return None, None, None
+    if not (_is_hex(trace_id, 32) and _is_hex(parent_id, 16) and _is_hex(flags, 2)):
+        return None, None, None
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None, None, None
+    return trace_id, parent_id, int(flags, 16) & 1 == 1
+
+class TracingMiddleware:
+    """
+    ASGI middleware that opens a root span per HTTP request, adds a
+    Server-Timing header with the stages finished before the response
+    started, and exports sampled and slow requests once the body is sent
+    (so streamed responses are traced to their end).
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        trace_id, parent_id, sampled = _parse_traceparent(headers.get("traceparent"))
+        if sampled is None:
+            sampled = random.random() < TRACING_CONFIG["sample_rate"]
+        trace = Trace(trace_id, parent_id, sampled)
+        route = scope.get("path", "")
+        root = trace.new_span(f"{scope['method']} {route}", parent_id, {
+            "http.method": scope["method"], "http.target": route
+        }, kind=2)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root)
+        finished = False
+
+        async def traced_send(message):
+            nonlocal finished
+            if message["type"] == "http.response.start":
+                root.set(**{"http.status_code": message["status"]})
+                extra = [(b"traceparent", f"00-{trace.trace_id}-{root.span_id}-{'01' if trace.sampled else '00'}".encode())]
+                if TRACING_CONFIG["server_timing"]:
+                    extra.append((b"server-timing", trace.server_timing(root).encode("latin-1")))
+                message = {**message, "headers": list(message.get("headers", [])) + extra}
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                finished = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, traced_send)
+        except BaseException as e:
+            root.end(e)
+            raise
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            root.end()
+            if trace.sampled or root.duration_ms >= TRACING_CONFIG["slow_ms"] or not finished:
+                export(trace)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Database round trips per endpoint
+
+Calls each documents endpoint in turn against the app in-process and counts
+the MongoDB commands it sends, using pymongo command monitoring. For every
+endpoint it reports commands per request, serial round trips (commands that
+had to wait for one another, i.e. what latency is made of) and latency.
+Requests run one at a time so every command belongs to the request in flight.
+
+Needs a reachable MongoDB (MONGODB_URL/DATABASE_NAME); run it against a remote
+cluster to see how latency follows serial round trips. Data it creates is
+deleted at the end.
+
+Run: python db_roundtrips.py --requests 20 --save baselines/roundtrips.json
+     python db_roundtrips.py --requests 20 --compare baselines/roundtrips.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from pymongo import monitoring
+
+# Commands that are not part of handling a request
+IGNORED_COMMANDS = {"ping", "createIndexes", "endSessions", "hello", "isMaster", "killCursors"}
+
+class CommandRecorder(monitoring.CommandListener):
+    """Collects (command, start, end) for every command sent by the process"""
+    def __init__(self):
+        self.commands: List[Tuple[str, float, float]] = []
+        self._started: Dict[Tuple[Any, int], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event) -> None:
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        name = f"{event.command_name} {event.command.get(event.command_name)}"
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (name, time.perf_counter())
+
+    def _finished(self, event) -> None:
+        with self._lock:
+            started = self._started.pop((event.connection_id, event.request_id), None)
+            if started is not None:
+                self.commands.append((started[0], started[1], time.perf_counter()))
+
+    succeeded = _finished
+    failed = _finished
+
+    def take(self) -> List[Tuple[str, float, float]]:
+        with self._lock:
+            commands, self.commands = self.commands, []
+        return commands
+
+def serial_round_trips(commands: List[Tuple[str, float, float]]) -> int:
+    """Number of stages when overlapping (concurrent) commands count once"""
+    stages = 0
+    stage_end = None
+    for _, start, end in sorted(commands, key=lambda command: command[1]):
+        if stage_end is None or start >= stage_end:
+            stages += 1
+            stage_end = end
+        else:
+            stage_end = max(stage_end, end)
+    return stages
+
+class Bench:
+    def __init__(self, client: httpx.AsyncClient, recorder: CommandRecorder):
+        self.client = client
+        self.recorder = recorder
+        self.results: Dict[str, List[Dict[str, Any]]] = {}
+
+    async def call(self, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        # Let background work of the previous request (e.g. revisions) settle
+        await asyncio.sleep(0.05)
+        self.recorder.take()
+        started = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0.01)
+        commands = self.recorder.take()
+        if response.status_code >= 400:
+            raise RuntimeError(f"{endpoint}: {method} {url} returned {response.status_code}: {response.text}")
+        self.results.setdefault(endpoint, []).append({
+            "commands": len(commands),
+            "serial": serial_round_trips(commands),
+            "latency_s": elapsed,
+            "names": [name for name, _, _ in sorted(commands, key=lambda command: command[1])]
+        })
+        return response
+
+async def run_bench(args: argparse.Namespace, recorder: CommandRecorder) -> Dict[str, Any]:
+    from app.main import app
+
+    paragraph = "The evidence suggests that early investment lowers long-term costs. "
+    transport = httpx.ASGITransport(app=app)
+    created: List[str] = []
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60.0) as client:
+            bench = Bench(client, recorder)
+            returning_user = f"bench-{uuid.uuid4().hex[:8]}"
+            for i in range(args.requests):
+                new_user = f"bench-{uuid.uuid4().hex[:8]}"
+                response = await bench.call("create_document (new user)", "POST", "/api/documents/",
+                                            json={"user_id": new_user, "title": f"Essay {i}"})
+                created.append(response.json()["id"])
+                response = await bench.call("create_document", "POST", "/api/documents/",
+                                            json={"user_id": returning_user, "title": f"Essay {i}"})
+                document_id = response.json()["id"]
+                created.append(document_id)
+
+                content = paragraph * (i + 1)
+                response = await bench.call("save_document", "PUT", f"/api/documents/{document_id}",
+                                            json={"content": content})
+                version = response.json()["version"]
+                await bench.call("patch_document", "PATCH", f"/api/documents/{document_id}", json={
+                    "base_version": version,
+                    "changes": [{"type": "insert", "start_pos": len(content), "end_pos": len(content), "new_text": "More."}]
+                })
+                await bench.call("get_content", "GET", f"/api/documents/{document_id}/content")
+                await bench.call("get_title", "GET", f"/api/documents/{document_id}/title")
+                await bench.call("add_chat_message", "POST", f"/api/documents/{document_id}/chat-message",
+                                 json={"role": "user", "content": "How can I improve my thesis?"})
+                await bench.call("get_chat_history", "GET", f"/api/documents/{document_id}/chat-history")
+                await bench.call("list_documents", "GET", f"/api/documents/user/{returning_user}")
+
+            for document_id in created:
+                await bench.call("delete_document", "DELETE", f"/api/documents/{document_id}")
+            # The users created are left in place; they hold no content
+
+    return {
+        "config": {
+            "requests": args.requests,
+            "autosave": os.environ.get("AUTOSAVE_ENABLED"),
+            # Host only; never the credentials
+            "mongodb_host": (os.environ.get("MONGODB_URL") or "").split("://", 1)[-1].rsplit("@", 1)[-1].split("/")[0]
+        },
+        "endpoints": {endpoint: _summarize(samples) for endpoint, samples in bench.results.items()}
+    }
+
+def _summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    latencies = sorted(sample["latency_s"] for sample in samples)
+    return {
+        "requests": len(samples),
+        "commands": round(sum(sample["commands"] for sample in samples) / len(samples), 2),
+        "serial_round_trips": round(sum(sample["serial"] for sample in samples) / len(samples), 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        # Commands of the last request, in order, to see what the endpoint does
+        "example": samples[-1]["names"]
+    }
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None, verbose: bool = False) -> None:
+    print(f"\nMongoDB round trips per request ({report['config']['requests']} iterations, "
+          f"autosave={report['config']['autosave']}, host={report['config']['mongodb_host']})\n")
+    header = f"{'endpoint':<28}{'commands':>10}{'serial':>8}{'p50 ms':>10}{'max ms':>10}"
+    if baseline:
+        header += f"{'serial (base)':>15}{'p50 (base)':>12}"
+    print(header)
+    for endpoint, stats in report["endpoints"].items():
+        line = f"{endpoint:<28}{stats['commands']:>10}{stats['serial_round_trips']:>8}{stats['p50_ms']:>10}{stats['max_ms']:>10}"
+        base = (baseline or {}).get("endpoints", {}).get(endpoint)
+        if base:
+            line += f"{base['serial_round_trips']:>15}{base['p50_ms']:>12}"
+        print(line)
+        if verbose:
+            print(f"{'':<4}{', '.join(stats['example']) or '(no database commands)'}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Count MongoDB round trips per documents endpoint")
+    parser.add_argument("--requests", type=int, default=10, help="Iterations of the endpoint sequence")
+    parser.add_argument("--autosave", action="store_true",
+                        help="Keep autosave buffering on (saves then cost no round trips until flushed)")
+    parser.add_argument("--verbose", action="store_true", help="List the commands of each endpoint")
+    parser.add_argument("--save", help="Write the report to this JSON file as a baseline")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    args = parser.parse_args()
+
+    os.environ["AUTOSAVE_ENABLED"] = "true" if args.autosave else "false"
+    os.environ.setdefault("LLM_WARM_ON_STARTUP", "false")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # Registered before the app creates its Mongo client
+    recorder = CommandRecorder()
+    monitoring.register(recorder)
+
+    report = asyncio.run(run_bench(args, recorder))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline, verbose=args.verbose)
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved report to {args.save}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Groq, Anthropic and Gemini APIs (and Cloudinary uploads)
+
+Serves the endpoints app/llm.py calls, with configurable time-to-first-token,
+tokens/sec and error injection, so routing and streaming code can be
+load-tested offline. Point the backend at it with:
+
+    LLM_BASE_URL=http://localhost:9100 uvicorn app.main:app
+
+Modes:
+    synthetic  deterministic generated text (default)
+    record     proxy to the real APIs and save every exchange as a cassette
+    replay     serve cassettes with their recorded timing
+
+Run: python llm_stub.py --port 9100 [--mode replay --cassettes cassettes/]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Real APIs proxied in record mode (LLM_STUB_<PROVIDER>_UPSTREAM overrides)
+UPSTREAMS = {
+    provider: os.getenv(f"LLM_STUB_{provider.upper()}_UPSTREAM", url)
+    for provider, url in {
+        "groq": "https://api.groq.com",
+        "anthropic": "https://api.anthropic.com",
+        "gemini": "https://generativelanguage.googleapis.com"
+    }.items()
+}
+
+# Request headers forwarded upstream in record mode
+FORWARDED_HEADERS = {"authorization", "x-api-key", "anthropic-version", "anthropic-beta", "x-goog-api-key", "content-type"}
+
+WORDS = (
+    "the essay argues that evidence from recent studies supports a clear thesis while "
+    "acknowledging counterarguments and limitations of the available data in each section"
+).split()
+
+# Stub behaviour, adjustable at runtime via POST /_stub/config
+CONFIG: Dict[str, Any] = {
+    "mode": os.getenv("LLM_STUB_MODE", "synthetic"),
+    "ttft_ms": float(os.getenv("LLM_STUB_TTFT_MS", "300")),
+    "tokens_per_sec": float(os.getenv("LLM_STUB_TOKENS_PER_SEC", "80")),
+    "response_tokens": int(os.getenv("LLM_STUB_RESPONSE_TOKENS", "120")),
+    "error_rate": float(os.getenv("LLM_STUB_ERROR_RATE", "0")),
+    "error_status": int(os.getenv("LLM_STUB_ERROR_STATUS", "503")),
+    "retry_after_s": float(os.getenv("LLM_STUB_RETRY_AFTER", "1")),
+    "cassettes": os.getenv("LLM_STUB_CASSETTES", "cassettes"),
+    "replay_speed": float(os.getenv("LLM_STUB_REPLAY_SPEED", "1.0")),
+    "seed": int(os.getenv("LLM_STUB_SEED", "0")),
+}
+
+app = FastAPI(title="LLM Stub", version="1.0.0")
+_rng = random.Random(CONFIG["seed"])
+_stats = {"requests": 0, "errors_injected": 0, "replayed": 0, "recorded": 0, "replay_misses": 0}
+
+def _request_hash(provider: str, path: str, body: Dict[str, Any]) -> str:
+    encoded = json.dumps({"provider": provider, "path": path, "body": body}, sort_keys=True)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:24]
+
+def _cassette_path(provider: str, key: str) -> str:
+    return os.path.join(CONFIG["cassettes"], f"{provider}-{key}.json")
+
+def _response_tokens(key: str) -> List[str]:
+    """Deterministic text for a request: same request, same answer"""
+    rng = random.Random(key)
+    return [rng.choice(WORDS) + " " for _ in range(CONFIG["response_tokens"])]
+
+def _prompt_text(body: Dict[str, Any]) -> str:
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        parts.append(content if isinstance(content, str) else json.dumps(content))
+    for content in body.get("contents", []):
+        parts.extend(part.get("text", "") for part in content.get("parts", []))
+    return "\n".join(parts)
+
+async def _paced(tokens: List[str]) -> AsyncIterator[str]:
+    """Yield tokens after the configured TTFT, at the configured rate, in ~20ms batches"""
+    await asyncio.sleep(CONFIG["ttft_ms"] / 1000.0)
+    per_token = 1.0 / CONFIG["tokens_per_sec"] if CONFIG["tokens_per_sec"] > 0 else 0.0
+    batch: List[str] = []
+    due = time.monotonic()
+    for token in tokens:
+        batch.append(token)
+        due += per_token
+        if due - time.monotonic() >= 0.02 or token is tokens[-1]:
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+def _injected_error(provider: str) -> Optional[JSONResponse]:
+    if CONFIG["error_rate"] <= 0 or _rng.random() >= CONFIG["error_rate"]:
+        return None
+    _stats["errors_injected"] += 1
+    status = CONFIG["error_status"]
+    headers = {"retry-after": str(CONFIG["retry_after_s"])} if status == 429 else {}
+    if provider == "anthropic":
+        body = {"type": "error", "error": {"type": "overloaded_error", "message": "Injected by llm_stub"}}
+    else:
+        body = {"error": {"code": status, "message": "Injected by llm_stub", "status": "UNAVAILABLE"}}
+    return JSONResponse(body, status_code=status, headers=headers)
+
+def _sse(data: Any, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+# Synthetic responses in each provider's wire format
+
+def _analysis(prompt: str) -> str:
+    simple = len(prompt) < 160
+    return json.dumps({"use_simple_model": simple, "reason": "llm_stub heuristic on query length", "confidence": 7})
+
+async def _groq(body: Dict[str, Any], key: str):
+    model = body.get("model", "stub")
+    prompt = _prompt_text(body)
+    if "query complexity analyzer" in prompt:
+        tokens = [_analysis(body["messages"][-1]["content"])]
+    else:
+        tokens = _response_tokens(key)
+    usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(tokens), "total_tokens": len(prompt) // 4 + len(tokens)}
+    base = {"id": f"chatcmpl-{key}", "created": int(time.time()), "model": model}
+
+    if not body.get("stream"):
+        await asyncio.sleep((CONFIG["ttft_ms"] + 1000.0 * len(tokens) / max(CONFIG["tokens_per_sec"], 1e-9)) / 1000.0)
+        return JSONResponse({**base, "object": "chat.completion", "usage": usage, "choices": [{
+            "index": 0, "finish_reason": "stop",
+            "message": {"role": "assistant", "content": "".join(tokens)}
+        }]})
+
+    async def events():
+        async for text in _paced(tokens):
+            yield _sse({**base, "object": "chat.completion.chunk", "choices": [{
+                "index": 0, "finish_reason": None, "delta": {"content": text}
+            }]})
+        yield _sse({**base, "object": "chat.completion.chunk", "x_groq": {"usage": usage}, "choices": [{
+            "index": 0, "finish_reason": "stop", "delta": {}
+        }]})
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+async def _anthropic(body: Dict[str, Any], key: str):
+    model = body.get("model", "stub")
+    tokens = _response_tokens(key)
+    input_tokens = len(_prompt_text(body) + str(body.get("system", ""))) // 4
+    message = {"id": f"msg_{key}", "type": "message", "role": "assistant", "model": model,
+               "stop_reason": None, "stop_sequence": None,
+               "usage": {"input_tokens": input_tokens, "output_tokens": 0}}
+
+    if not body.get("stream"):
+        await asyncio.sleep((CONFIG["ttft_ms"] + 1000.0 * len(tokens) / max(CONFIG["tokens_per_sec"], 1e-9)) / 1000.0)
+        return JSONResponse({**message, "stop_reason": "end_turn",
+                             "content": [{"type": "text", "text": "".join(tokens)}],
+                             "usage": {"input_tokens": input_tokens, "output_tokens": len(tokens)}})
+
+    async def events():
+        yield _sse({"type": "message_start", "message": {**message, "content": []}}, "message_start")
+        yield _sse({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}, "content_block_start")
+        async for text in _paced(tokens):
+            yield _sse({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}}, "content_block_delta")
+        yield _sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        yield _sse({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                    "usage": {"output_tokens": len(tokens)}}, "message_delta")
+        yield _sse({"type": "message_stop"}, "message_stop")
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+async def _gemini(body: Dict[str, Any], key: str, stream: bool):
+    tokens = _response_tokens(key)
+
+    def candidate(text: str) -> Dict[str, Any]:
+        # finishReason 1 is STOP (the SDK asks for integer enums)
+        return {"candidates": [{"index": 0, "finishReason": 1,
+                                "content": {"role": "model", "parts": [{"text": text}]}}]}
+
+    if not stream:
+        await asyncio.sleep((CONFIG["ttft_ms"] + 1000.0 * len(tokens) / max(CONFIG["tokens_per_sec"], 1e-9)) / 1000.0)
+        return JSONResponse(candidate("".join(tokens)))
+
+    async def events():
+        # The REST transport streams a JSON array of responses
+        first = True
+        yield "["
+        async for text in _paced(tokens):
+            yield ("" if first else ",") + json.dumps(candidate(text))
+            first = False
+        yield "]"
+    return StreamingResponse(events(), media_type="application/json")
+
+# Record / replay
+
+async def _record(provider: str, path: str, request: Request, body: Dict[str, Any], key: str):
+    """Proxy to the real API, streaming through while saving a cassette"""
+    headers = {name: value for name, value in request.headers.items() if name.lower() in FORWARDED_HEADERS}
+    url = UPSTREAMS[provider] + path + (f"?{request.url.query}" if request.url.query else "")
+    client = httpx.AsyncClient(timeout=httpx.Timeout(300.0, connect=10.0))
+    upstream = await client.send(client.build_request("POST", url, headers=headers, json=body), stream=True)
+    started = time.monotonic()
+    chunks: List[List[Any]] = []
+
+    async def relay():
+        try:
+            async for text in upstream.aiter_text():
+                chunks.append([round(time.monotonic() - started, 4), text])
+                yield text
+        finally:
+            await upstream.aclose()
+            await client.aclose()
+            os.makedirs(CONFIG["cassettes"], exist_ok=True)
+            with open(_cassette_path(provider, key), "w") as f:
+                json.dump({
+                    "provider": provider, "path": path, "request": body,
+                    "status": upstream.status_code,
+                    "content_type": upstream.headers.get("content-type", "application/json"),
+                    "chunks": chunks
+                }, f, indent=1)
+            _stats["recorded"] += 1
+
+    return StreamingResponse(relay(), status_code=upstream.status_code,
+                             media_type=upstream.headers.get("content-type", "application/json"))
+
+def _replay(provider: str, key: str):
+    path = _cassette_path(provider, key)
+    if not os.path.exists(path):
+        _stats["replay_misses"] += 1
+        return None
+    with open(path) as f:
+        cassette = json.load(f)
+    _stats["replayed"] += 1
+    speed = CONFIG["replay_speed"] or 1.0
+
+    async def chunks():
+        started = time.monotonic()
+        for offset, text in cassette["chunks"]:
+            await asyncio.sleep(max(0.0, started + offset / speed - time.monotonic()))
+            yield text
+    return StreamingResponse(chunks(), status_code=cassette["status"], media_type=cassette["content_type"])
+
+async def _handle(provider: str, path: str, request: Request, synthetic):
+    _stats["requests"] += 1
+    body = await request.json()
+    key = _request_hash(provider, path, body)
+    mode = CONFIG["mode"]
+    if mode == "record":
+        return await _record(provider, path, request, body, key)
+    if mode == "replay":
+        replayed = _replay(provider, key)
+        if replayed is not None:
+            return replayed
+        # Fall through to synthetic output for requests never recorded
+    error = _injected_error(provider)
+    if error is not None:
+        return error
+    return await synthetic(body, key)
+
+@app.post("/openai/v1/chat/completions")
+async def groq_chat_completions(request: Request):
+    return await _handle("groq", "/openai/v1/chat/completions", request, _groq)
+
+@app.post("/v1/messages")
+async def anthropic_messages(request: Request):
+    return await _handle("anthropic", "/v1/messages", request, _anthropic)
+
+@app.post("/v1beta/models/{model_method:path}")
+async def gemini_generate(model_method: str, request: Request):
+    stream = model_method.endswith(":streamGenerateContent")
+    return await _handle("gemini", f"/v1beta/models/{model_method}", request,
+                         lambda body, key: _gemini(body, key, stream))
+
+@app.get("/v1beta/models/{model}")
+async def gemini_get_model(model: str):
+    # Used by the backend's connection warm-up
+    return {"name": f"models/{model}", "displayName": model}
+
+@app.post("/v1_1/{cloud_name}/image/upload")
+async def cloudinary_upload(cloud_name: str, request: Request):
+    # Stand-in for Cloudinary uploads (CLOUDINARY_UPLOAD_PREFIX), so load
+    # tests exercise the upload route without an account
+    _stats["requests"] += 1
+    size = len(await request.body())
+    public_id = f"writing-tool-images/stub-{hashlib.sha256(str(time.time_ns()).encode()).hexdigest()[:12]}"
+    await asyncio.sleep(CONFIG["ttft_ms"] / 1000.0)
+    return {
+        "public_id": public_id, "width": 800, "height": 600, "format": "png", "bytes": size,
+        "resource_type": "image", "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "secure_url": f"https://res.cloudinary.com/{cloud_name}/image/upload/{public_id}.png"
+    }
+
+@app.head("/")
+@app.get("/")
+async def root():
+    return {"message": "LLM stub is running", "mode": CONFIG["mode"]}
+
+@app.get("/_stub/stats")
+async def stub_stats():
+    return {"config": CONFIG, "stats": _stats}
+
+@app.post("/_stub/config")
+async def update_stub_config(changes: Dict[str, Any]):
+    """Change stub behaviour between benchmark phases"""
+    for name, value in changes.items():
+        if name in CONFIG:
+            CONFIG[name] = type(CONFIG[name])(value)
+    if "seed" in changes:
+        _rng.seed(CONFIG["seed"])
+    return {"config": CONFIG}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Groq, Anthropic and Gemini APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--mode", choices=["synthetic", "record", "replay"], default=CONFIG["mode"])
+    parser.add_argument("--ttft-ms", type=float, default=CONFIG["ttft_ms"])
+    parser.add_argument("--tokens-per-sec", type=float, default=CONFIG["tokens_per_sec"])
+    parser.add_argument("--response-tokens", type=int, default=CONFIG["response_tokens"])
+    parser.add_argument("--error-rate", type=float, default=CONFIG["error_rate"])
+    parser.add_argument("--error-status", type=int, default=CONFIG["error_status"])
+    parser.add_argument("--cassettes", default=CONFIG["cassettes"])
+    parser.add_argument("--replay-speed", type=float, default=CONFIG["replay_speed"])
+    parser.add_argument("--seed", type=int, default=CONFIG["seed"])
+    args = parser.parse_args()
+
+    for name in ("mode", "ttft_ms", "tokens_per_sec", "response_tokens", "error_rate",
+                 "error_status", "cassettes", "replay_speed", "seed"):
+        CONFIG[name] = getattr(args, name)
+    _rng.seed(CONFIG["seed"])
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Load test for the Writing Tool API
+
+Drives mixed traffic from simulated students (document create, list, load and
+save, chat streaming, edit+diff and image upload) and reports throughput,
+p50/p95/p99 latency and event-loop lag per route.
+
+By default the app is served in-process (uvicorn on this event loop) against
+the LLM stub (llm_stub.py, started automatically) and the in-memory storage
+backend, so only the app's own costs are measured and no database is needed.
+Pass --mongo to use the database configured by MONGODB_URL/DATABASE_NAME
+instead, or --base-url to load a running server.
+
+Run: python load_test.py --users 50 --duration 60 --save baselines/current.json
+     python load_test.py --users 50 --duration 60 --compare baselines/current.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+# Relative weights of each action in the traffic mix
+TRAFFIC_MIX = {
+    "list_documents": 10,
+    "load_document": 15,
+    "save_document": 35,
+    "chat_stream": 15,
+    "edit_diff": 15,
+    "image_upload": 5,
+    "create_document": 5
+}
+
+PARAGRAPH = (
+    "Climate policy has to balance the cost of acting now against the cost of waiting. "
+    "Recent studies suggest that early investment in renewable energy lowers long-term costs, "
+    "although the evidence varies by region and by sector."
+)
+
+CHAT_PROMPTS = [
+    "Fix the grammar in my introduction",
+    "What is a thesis statement?",
+    "Rewrite the second paragraph so the argument about renewable energy costs is more persuasive and cites the evidence",
+    "Suggest a stronger conclusion for this essay that ties the economic and environmental arguments together",
+    "Give me a synonym for 'important'"
+]
+
+# 1x1 PNG
+PNG_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c63000100000500010d0a2db40000000049454e44ae426082"
+)
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class LoopLagMonitor:
+    """Samples event-loop lag: how late a short sleep wakes up"""
+    def __init__(self, interval_s: float = 0.01):
+        self.interval_s = interval_s
+        self.times: List[float] = []
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            now = time.perf_counter()
+            self.times.append(now)
+            self.lags.append(max(0.0, now - started - self.interval_s))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def max_between(self, start: float, end: float) -> float:
+        """Worst lag sampled while a request was in flight"""
+        lo = bisect_left(self.times, start)
+        hi = bisect_right(self.times, end + self.interval_s)
+        return max(self.lags[lo:hi], default=0.0)
+
+class Results:
+    def __init__(self):
+        # route -> list of (start, end, ok, extra)
+        self.samples: Dict[str, List[Tuple[float, float, bool, Dict[str, float]]]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+
+    def record(self, route: str, start: float, ok: bool, error: str = "", **extra: float) -> None:
+        self.samples.setdefault(route, []).append((start, time.perf_counter(), ok, extra))
+        if not ok:
+            counts = self.errors.setdefault(route, {})
+            counts[error] = counts.get(error, 0) + 1
+
+    def summary(self, elapsed: float, lag: LoopLagMonitor) -> Dict[str, Any]:
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            latencies = sorted(end - start for start, end, ok, _ in samples if ok)
+            lags = sorted(lag.max_between(start, end) for start, end, _, _ in samples)
+            stats = {
+                "requests": len(samples),
+                "errors": sum(1 for sample in samples if not sample[2]),
+                "throughput_rps": round(len(latencies) / elapsed, 2),
+                "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+                "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+                "max_ms": round((latencies[-1] if latencies else 0.0) * 1000, 1),
+                "loop_lag_p99_ms": round(_percentile(lags, 0.99) * 1000, 1),
+                "loop_lag_max_ms": round((lags[-1] if lags else 0.0) * 1000, 1)
+            }
+            extras = sorted({name for _, _, ok, extra in samples if ok for name in extra})
+            for name in extras:
+                values = sorted(extra[name] for _, _, ok, extra in samples if ok and name in extra)
+                stats[f"{name}_p50_ms"] = round(_percentile(values, 0.50) * 1000, 1)
+                stats[f"{name}_p99_ms"] = round(_percentile(values, 0.99) * 1000, 1)
+            if route in self.errors:
+                stats["error_types"] = self.errors[route]
+            routes[route] = stats
+
+        all_lags = sorted(lag.lags)
+        total = sum(stats["requests"] for stats in routes.values())
+        return {
+            "routes": routes,
+            "totals": {
+                "requests": total,
+                "errors": sum(stats["errors"] for stats in routes.values()),
+                "throughput_rps": round(sum(stats["throughput_rps"] for stats in routes.values()), 2),
+                "loop_lag_p50_ms": round(_percentile(all_lags, 0.50) * 1000, 1),
+                "loop_lag_p99_ms": round(_percentile(all_lags, 0.99) * 1000, 1),
+                "loop_lag_max_ms": round((all_lags[-1] if all_lags else 0.0) * 1000, 1)
+            }
+        }
+
+class Student:
+    """One simulated user working on a few documents"""
+    def __init__(self, index: int, client: httpx.AsyncClient, results: Results, rng: random.Random, think_s: float):
+        self.user_id = f"loadtest-user-{index}"
+        self.client = client
+        self.results = results
+        self.rng = rng
+        self.think_s = think_s
+        self.documents: List[str] = []
+        self.content: Dict[str, str] = {}
+
+    async def _request(self, route: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except Exception as e:
+            self.results.record(route, start, False, type(e).__name__)
+            return None
+        ok = response.status_code < 400
+        self.results.record(route, start, ok, str(response.status_code))
+        return response if ok else None
+
+    async def create_document(self) -> None:
+        response = await self._request("POST /api/documents/", "POST", "/api/documents/",
+                                       json={"user_id": self.user_id, "title": f"Essay {len(self.documents) + 1}"})
+        if response is not None:
+            document_id = response.json()["id"]
+            self.documents.append(document_id)
+            self.content[document_id] = ""
+
+    def _document(self) -> str:
+        return self.rng.choice(self.documents)
+
+    async def list_documents(self) -> None:
+        await self._request("GET /api/documents/user/{user_id}", "GET", f"/api/documents/user/{self.user_id}")
+
+    async def load_document(self) -> None:
+        await self._request("GET /api/documents/{id}/content", "GET", f"/api/documents/{self._document()}/content")
+
+    async def save_document(self) -> None:
+        document_id = self._document()
+        # Autosave: the essay grows a sentence or two at a time
+        content = self.content[document_id] + " " + PARAGRAPH[: self.rng.randint(40, len(PARAGRAPH))]
+        if len(content) > 20000:
+            content = PARAGRAPH
+        response = await self._request("PUT /api/documents/{id}", "PUT", f"/api/documents/{document_id}",
+                                       json={"content": content})
+        if response is not None:
+            self.content[document_id] = content
+
+    async def chat_stream(self) -> None:
+        document_id = self._document()
+        route = "POST /api/chat/message/stream"
+        start = time.perf_counter()
+        first_chunk = None
+        try:
+            async with self.client.stream("POST", "/api/chat/message/stream", json={
+                "message": self.rng.choice(CHAT_PROMPTS),
+                "document_content": self.content[document_id],
+                "document_id": document_id,
+                "user_id": self.user_id
+            }) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    self.results.record(route, start, False, str(response.status_code))
+                    return
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data = json.loads(line[6:])
+                    if isinstance(data, dict) and data.get("type") == "error":
+                        self.results.record(route, start, False, "stream_error")
+                        return
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter() - start
+        except Exception as e:
+            self.results.record(route, start, False, type(e).__name__)
+            return
+        self.results.record(route, start, True, **({"ttft": first_chunk} if first_chunk is not None else {}))
+
+    async def edit_diff(self) -> None:
+        # An accepted AI edit: diff the old and new text, then save the result
+        document_id = self._document()
+        old = self.content[document_id] or PARAGRAPH
+        words = old.split()
+        for _ in range(max(1, len(words) // 20)):
+            words[self.rng.randrange(len(words))] = self.rng.choice(["notably", "however", "evidence", "costs"])
+        new = " ".join(words)
+        response = await self._request("POST /api/diff/compute", "POST", "/api/diff/compute",
+                                       json={"old_content": old, "new_content": new, "granularity": "word"})
+        if response is not None:
+            saved = await self._request("PUT /api/documents/{id}", "PUT", f"/api/documents/{document_id}",
+                                        json={"content": new})
+            if saved is not None:
+                self.content[document_id] = new
+
+    async def image_upload(self) -> None:
+        await self._request("POST /api/images/upload", "POST", "/api/images/upload",
+                            files={"file": ("figure.png", PNG_BYTES, "image/png")})
+
+    async def run(self, deadline: float) -> None:
+        await self.create_document()
+        actions = list(TRAFFIC_MIX)
+        weights = [TRAFFIC_MIX[action] for action in actions]
+        while time.perf_counter() < deadline:
+            if not self.documents:
+                await self.create_document()
+                continue
+            action = self.rng.choices(actions, weights)[0]
+            await getattr(self, action)()
+            await asyncio.sleep(self.rng.expovariate(1.0 / self.think_s) if self.think_s > 0 else 0)
+
+async def _cleanup(client: httpx.AsyncClient, students: List[Student]) -> None:
+    for student in students:
+        for document_id in student.documents:
+            try:
+                await client.delete(f"/api/documents/{document_id}")
+            except Exception:
+                pass
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    results = Results()
+    lag = LoopLagMonitor()
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+
+    server = server_task = None
+    base_url = args.base_url
+    if not base_url:
+        # In-process uvicorn on this event loop, so loop lag includes the server.
+        # (httpx's ASGITransport buffers whole responses, hiding stream timing.)
+        import uvicorn
+        from app.main import app
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            if server_task.done():
+                server_task.result()
+            await asyncio.sleep(0.05)
+        base_url = f"http://127.0.0.1:{port}"
+    client = httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits)
+
+    rng = random.Random(args.seed)
+    students = [Student(i, client, results, random.Random(rng.random()), args.think_time) for i in range(args.users)]
+    lag.start()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    try:
+        # Ramp users up over the first tenth of the run
+        ramp = args.duration / 10.0 / max(1, args.users)
+        tasks = []
+        for student in students:
+            tasks.append(asyncio.create_task(student.run(deadline)))
+            await asyncio.sleep(ramp)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    finally:
+        await lag.stop()
+        if not args.keep_data:
+            await _cleanup(client, students)
+        await client.aclose()
+        if server is not None:
+            server.should_exit = True
+            await server_task
+
+    report = results.summary(elapsed, lag)
+    report["meta"] = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "git_commit": _git_commit(),
+        "target": args.base_url or "in-process",
+        "storage": None if args.base_url else ("mongodb" if args.mongo else "memory"),
+        "users": args.users,
+        "duration_s": args.duration,
+        "think_time_s": args.think_time,
+        "seed": args.seed,
+        "traffic_mix": TRAFFIC_MIX
+    }
+    return report
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    columns = ["requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "loop_lag_p99_ms"]
+    print(f"\n{'route':<38}" + "".join(f"{column:>16}" for column in columns))
+    for route, stats in report["routes"].items():
+        line = f"{route:<38}"
+        for column in columns:
+            value = stats.get(column, 0)
+            cell = f"{value}"
+            old = (baseline or {}).get("routes", {}).get(route, {}).get(column)
+            if old:
+                cell += f" ({(value - old) / old * 100:+.0f}%)"
+            line += f"{cell:>16}"
+        print(line)
+        if "ttft_p50_ms" in stats:
+            print(f"{'':<38}ttft p50 {stats['ttft_p50_ms']} ms, p99 {stats['ttft_p99_ms']} ms")
+        if "error_types" in stats:
+            print(f"{'':<38}errors: {stats['error_types']}")
+    totals = report["totals"]
+    print(f"\nTotal: {totals['requests']} requests, {totals['errors']} errors, {totals['throughput_rps']} req/s")
+    print(f"Event-loop lag: p50 {totals['loop_lag_p50_ms']} ms, p99 {totals['loop_lag_p99_ms']} ms, "
+          f"max {totals['loop_lag_max_ms']} ms")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mixed-traffic load test for the Writing Tool API")
+    parser.add_argument("--base-url", help="Load a running server instead of the app in-process")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent simulated students")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean pause between a student's actions")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mongo", action="store_true",
+                        help="Serve in-process against MONGODB_URL/DATABASE_NAME instead of in-memory storage")
+    parser.add_argument("--llm-stub-url", help="LLM stub to use in-process (default: start llm_stub.py)")
+    parser.add_argument("--stub-ttft-ms", type=float, default=300.0)
+    parser.add_argument("--stub-tokens-per-sec", type=float, default=80.0)
+    parser.add_argument("--keep-data", action="store_true", help="Do not delete the documents created")
+    parser.add_argument("--save", help="Write the report to this JSON file as a baseline")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    args = parser.parse_args()
+
+    stub = None
+    if not args.base_url:
+        stub_url = args.llm_stub_url
+        if not stub_url:
+            port = _free_port()
+            stub_url = f"http://127.0.0.1:{port}"
+            stub = subprocess.Popen([
+                sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_stub.py"),
+                "--port", str(port), "--ttft-ms", str(args.stub_ttft_ms),
+                "--tokens-per-sec", str(args.stub_tokens_per_sec)
+            ])
+            for _ in range(50):
+                try:
+                    httpx.get(stub_url, timeout=1.0)
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.1)
+        # Must be set before the app (and its provider clients) is imported
+        os.environ["LLM_BASE_URL"] = stub_url
+        os.environ["STORAGE_BACKEND"] = "mongodb" if args.mongo else "memory"
+        os.environ["CLOUDINARY_UPLOAD_PREFIX"] = stub_url
+        os.environ.setdefault("CLOUDINARY_CLOUD_NAME", "loadtest")
+        for key in ("GROQ_API_KEY", "ANTHROPIC_API_KEY", "GOOGLE_API_KEY", "CLOUDINARY_API_KEY", "CLOUDINARY_API_SECRET"):
+            os.environ.setdefault(key, "loadtest")
+
+    try:
+        report = asyncio.run(run_load(args))
+    finally:
+        if stub is not None:
+            stub.terminate()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Tests for the autosave write-behind buffer (app/autosave.py)
+
+Runs against the in-memory storage backend, so no database is needed.
+
+Run: python test_autosave.py    (or: python -m pytest test_autosave.py)
+"""
+
+import asyncio
+import os
+import uuid
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from app.autosave import AutosaveBuffer, flush_conflicts_total, flushes_total
+from app.database import documents_collection
+
+def _new_document(version: int = 0) -> str:
+    document_id = str(uuid.uuid4())
+    asyncio.run(documents_collection.insert_one(
+        {"_id": document_id, "user_id": "u", "title": "T", "content": "", "version": version, "images": []}
+    ))
+    return document_id
+
+def _stored(document_id: str) -> dict:
+    return asyncio.run(documents_collection.find_one({"_id": document_id}))
+
+def test_burst_is_written_once():
+    document_id = _new_document()
+    buffer = AutosaveBuffer(documents_collection)
+
+    async def run():
+        for i in range(5):
+            saved = await buffer.save(document_id, {"content": f"draft {i}"})
+        assert saved["version"] == 5
+        assert (await documents_collection.find_one({"_id": document_id}))["content"] == ""
+        await buffer.flush(document_id)
+    asyncio.run(run())
+
+    stored = _stored(document_id)
+    assert stored["content"] == "draft 4" and stored["version"] == 5
+    assert buffer.get(document_id) is None
+
+def test_images_are_not_buffered():
+    document_id = _new_document()
+    buffer = AutosaveBuffer(documents_collection)
+
+    async def run():
+        await buffer.save(document_id, {"content": "typing"})
+        # An image upload during the burst goes straight to the database
+        await documents_collection.update_one({"_id": document_id}, {"$push": {"images": {"publicId": "p"}}})
+        assert "images" not in buffer.get(document_id)
+        await buffer.flush(document_id)
+    asyncio.run(run())
+
+    assert _stored(document_id)["images"] == [{"publicId": "p"}]
+
+def test_newer_version_from_another_worker_is_rebased():
+    document_id = _new_document()
+    buffer = AutosaveBuffer(documents_collection)
+    rebased = flush_conflicts_total.value(result="rebased")
+
+    async def run():
+        await buffer.save(document_id, {"content": "mine"})
+        # Another worker's counter is ahead of this one
+        await documents_collection.update_one({"_id": document_id}, {"$set": {"content": "theirs", "version": 7}})
+        await buffer.flush(document_id)
+        assert buffer.get(document_id) is None
+        # Later saves are acknowledged above the version written
+        assert (await buffer.save(document_id, {"content": "next"}))["version"] == 9
+    asyncio.run(run())
+
+    stored = _stored(document_id)
+    assert stored["content"] == "mine" and stored["version"] == 8
+    assert flush_conflicts_total.value(result="rebased") == rebased + 1
+
+def test_deleted_document_is_dropped_without_counting_a_flush():
+    document_id = _new_document()
+    buffer = AutosaveBuffer(documents_collection)
+    flushed = flushes_total.value(reason="manual")
+
+    async def run():
+        await buffer.save(document_id, {"content": "lost cause"})
+        await documents_collection.delete_one({"_id": document_id})
+        await buffer.flush(document_id)
+    asyncio.run(run())
+
+    assert buffer.get(document_id) is None
+    assert flushes_total.value(reason="manual") == flushed
+    assert _stored(document_id) is None
+
+def test_failed_write_stays_buffered():
+    document_id = _new_document()
+
+    class Failing:
+        def __getattr__(self, name):
+            return getattr(documents_collection, name)
+
+        async def update_one(self, *args, **kwargs):
+            raise RuntimeError("database unavailable")
+
+    buffer = AutosaveBuffer(Failing())
+
+    async def run():
+        await buffer.save(document_id, {"content": "kept"})
+        await buffer.flush(document_id)
+    asyncio.run(run())
+
+    assert buffer.get(document_id)["content"] == "kept"
+    assert _stored(document_id)["content"] == ""
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
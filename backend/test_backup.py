@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Tests for export and import of a user's documents (app/backup.py and the
+export/import routes)
+
+Runs the app in-process against the in-memory storage backend, so no
+database or API keys are needed.
+
+Run: python test_backup.py    (or: python -m pytest test_backup.py)
+"""
+
+import io
+import json
+import os
+import uuid
+import zipfile
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("LLM_WARM_ON_STARTUP", "false")
+
+from fastapi.testclient import TestClient
+
+from app.database import content_chunks_collection
+from app.main import app
+
+LARGE = "\n\n".join(f"Paragraph {i} " + "lorem ipsum " * 50 for i in range(100))
+
+def _seed(client: TestClient, user_id: str) -> list:
+    """Three documents, one large enough to be chunked, each with some chat"""
+    ids = []
+    for i, content in enumerate(["short one", LARGE, "short three"]):
+        document_id = client.post("/api/documents/", json={"user_id": user_id, "title": f"Doc {i}"}).json()["id"]
+        client.put(f"/api/documents/{document_id}", json={"content": content})
+        for j in range(i + 1):
+            client.post(f"/api/documents/{document_id}/chat-message", json={"role": "user", "content": f"m{i}-{j}"})
+        ids.append(document_id)
+    return ids
+
+def _state(client: TestClient, document_id: str) -> tuple:
+    content = client.get(f"/api/documents/{document_id}/content").json()["content"]
+    history = client.get(f"/api/documents/{document_id}/chat-history").json()["messages"]
+    return content, [message["content"] for message in history]
+
+def _chunk_count(client: TestClient) -> int:
+    return client.portal.call(content_chunks_collection.count_documents, {})
+
+def _records(export: bytes) -> list:
+    return [json.loads(line) for line in export.splitlines() if line.strip()]
+
+def _import(client: TestClient, user_id: str, body: bytes, **kwargs):
+    return client.post(f"/api/documents/user/{user_id}/import", content=body, **kwargs)
+
+def test_ndjson_and_zip_round_trip():
+    source, target = str(uuid.uuid4()), str(uuid.uuid4())
+    with TestClient(app) as client:
+        ids = _seed(client, source)
+        for params, headers in (({}, {"content-type": "application/x-ndjson"}),
+                                ({"format": "zip"}, {"content-type": "application/zip"})):
+            export = client.get(f"/api/documents/user/{source}/export", params=params).content
+            result = _import(client, target, export, headers=headers).json()
+
+            assert result["imported"] == 3 and result["skipped"] == 0
+            assert set(result["id_map"]) == set(ids)
+            for exported_id, imported_id in result["id_map"].items():
+                assert imported_id != exported_id
+                assert _state(client, imported_id) == _state(client, exported_id)
+
+def test_keep_ids_reimport_skips_existing_and_keeps_their_chunks():
+    user_id = str(uuid.uuid4())
+    with TestClient(app) as client:
+        ids = _seed(client, user_id)
+        before = {document_id: _state(client, document_id) for document_id in ids}
+        chunks = _chunk_count(client)
+        export = client.get(f"/api/documents/user/{user_id}/export").content
+
+        result = _import(client, user_id, export, params={"keep_ids": True}).json()
+
+        assert result["imported"] == 0 and result["skipped"] == 3
+        assert _chunk_count(client) == chunks
+        assert {document_id: _state(client, document_id) for document_id in ids} == before
+
+def test_malformed_record_rejects_the_whole_import():
+    source, target = str(uuid.uuid4()), str(uuid.uuid4())
+    with TestClient(app) as client:
+        _seed(client, source)
+        lines = client.get(f"/api/documents/user/{source}/export").content.splitlines()
+
+        response = _import(client, target, b"\n".join(lines[:-1] + [b"{not json"]))
+
+        assert response.status_code == 400
+        assert "not valid JSON" in response.json()["detail"]
+        assert client.get(f"/api/documents/user/{target}").json()["documents"] == []
+
+def test_bad_date_is_rejected_and_listing_keeps_working():
+    source, target = str(uuid.uuid4()), str(uuid.uuid4())
+    with TestClient(app) as client:
+        _seed(client, source)
+        records = _records(client.get(f"/api/documents/user/{source}/export").content)
+        documents = [record for record in records if record["type"] == "document"]
+        documents[0]["updated_at"] = "last tuesday"
+        documents[1]["created_at"] = "2024-03-01T12:00:00+02:00"
+        body = "\n".join(json.dumps(record) for record in records).encode()
+
+        response = _import(client, target, body)
+        assert response.status_code == 400 and "last tuesday" in response.json()["detail"]
+        assert client.get(f"/api/documents/user/{target}").status_code == 200
+
+        documents[0]["updated_at"] = None
+        result = _import(client, target, "\n".join(json.dumps(record) for record in records).encode()).json()
+        assert result["imported"] == 3
+        listing = client.get(f"/api/documents/user/{target}")
+        assert listing.status_code == 200 and len(listing.json()["documents"]) == 3
+        created = [document["created_at"] for document in listing.json()["documents"]]
+        # Offsets are converted to UTC, as stored dates are
+        assert "2024-03-01T10:00:00" in created
+
+def test_broken_archive_is_a_400():
+    with TestClient(app) as client:
+        response = _import(client, str(uuid.uuid4()), b"not a zip", headers={"content-type": "application/zip"})
+        assert response.status_code == 400
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr("documents/x.json", "{}")
+        response = _import(client, str(uuid.uuid4()), buffer.getvalue(), headers={"content-type": "application/zip"})
+        assert response.status_code == 400 and "manifest" in response.json()["detail"]
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Tests for the bucketed chat message store (app/chat_store.py)
+
+Runs against the in-memory storage backend, so no database is needed.
+
+Run: python test_chat_store.py    (or: python -m pytest test_chat_store.py)
+"""
+
+import asyncio
+import os
+import uuid
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from app.chat_store import CHAT_STORE_CONFIG, append_messages, get_messages, import_messages
+from app.database import chat_history_collection, chat_messages_collection
+
+def _messages(count: int, prefix: str = "m") -> list:
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{prefix}{i}"} for i in range(count)]
+
+def _buckets(document_id: str) -> list:
+    async def run():
+        return await chat_messages_collection.find({"document_id": document_id}).sort("bucket", 1).to_list(length=None)
+    return asyncio.run(run())
+
+def _all_pages(document_id: str, limit: int) -> list:
+    async def run():
+        pages, before = [], None
+        while True:
+            page = await get_messages(document_id, limit=limit, before=before)
+            pages.append(page["messages"])
+            before = page["next_before"]
+            if before is None:
+                return pages
+    return asyncio.run(run())
+
+def _with_bucket_size(size: int, test) -> None:
+    previous = CHAT_STORE_CONFIG["bucket_size"]
+    CHAT_STORE_CONFIG["bucket_size"] = size
+    try:
+        test()
+    finally:
+        CHAT_STORE_CONFIG["bucket_size"] = previous
+
+def test_messages_fill_fixed_size_buckets():
+    def run():
+        document_id = str(uuid.uuid4())
+        seqs = asyncio.run(append_messages(document_id, _messages(25)))
+
+        assert seqs == list(range(1, 26))
+        buckets = _buckets(document_id)
+        assert [(bucket["bucket"], bucket["count"]) for bucket in buckets] == [(0, 10), (1, 10), (2, 5)]
+        assert [message["seq"] for message in buckets[1]["messages"]] == list(range(11, 21))
+    _with_bucket_size(10, run)
+
+def test_pages_walk_back_across_buckets():
+    def run():
+        document_id = str(uuid.uuid4())
+        asyncio.run(append_messages(document_id, _messages(25)))
+
+        pages = _all_pages(document_id, limit=7)
+        assert [len(page) for page in pages] == [7, 7, 7, 4]
+        seqs = [message["seq"] for page in reversed(pages) for message in page]
+        assert seqs == list(range(1, 26))
+        assert asyncio.run(get_messages(document_id, limit=7))["total"] == 25
+    _with_bucket_size(10, run)
+
+def test_concurrent_appends_get_distinct_seqs():
+    document_id = str(uuid.uuid4())
+
+    async def run():
+        return await asyncio.gather(*(append_messages(document_id, _messages(3, prefix=f"w{i}-")) for i in range(5)))
+    reserved = asyncio.run(run())
+
+    seqs = sorted(seq for batch in reserved for seq in batch)
+    assert seqs == list(range(1, 16))
+    assert all(batch == list(range(batch[0], batch[0] + 3)) for batch in reserved)
+
+def test_legacy_history_is_migrated_before_new_messages():
+    document_id = str(uuid.uuid4())
+    asyncio.run(chat_history_collection.insert_one({
+        "_id": document_id, "document_id": document_id, "messages": _messages(3, prefix="old")
+    }))
+    asyncio.run(append_messages(document_id, _messages(2, prefix="new")))
+
+    page = asyncio.run(get_messages(document_id))
+
+    assert [message["seq"] for message in page["messages"]] == [-3, -2, -1, 1, 2]
+    assert [message["content"] for message in page["messages"]] == ["old0", "old1", "old2", "new0", "new1"]
+    assert page["total"] == 5 and page["next_before"] is None
+    head = asyncio.run(chat_history_collection.find_one({"_id": document_id}))
+    assert "messages" not in head and head["legacy_count"] == 3
+
+def test_reimport_does_not_duplicate_messages():
+    document_id = str(uuid.uuid4())
+    history = [{**message, "seq": seq} for seq, message in zip([-1, 1, 2], _messages(3))]
+
+    asyncio.run(import_messages({document_id: history}))
+    asyncio.run(import_messages({document_id: history}))
+
+    page = asyncio.run(get_messages(document_id))
+    assert [message["seq"] for message in page["messages"]] == [-1, 1, 2]
+    assert page["total"] == 3
+    # New messages continue after the imported ones
+    assert asyncio.run(append_messages(document_id, _messages(1))) == [3]
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
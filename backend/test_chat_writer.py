@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Tests for batched chat persistence (app/chat_writer.py)
+
+Runs against the in-memory storage backend, so no database is needed.
+
+Run: python test_chat_writer.py    (or: python -m pytest test_chat_writer.py)
+"""
+
+import asyncio
+import os
+import uuid
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("LLM_WARM_ON_STARTUP", "false")
+
+from fastapi.testclient import TestClient
+
+import app.chat_writer as chat_writer_module
+import app.routers.chat as chat_router
+from app.chat_store import get_messages
+from app.chat_writer import ChatWriter, chat_writer, dropped_messages_total
+from app.llm import LLMResponse
+from app.main import app
+
+def _turn(text: str) -> list:
+    return [{"role": "user", "content": text}, {"role": "assistant", "content": f"re: {text}"}]
+
+def _contents(document_id: str) -> list:
+    page = asyncio.run(get_messages(document_id, limit=100))
+    return [message["content"] for message in page["messages"]] if page else []
+
+def test_turns_are_written_in_order():
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    writer = ChatWriter()
+    writer.add(first, _turn("a"))
+    writer.add(second, _turn("x"))
+    writer.add(first, _turn("b"))
+    asyncio.run(writer.flush())
+
+    assert _contents(first) == ["a", "re: a", "b", "re: b"]
+    assert _contents(second) == ["x", "re: x"]
+    assert writer.queued_count() == 0
+
+def _failing_for(poisoned: set, failures: list):
+    write_messages = chat_writer_module.write_messages
+
+    async def failing(numbered):
+        if any(document_id in poisoned for document_id, _ in numbered):
+            failures.append([document_id for document_id, _ in numbered])
+            raise RuntimeError("rejected")
+        await write_messages(numbered)
+    return failing
+
+def test_failed_write_is_retried():
+    document_id = str(uuid.uuid4())
+    writer = ChatWriter()
+    original = chat_writer_module.write_messages
+    failures = []
+    chat_writer_module.write_messages = _failing_for({document_id}, failures)
+    try:
+        writer.add(document_id, _turn("retry me"))
+        asyncio.run(writer.flush())
+        assert writer.queued_count() == 2
+    finally:
+        chat_writer_module.write_messages = original
+    asyncio.run(writer.flush())
+
+    assert _contents(document_id) == ["retry me", "re: retry me"]
+    assert writer.queued_count() == 0
+
+def test_poison_document_is_dropped_without_blocking_others():
+    poisoned, healthy = str(uuid.uuid4()), str(uuid.uuid4())
+    writer = ChatWriter(max_attempts=3)
+    dropped = dropped_messages_total.value()
+    original = chat_writer_module.write_messages
+    failures = []
+    chat_writer_module.write_messages = _failing_for({poisoned}, failures)
+    try:
+        writer.add(poisoned, _turn("bad"))
+        writer.add(healthy, _turn("good"))
+        # The shared batch fails; the healthy document is written on the retry
+        asyncio.run(writer.flush())
+        asyncio.run(writer.flush())
+        assert _contents(healthy) == ["good", "re: good"]
+        asyncio.run(writer.flush())
+        asyncio.run(writer.flush())
+    finally:
+        chat_writer_module.write_messages = original
+
+    assert writer.queued_count() == 0
+    assert len(failures) == 3
+    assert dropped_messages_total.value() == dropped + 2
+    assert _contents(poisoned) == []
+
+def test_failed_llm_call_is_not_saved_as_a_turn():
+    original = chat_router.get_llm_response
+    replies = iter([
+        LLMResponse(response="I apologize, but I encountered an error processing your request.", used_model="error"),
+        LLMResponse(response="A thesis states your argument.", used_model="groq")
+    ])
+    chat_router.get_llm_response = lambda **kwargs: next(replies)
+    try:
+        with TestClient(app) as client:
+            document_id = client.post("/api/documents/", json={"user_id": "u", "title": "T"}).json()["id"]
+            for message in ("first try", "What is a thesis?"):
+                response = client.post("/api/chat/message", json={"message": message, "document_id": document_id})
+                assert response.status_code == 200
+            client.portal.call(chat_writer.flush)
+            history = client.get(f"/api/documents/{document_id}/chat-history").json()["messages"]
+    finally:
+        chat_router.get_llm_response = original
+
+    assert [message["content"] for message in history] == ["What is a thesis?", "A thesis states your argument."]
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
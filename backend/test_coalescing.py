@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Tests for coalescing of identical in-flight requests (app/coalescing.py)
+
+Run: python test_coalescing.py    (or: python -m pytest test_coalescing.py)
+"""
+
+import asyncio
+import threading
+import time
+
+from app.coalescing import SingleFlight, StreamFanout, request_key
+
+def test_request_key_ignores_key_order():
+    assert request_key({"a": 1, "b": [1, 2]}) == request_key({"b": [1, 2], "a": 1})
+    assert request_key({"a": 1}) != request_key({"a": 2})
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("k", fetch) for _ in range(5)))
+        other = await flight.do("other", fetch)
+        return results, other
+    results, other = asyncio.run(run())
+
+    assert results == ["answer"] * 5 and other == "answer"
+    assert len(calls) == 2 and flight.coalesced == 4
+    assert flight.in_flight() == 0
+
+def test_single_flight_shares_the_exception_and_forgets_it():
+    flight = SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("provider down")
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+        retried = await asyncio.gather(flight.do("k", failing), return_exceptions=True)
+        return results + retried
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, RuntimeError) and str(result) == "provider down" for result in results)
+    # Failures are not cached: the later call runs again
+    assert len(calls) == 2
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        leaving = asyncio.create_task(flight.do("k", slow))
+        staying = asyncio.create_task(flight.do("k", slow))
+        await asyncio.sleep(0.01)
+        leaving.cancel()
+        return await staying
+    assert asyncio.run(run()) == "done"
+
+class Upstream:
+    """A blocking event stream, like a provider stream pumped on the threadpool"""
+    def __init__(self, events: int, gap: float):
+        self.events = events
+        self.gap = gap
+        self.calls = 0
+        self.yielded = 0
+        self.closed = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        return self._stream()
+
+    def _stream(self):
+        try:
+            for i in range(self.events):
+                time.sleep(self.gap)
+                self.yielded += 1
+                yield i
+        finally:
+            self.closed.set()
+
+def test_late_subscriber_gets_the_whole_stream():
+    fanout = StreamFanout()
+    upstream = Upstream(events=10, gap=0.01)
+
+    async def collect(delay):
+        await asyncio.sleep(delay)
+        return [event async for event in fanout.subscribe("k", upstream)]
+
+    async def run():
+        return await asyncio.gather(collect(0), collect(0.05))
+    early, late = asyncio.run(run())
+
+    assert early == late == list(range(10))
+    assert upstream.calls == 1 and fanout.coalesced == 1
+    assert fanout.in_flight() == 0
+
+def test_upstream_error_reaches_every_subscriber():
+    fanout = StreamFanout()
+
+    def failing():
+        yield "partial"
+        raise RuntimeError("cut off")
+
+    async def collect():
+        received = []
+        try:
+            async for event in fanout.subscribe("k", failing):
+                received.append(event)
+        except RuntimeError as e:
+            return received, str(e)
+
+    async def run():
+        return await asyncio.gather(collect(), collect())
+    assert asyncio.run(run()) == [(["partial"], "cut off")] * 2
+
+def test_pump_stops_when_every_subscriber_leaves():
+    fanout = StreamFanout()
+    upstream = Upstream(events=10000, gap=0.005)
+
+    async def run():
+        subscribers = [fanout.subscribe("k", upstream) for _ in range(2)]
+        for subscriber in subscribers:
+            await subscriber.__anext__()
+        for subscriber in subscribers:
+            await subscriber.aclose()
+        for _ in range(100):
+            if fanout.in_flight() == 0 and upstream.closed.is_set():
+                break
+            await asyncio.sleep(0.01)
+    asyncio.run(run())
+
+    assert upstream.closed.is_set() and fanout.in_flight() == 0
+    assert upstream.yielded < 100
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
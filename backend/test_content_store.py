@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Tests for chunked storage of large document content (app/content_store.py)
+
+Runs against the in-memory storage backend, so no database is needed.
+
+Run: python test_content_store.py    (or: python -m pytest test_content_store.py)
+"""
+
+import asyncio
+import os
+import random
+import time
+import uuid
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from app.content_store import (
+    CONTENT_STORE_CONFIG, chunks_written_total, discard_chunks, is_large, load_content, prune_chunks,
+    read_range, split_chunks, store_content
+)
+from app.database import content_chunks_collection
+
+def _essay(paragraphs: int, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    words = ["energy", "policy", "cost", "climate", "evidence", "region", "sector", "renewable"]
+    return "".join(
+        " ".join(rng.choice(words) for _ in range(rng.randint(20, 120))) + "\n\n"
+        for _ in range(paragraphs)
+    )
+
+def _chunk_ids(document_id: str) -> set:
+    async def run():
+        return {doc["_id"] async for doc in content_chunks_collection.find({"document_id": document_id}, {"_id": 1})}
+    return asyncio.run(run())
+
+def test_split_round_trips_on_paragraph_boundaries():
+    content = _essay(300)
+    chunks = split_chunks(content, 2048)
+
+    assert "".join(chunks) == content
+    assert len(chunks) > 10
+    for chunk in chunks[:-1]:
+        assert chunk.endswith("\n") and len(chunk) >= 1024
+
+def test_edit_changes_only_nearby_chunks():
+    content = _essay(300)
+    paragraphs = content.split("\n\n")
+    paragraphs[150] += " an inserted sentence"
+    edited = "\n\n".join(paragraphs)
+
+    before, after = split_chunks(content, 2048), split_chunks(edited, 2048)
+
+    assert len(set(after) - set(before)) <= 2
+
+def test_huge_paragraph_is_split():
+    content = "x" * 10000
+    chunks = split_chunks(content, 1000)
+
+    assert "".join(chunks) == content
+    assert max(len(chunk) for chunk in chunks) <= 2000
+
+def test_store_and_load_round_trip_with_reuse():
+    document_id = str(uuid.uuid4())
+    content = _essay(400)
+    assert is_large(content) and not is_large("short")
+
+    fields = asyncio.run(store_content(document_id, content))
+    assert fields["content"] == "" and fields["content_chunks"]
+    loaded = asyncio.run(load_content({"_id": document_id, **fields}))
+    assert loaded["content"] == content
+
+    reused = chunks_written_total.value(result="reused")
+    again = asyncio.run(store_content(document_id, content, previous=fields["content_chunks"]))
+    assert again == fields
+    assert chunks_written_total.value(result="reused") == reused + len({ref["hash"] for ref in fields["content_chunks"]})
+
+def test_read_range_reads_the_overlapping_chunks():
+    document_id = str(uuid.uuid4())
+    content = _essay(400)
+    fields = asyncio.run(store_content(document_id, content))
+    document = {"_id": document_id, **fields}
+
+    text, length = asyncio.run(read_range(document, 5000, 9000))
+    assert text == content[5000:9000] and length == len(content)
+    text, _ = asyncio.run(read_range(document, len(content) - 10))
+    assert text == content[-10:]
+
+def test_prune_deletes_unused_chunks_after_the_grace_period():
+    document_id = str(uuid.uuid4())
+    content = _essay(400)
+    first = asyncio.run(store_content(document_id, content))
+    second = asyncio.run(store_content(document_id, content[:len(content) // 2], previous=first["content_chunks"]))
+    kept = {f"{document_id}:{ref['hash']}" for ref in second["content_chunks"]}
+    assert _chunk_ids(document_id) > kept
+
+    # Within the grace period another save may still use the old chunks
+    asyncio.run(prune_chunks(document_id, second, first["content_chunks"]))
+    assert _chunk_ids(document_id) > kept
+
+    grace = CONTENT_STORE_CONFIG["gc_grace_s"]
+    CONTENT_STORE_CONFIG["gc_grace_s"] = -1
+    try:
+        asyncio.run(prune_chunks(document_id, second, first["content_chunks"]))
+    finally:
+        CONTENT_STORE_CONFIG["gc_grace_s"] = grace
+    assert _chunk_ids(document_id) == kept
+    assert asyncio.run(load_content({"_id": document_id, **second}))["content"] == content[:len(content) // 2]
+
+def test_discard_deletes_only_chunks_nobody_used_since():
+    document_id = str(uuid.uuid4())
+    content = _essay(400)
+    inserted = {}
+    fields = asyncio.run(store_content(document_id, content, previous=[], inserted=inserted))
+    assert set(inserted) == _chunk_ids(document_id)
+
+    asyncio.run(discard_chunks(inserted))
+    assert _chunk_ids(document_id) == set()
+
+    # A chunk another save marked seen after it was written is kept
+    inserted = {}
+    asyncio.run(store_content(document_id, content, previous=[], inserted=inserted))
+    time.sleep(0.01)
+    asyncio.run(store_content(document_id, content, previous=fields["content_chunks"]))
+    asyncio.run(discard_chunks(inserted))
+    assert _chunk_ids(document_id) == set(inserted)
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
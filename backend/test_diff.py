@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Round-trip tests for document deltas (app/diff.py)
+
+apply_changes(old, compute_delta(old, new)) must give back `new` exactly,
+whitespace included; so must character-level compute_exact_diff output.
+
+Run: python test_diff.py    (or: python -m pytest test_diff.py)
+"""
+
+import random
+
+from app.diff import apply_changes, compute_delta, compute_exact_diff
+
+ALPHABET = "ab c\n\t.é—"
+
+def _edit(rng: random.Random, text: str) -> str:
+    chars = list(text)
+    for _ in range(rng.randint(0, 6)):
+        position = rng.randint(0, len(chars))
+        operation = rng.random()
+        if operation < 0.4:
+            chars[position:position] = rng.choice(ALPHABET) * rng.randint(1, 3)
+        elif chars and operation < 0.7:
+            del chars[min(position, len(chars) - 1):position + rng.randint(1, 3)]
+        elif chars:
+            chars[min(position, len(chars) - 1)] = rng.choice(ALPHABET)
+    return "".join(chars)
+
+def _pairs(count: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(count):
+        old = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 60)))
+        yield old, _edit(rng, old)
+
+def test_compute_delta_round_trips():
+    for old, new in _pairs(3000, seed=1):
+        assert apply_changes(old, compute_delta(old, new)) == new, (old, new)
+
+def test_compute_delta_round_trips_long_documents():
+    rng = random.Random(2)
+    paragraphs = [" ".join(rng.choice(["essay", "thesis", "evidence", "claim"]) for _ in range(40)) for _ in range(300)]
+    old = "\n\n".join(paragraphs)
+    for _ in range(50):
+        new = _edit(rng, old)
+        assert apply_changes(old, compute_delta(old, new)) == new
+        old = new
+
+def test_identical_content_has_no_delta():
+    assert compute_delta("same text\n", "same text\n") == []
+
+def test_character_diff_round_trips():
+    for old, new in _pairs(1000, seed=3):
+        assert apply_changes(old, compute_exact_diff(old, new, granularity="character")) == new, (old, new)
+
+def test_invalid_changes_are_rejected():
+    content = "The quick brown fox"
+    invalid = [
+        [{"type": "replace", "start_pos": 4, "end_pos": 9, "old_text": "slow!", "new_text": "slow"}],
+        [{"type": "delete", "start_pos": 0, "end_pos": 5}, {"type": "delete", "start_pos": 3, "end_pos": 8}],
+        [{"type": "insert", "start_pos": 99, "end_pos": 99, "new_text": "x"}],
+        [{"type": "insert", "start_pos": 0, "end_pos": 0}]
+    ]
+    for changes in invalid:
+        try:
+            apply_changes(content, changes)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {changes}")
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for the document cache (app/document_cache.py)
+
+Runs against the in-memory storage backend, so no database is needed.
+
+Run: python test_document_cache.py    (or: python -m pytest test_document_cache.py)
+"""
+
+import asyncio
+import os
+import uuid
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from app.database import documents_collection
+from app.document_cache import cache_requests_total, get_content_range, get_stored_document
+
+def _new_document(content: str) -> str:
+    document_id = str(uuid.uuid4())
+    asyncio.run(documents_collection.insert_one(
+        {"_id": document_id, "user_id": "u", "title": "T", "content": content, "version": 1, "images": []}
+    ))
+    return document_id
+
+def test_unchanged_document_is_served_from_the_cache():
+    document_id = _new_document("cached text")
+    asyncio.run(get_stored_document(document_id))
+    hits = cache_requests_total.value(result="hit")
+
+    document = asyncio.run(get_stored_document(document_id))
+
+    assert document["content"] == "cached text" and document["version"] == 1
+    assert cache_requests_total.value(result="hit") == hits + 1
+
+def test_write_by_another_worker_is_seen():
+    document_id = _new_document("old text")
+    asyncio.run(get_stored_document(document_id))
+    stale = cache_requests_total.value(result="stale")
+
+    # Another worker's save: this worker's cache is not invalidated
+    asyncio.run(documents_collection.update_one(
+        {"_id": document_id}, {"$set": {"content": "new text"}, "$inc": {"version": 1}}
+    ))
+
+    document = asyncio.run(get_stored_document(document_id))
+    assert document["content"] == "new text" and document["version"] == 2
+    assert cache_requests_total.value(result="stale") == stale + 1
+    assert asyncio.run(get_content_range(document_id, 0, 3))["content"] == "new"
+    # The fresh copy replaced the stale one
+    assert asyncio.run(get_stored_document(document_id))["content"] == "new text"
+
+def test_fields_that_keep_the_version_are_read_fresh():
+    document_id = _new_document("text")
+    asyncio.run(get_stored_document(document_id))
+
+    asyncio.run(documents_collection.update_one({"_id": document_id}, {"$push": {"images": {"publicId": "p"}}}))
+
+    assert asyncio.run(get_stored_document(document_id))["images"] == [{"publicId": "p"}]
+
+def test_deleted_document_is_not_served():
+    document_id = _new_document("text")
+    asyncio.run(get_stored_document(document_id))
+
+    asyncio.run(documents_collection.delete_one({"_id": document_id}))
+
+    assert asyncio.run(get_stored_document(document_id)) is None
+    assert asyncio.run(get_content_range(document_id, 0)) is None
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
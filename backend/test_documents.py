@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Tests for the document listing endpoint (app/routers/documents.py)
+
+Runs against the in-memory storage backend, so no database is needed.
+
+Run: python test_documents.py    (or: python -m pytest test_documents.py)
+"""
+
+import base64
+import os
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("LLM_WARM_ON_STARTUP", "false")
+
+from fastapi.testclient import TestClient
+
+import app.routers.documents as documents_router
+from app.autosave import AUTOSAVE_CONFIG
+from app.content_store import is_large
+from app.database import content_chunks_collection, documents_collection
+from app.main import app
+
+def _insert(client: TestClient, user_id: str, updated_at: datetime, content: str = "", **fields) -> str:
+    document_id = str(uuid.uuid4())
+    client.portal.call(documents_collection.insert_one, {
+        "_id": document_id, "user_id": user_id, "title": f"Doc {document_id[:8]}", "content": content,
+        "version": 0, "images": [], "created_at": updated_at, "updated_at": updated_at, **fields
+    })
+    return document_id
+
+def _all_pages(client: TestClient, user_id: str, limit: int) -> list:
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/api/documents/user/{user_id}", params=params)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        pages.append([doc["id"] for doc in body["documents"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return pages
+
+def test_paging_breaks_updated_at_ties_by_id():
+    user_id = str(uuid.uuid4())
+    same_time = datetime(2024, 5, 1, 12, 0, 0)
+    with TestClient(app) as client:
+        tied = [_insert(client, user_id, same_time, word_count=0) for _ in range(7)]
+        newest = _insert(client, user_id, same_time + timedelta(seconds=1), word_count=0)
+        oldest = _insert(client, user_id, same_time - timedelta(seconds=1), word_count=0)
+
+        pages = _all_pages(client, user_id, limit=3)
+
+    listed = [document_id for page in pages for document_id in page]
+    # Every document exactly once, ties ordered by _id descending
+    assert listed == [newest] + sorted(tied, reverse=True) + [oldest]
+    assert [len(page) for page in pages] == [3, 3, 3, 0]
+
+def test_malformed_cursor_is_a_400():
+    user_id = str(uuid.uuid4())
+    bad_cursors = [
+        "not base64!",
+        base64.urlsafe_b64encode(b"not json").decode(),
+        base64.urlsafe_b64encode(b'["yesterday", "id"]').decode(),
+        base64.urlsafe_b64encode(b'{"updated_at": 1}').decode()
+    ]
+    with TestClient(app) as client:
+        for cursor in bad_cursors:
+            response = client.get(f"/api/documents/user/{user_id}", params={"cursor": cursor})
+            assert response.status_code == 400, cursor
+            assert response.json()["detail"] == "Invalid cursor"
+
+def test_missing_summaries_are_backfilled():
+    user_id = str(uuid.uuid4())
+    with TestClient(app) as client:
+        # Written before snippet/word_count were maintained
+        legacy = _insert(client, user_id, datetime.utcnow(), content="An   older\ndocument with six words")
+        current = _insert(client, user_id, datetime.utcnow() - timedelta(minutes=1),
+                          content="ignored", snippet="kept", word_count=42)
+
+        response = client.get(f"/api/documents/user/{user_id}")
+        stored = client.portal.call(documents_collection.find_one, {"_id": legacy})
+
+    listed = {doc["id"]: doc for doc in response.json()["documents"]}
+    assert listed[legacy]["snippet"] == "An older document with six words"
+    assert listed[legacy]["word_count"] == 6
+    # Stored summaries are used as they are, and backfilled ones are saved
+    assert (listed[current]["snippet"], listed[current]["word_count"]) == ("kept", 42)
+    assert stored["snippet"] == "An older document with six words" and stored["word_count"] == 6
+
+def test_patch_conflict_leaves_no_orphan_chunks():
+    user_id = str(uuid.uuid4())
+    content = "".join(f"Paragraph {i} " + "words " * 80 + "\n\n" for i in range(120))
+    assert is_large(content)
+    store_content = documents_router.store_content
+
+    async def store_then_lose_the_race(document_id, *args):
+        fields = await store_content(document_id, *args)
+        # Another save lands between writing the chunks and the document
+        await documents_collection.update_one({"_id": document_id}, {"$inc": {"version": 1}})
+        return fields
+
+    enabled = AUTOSAVE_CONFIG["enabled"]
+    AUTOSAVE_CONFIG["enabled"] = False
+    documents_router.store_content = store_then_lose_the_race
+    try:
+        with TestClient(app) as client:
+            document_id = _insert(client, user_id, datetime.utcnow(), content=content)
+            patch = {"base_version": 0, "changes": [
+                {"type": "insert", "start_pos": len(content), "end_pos": len(content), "new_text": "The end."}
+            ]}
+
+            response = client.patch(f"/api/documents/{document_id}", json=patch)
+            chunks = client.portal.call(content_chunks_collection.count_documents, {"document_id": document_id})
+    finally:
+        documents_router.store_content = store_content
+        AUTOSAVE_CONFIG["enabled"] = enabled
+
+    assert response.status_code == 409
+    assert chunks == 0
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for hedged requests across providers (app/hedging.py)
+
+Uses fake providers that sleep, so no API keys are needed.
+
+Run: python test_hedging.py    (or: python -m pytest test_hedging.py)
+"""
+
+import threading
+import time
+
+from app.hedging import HedgePolicy, LatencyTracker, WinningStream, hedged_call
+
+class FakeProvider:
+    """A provider stream: waits `ttft` before its first chunk, then yields `chunks` every `gap` seconds"""
+    def __init__(self, ttft: float, chunks: int = 3, gap: float = 0.0, error: str = None):
+        self.ttft = ttft
+        self.chunks = chunks
+        self.gap = gap
+        self.error = error
+        self.started_at = None
+        self.yielded = 0
+        self.closed = threading.Event()
+
+    def __call__(self):
+        self.started_at = time.monotonic()
+        try:
+            time.sleep(self.ttft)
+            if self.error:
+                raise RuntimeError(self.error)
+            for i in range(self.chunks):
+                if i:
+                    time.sleep(self.gap)
+                self.yielded += 1
+                yield f"chunk{i} "
+        finally:
+            self.closed.set()
+
+def _policy(delay: float) -> HedgePolicy:
+    return HedgePolicy(enabled=True, default_delay_s=delay, min_delay_s=0.0)
+
+def test_delay_uses_the_percentile_once_there_are_enough_samples():
+    tracker = LatencyTracker()
+    policy = HedgePolicy(percentile=95, min_samples=20, default_delay_s=4.0, min_delay_s=0.5, max_delay_s=15.0)
+    for i in range(19):
+        tracker.record("claude", 1.0 + i / 100)
+    assert policy.delay_for("claude", tracker) == 4.0
+
+    tracker.record("claude", 2.0)
+    assert policy.delay_for("claude", tracker) == tracker.percentile("claude", 95) == 1.18
+    for _ in range(200):
+        tracker.record("gemini", 0.1)
+    assert policy.delay_for("gemini", tracker) == 0.5
+
+def test_fast_first_provider_is_not_hedged():
+    first, second = FakeProvider(ttft=0.01), FakeProvider(ttft=0.01)
+
+    provider, chunks = hedged_call([("a", first), ("b", second)], _policy(0.5), LatencyTracker())
+
+    assert provider == "a" and "".join(chunks) == "chunk0 chunk1 chunk2 "
+    assert second.started_at is None
+
+def test_hedge_fires_after_the_delay_and_the_loser_is_cancelled():
+    slow, fast = FakeProvider(ttft=0.4, chunks=50, gap=0.01), FakeProvider(ttft=0.01)
+    started = time.monotonic()
+
+    provider, chunks = hedged_call([("slow", slow), ("fast", fast)], _policy(0.1), LatencyTracker())
+
+    assert provider == "fast"
+    assert 0.08 <= fast.started_at - started < 0.3
+    assert "".join(chunks) == "chunk0 chunk1 chunk2 "
+    # The slow provider stops at its first chunk instead of streaming all 50
+    assert slow.closed.wait(2.0)
+    assert slow.yielded <= 1
+
+def test_failure_before_the_first_chunk_hedges_at_once():
+    broken, backup = FakeProvider(ttft=0.01, error="down"), FakeProvider(ttft=0.01)
+    started = time.monotonic()
+
+    provider, chunks = hedged_call([("broken", broken), ("backup", backup)], _policy(5.0), LatencyTracker())
+
+    assert provider == "backup" and list(chunks)
+    assert backup.started_at - started < 0.5
+
+def test_all_failing_raises_the_first_error():
+    try:
+        hedged_call([("a", FakeProvider(ttft=0.0, error="a down")), ("b", FakeProvider(ttft=0.05, error="b down"))],
+                    _policy(0.01), LatencyTracker())
+    except RuntimeError as e:
+        assert str(e) == "a down"
+    else:
+        raise AssertionError("no error raised")
+
+def test_closing_the_winning_stream_stops_the_runner():
+    endless = FakeProvider(ttft=0.0, chunks=10000, gap=0.01)
+
+    provider, chunks = hedged_call([("a", endless)], _policy(1.0), LatencyTracker())
+    assert isinstance(chunks, WinningStream)
+    assert next(chunks) == "chunk0 " and next(chunks) == "chunk1 "
+
+    chunks.close()
+
+    assert endless.closed.wait(2.0)
+    chunks._runner._thread.join(2.0)
+    assert not chunks._runner._thread.is_alive()
+    assert endless.yielded < 100
+
+def test_closing_before_iterating_stops_the_runner():
+    endless = FakeProvider(ttft=0.0, chunks=10000, gap=0.01)
+
+    _, chunks = hedged_call([("a", endless)], _policy(1.0), LatencyTracker())
+    chunks.close()
+
+    assert endless.closed.wait(2.0)
+    assert endless.yielded < 100
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for the API process
+
+Imports app.main in a fresh interpreter under `python -X importtime` and
+checks what a cold start pays before the app can serve:
+
+- the provider SDKs, Cloudinary and Motor are not imported at all. They are
+  loaded on first use (see app/llm_clients.py, app/cloudinary_config.py and
+  app/storage.py), so a worker that only serves documents or diffs never
+  pays for them;
+- if a budget is given (--budget-ms or IMPORT_BUDGET_MS), importing app.main
+  stays within it (best of --runs, in ms). Import time varies by machine and
+  load, so there is no default budget; pick one well above your own timings.
+
+Nothing connects at import, so no database or API keys are needed. Exits
+non-zero if a check fails; the slowest modules are listed either way.
+
+Run: python test_import_time.py    (or: python -m pytest test_import_time.py)
+     python test_import_time.py --budget-ms 1500 --runs 5 --top 20
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# Modules that must only be imported on first use
+DEFERRED_MODULES = ["groq", "anthropic", "google.generativeai", "cloudinary", "motor"]
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def measure() -> Dict[str, Tuple[int, int]]:
+    """Import app.main in a new interpreter; {module: (self_us, cumulative_us)}"""
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing app.main failed:\n{result.stderr[-2000:]}")
+    modules: Dict[str, Tuple[int, int]] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+def deferred_imports(modules: Dict[str, Tuple[int, int]]) -> List[str]:
+    """Deferred packages that were imported (directly or through a submodule)"""
+    return [deferred for deferred in DEFERRED_MODULES
+            if any(name == deferred or name.startswith(deferred + ".") for name in modules)]
+
+def _budget_ms() -> Optional[float]:
+    value = os.getenv("IMPORT_BUDGET_MS")
+    return float(value) if value else None
+
+def test_deferred_modules_are_not_imported_at_startup():
+    assert deferred_imports(measure()) == []
+
+def test_import_stays_within_the_budget():
+    # Opt-in: only checked when IMPORT_BUDGET_MS is set
+    budget_ms = _budget_ms()
+    if budget_ms is None:
+        return
+    total_ms = min(measure()["app.main"][1] for _ in range(3)) / 1000
+    assert total_ms <= budget_ms, f"import app.main took {total_ms:.0f} ms, over the {budget_ms:.0f} ms budget"
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check the import time of app.main")
+    parser.add_argument("--budget-ms", type=float, default=_budget_ms(),
+                        help="Maximum time to import app.main (default IMPORT_BUDGET_MS; unchecked if unset)")
+    parser.add_argument("--runs", type=int, default=3, help="Imports to measure; the fastest counts")
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(max(1, args.runs))]
+    best = min(runs, key=lambda modules: modules["app.main"][1])
+    total_ms = best["app.main"][1] / 1000
+
+    print(f"Slowest modules by self time (fastest of {len(runs)} runs):")
+    for name, (self_us, cumulative_us) in sorted(best.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  (cumulative {cumulative_us / 1000:8.1f} ms)  {name}")
+    print("App modules by cumulative time:")
+    for name, (self_us, cumulative_us) in sorted(best.items(), key=lambda item: -item[1][1]):
+        if name.startswith("app.") and cumulative_us >= 1000:
+            print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        failures.append(f"import app.main took {total_ms:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+    deferred = deferred_imports(best)
+    if deferred:
+        failures.append(f"imported at startup instead of on first use: {', '.join(deferred)}")
+
+    budget = "no budget" if args.budget_ms is None else f"budget {args.budget_ms:.0f} ms"
+    print(f"\nimport app.main: {total_ms:.0f} ms ({budget})")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
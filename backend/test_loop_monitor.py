@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Tests for event-loop lag monitoring (app/loop_monitor.py)
+
+Run: python test_loop_monitor.py    (or: python -m pytest test_loop_monitor.py)
+"""
+
+import asyncio
+import time
+
+from app.loop_monitor import LoopMonitor, loop_stalls_total
+
+def _blocking_handler(seconds: float) -> None:
+    time.sleep(seconds)
+
+def test_stall_is_reported_once_with_the_blocking_stack():
+    monitor = LoopMonitor(interval_s=0.01, threshold_ms=50, history=5)
+    stalls = loop_stalls_total.value()
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        _blocking_handler(0.3)
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+    asyncio.run(run())
+
+    assert len(monitor.stalls) == 1
+    stall = monitor.stalls[0]
+    assert "_blocking_handler" in stall["stack"]
+    assert 50 <= stall["blocked_ms"] <= 400
+    assert monitor.max_lag_s >= 0.25
+    assert loop_stalls_total.value() == stalls + 1
+    assert monitor.snapshot()["recent_stalls"] == [stall]
+
+def test_awaiting_code_is_not_a_stall():
+    monitor = LoopMonitor(interval_s=0.01, threshold_ms=50)
+
+    async def run():
+        monitor.start()
+        await asyncio.gather(*(asyncio.sleep(0.1) for _ in range(100)))
+        await asyncio.to_thread(time.sleep, 0.2)
+        await monitor.stop()
+    asyncio.run(run())
+
+    assert monitor.stalls == []
+    assert monitor.max_lag_s < 0.05
+
+def test_history_is_bounded():
+    monitor = LoopMonitor(interval_s=0.01, threshold_ms=30, history=2)
+
+    async def run():
+        monitor.start()
+        for _ in range(4):
+            await asyncio.sleep(0.03)
+            _blocking_handler(0.1)
+        await asyncio.sleep(0.03)
+        await monitor.stop()
+    asyncio.run(run())
+
+    assert len(monitor.stalls) == 2
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
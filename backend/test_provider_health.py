@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Tests for provider health, circuit breaking and failover (app/provider_health.py)
+
+Uses fake providers, so no API keys are needed.
+
+Run: python test_provider_health.py    (or: python -m pytest test_provider_health.py)
+"""
+
+import time
+
+from app.provider_health import CircuitOpenError, ProviderHealth, ProviderHealthRegistry, failover_call
+
+def _fails(message: str):
+    def factory():
+        raise RuntimeError(message)
+        yield  # a generator, like the provider streams
+    return factory
+
+def _chunks(*chunks, error: str = None, closed: list = None):
+    def factory():
+        try:
+            yield from chunks
+            if error:
+                raise RuntimeError(error)
+        finally:
+            if closed is not None:
+                closed.append(True)
+    return factory
+
+def _open(health: ProviderHealth) -> None:
+    for _ in range(health.failure_threshold):
+        health.acquire()
+        health.record_failure(RuntimeError("down"))
+
+def test_breaker_opens_after_consecutive_failures():
+    health = ProviderHealth("p", failure_threshold=3, open_seconds=60)
+    for _ in range(2):
+        health.acquire()
+        health.record_failure(RuntimeError("down"))
+    assert health.state == "closed"
+
+    health.acquire()
+    health.record_failure(RuntimeError("down"))
+
+    assert health.state == "open" and not health.is_available()
+    try:
+        health.acquire()
+    except CircuitOpenError:
+        pass
+    else:
+        raise AssertionError("an open breaker admitted a request")
+    assert health.snapshot()["retry_in_s"] > 0
+
+def test_breaker_opens_on_a_sustained_error_rate():
+    health = ProviderHealth("p", failure_threshold=100, error_rate_threshold=0.5, min_requests=10, ewma_alpha=0.5)
+    for i in range(20):
+        health.acquire()
+        if i % 4 == 3:
+            health.record_success(0.1)
+        else:
+            health.record_failure(RuntimeError("flaky"))
+        if health.state == "open":
+            break
+    assert health.state == "open" and health.total_requests >= 10
+
+def test_half_open_admits_one_probe_and_closes_on_success():
+    health = ProviderHealth("p", failure_threshold=1, open_seconds=0.05)
+    _open(health)
+    time.sleep(0.06)
+
+    assert health.is_available()
+    health.acquire()
+    assert health.state == "half_open" and not health.is_available()
+    try:
+        health.acquire()
+    except CircuitOpenError:
+        pass
+    else:
+        raise AssertionError("a second probe was admitted")
+
+    health.record_success(0.2, ttft=0.1)
+    assert health.state == "closed" and health.is_available()
+
+def test_failed_probe_reopens():
+    health = ProviderHealth("p", failure_threshold=1, open_seconds=0.05)
+    _open(health)
+    time.sleep(0.06)
+    health.acquire()
+
+    health.record_failure(RuntimeError("still down"))
+
+    assert health.state == "open" and not health.is_available()
+
+def test_failover_skips_providers_failing_before_the_first_chunk():
+    registry = ProviderHealthRegistry(failure_threshold=1, open_seconds=60)
+
+    def monitored(name, factory):
+        return name, lambda: registry.monitored(name, factory)
+
+    provider, chunks = failover_call([
+        monitored("a", _fails("a down")),
+        monitored("b", _chunks("hello", " world"))
+    ])
+
+    assert provider == "b" and "".join(chunks) == "hello world"
+    assert registry.get("a").state == "open"
+    assert registry.get("b").total_requests == 1 and registry.get("b").ttft_ewma is not None
+
+    # With a's breaker open it is skipped without being called
+    called = []
+    provider, chunks = failover_call([
+        monitored("a", lambda: called.append("a") or iter(["never"])),
+        monitored("b", _chunks("again"))
+    ])
+    assert provider == "b" and list(chunks) == ["again"] and called == []
+
+def test_error_after_the_first_chunk_propagates():
+    provider, chunks = failover_call([("a", _chunks("partial", error="cut off")), ("b", _chunks("unused"))])
+
+    assert provider == "a"
+    received = []
+    try:
+        for chunk in chunks:
+            received.append(chunk)
+    except RuntimeError as e:
+        assert str(e) == "cut off"
+    else:
+        raise AssertionError("the mid-stream error was swallowed")
+    assert received == ["partial"]
+
+def test_all_providers_failing_raises_the_first_error():
+    try:
+        failover_call([("a", _fails("first")), ("b", _fails("second"))])
+    except RuntimeError as e:
+        assert str(e) == "first"
+    else:
+        raise AssertionError("no error raised")
+
+def test_closing_the_stream_releases_the_provider():
+    registry = ProviderHealthRegistry(failure_threshold=1, open_seconds=0.05)
+    health = registry.get("a")
+    _open(health)
+    time.sleep(0.06)
+    closed = []
+
+    provider, chunks = failover_call([("a", lambda: registry.monitored("a", _chunks("one", "two", closed=closed)))])
+    # The half-open probe is held while the stream is open
+    assert not health.is_available()
+
+    chunks.close()
+
+    assert closed == [True]
+    assert health.is_available() and health.total_requests == 1
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Tests for provider retries and client-side pacing (app/retry.py)
+
+Uses fake provider errors and a fake Claude client, so no API keys are needed.
+
+Run: python test_retry.py    (or: python -m pytest test_retry.py)
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import app.llm as llm
+from app.llm_clients import llm_clients
+from app.retry import ProviderRetry, RequestPacer, RetryPolicy, TokenBucket, _retry_after, retry_reason
+
+class ProviderError(Exception):
+    """An SDK error carrying an HTTP status and response headers"""
+    def __init__(self, status: int, headers: dict = None):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+        self.response = SimpleNamespace(headers=headers or {})
+
+class APIConnectionError(Exception):
+    pass
+
+def test_backoff_stays_within_its_window():
+    policy = RetryPolicy(base_delay_s=0.5, max_delay_s=20.0)
+    for attempt in range(1, 10):
+        window = min(20.0, 0.5 * 2 ** attempt)
+        delays = [policy.delay(attempt, None) for _ in range(200)]
+        assert all(0 <= delay <= window for delay in delays), attempt
+    # Retry-After is honoured (capped at max_delay_s) plus a little jitter
+    assert all(3.0 <= policy.delay(1, 3.0) <= 3.5 for _ in range(100))
+    assert all(20.0 <= policy.delay(1, 600.0) <= 20.5 for _ in range(100))
+
+def test_retry_after_headers():
+    assert _retry_after(ProviderError(429, {"retry-after-ms": "1500", "retry-after": "9"})) == 1.5
+    assert _retry_after(ProviderError(429, {"retry-after": "2"})) == 2.0
+    assert _retry_after(ProviderError(429, {"retry-after": "-5"})) == 0.0
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < _retry_after(ProviderError(503, {"retry-after": later})) <= 30
+    # A bad -ms value falls back to Retry-After
+    assert _retry_after(ProviderError(429, {"retry-after-ms": "soon", "retry-after": "4"})) == 4.0
+    assert _retry_after(ProviderError(429, {"retry-after": "whenever"})) is None
+    assert _retry_after(ProviderError(429)) is None
+    assert _retry_after(RuntimeError("no response")) is None
+
+def test_retry_reasons():
+    assert retry_reason(ProviderError(429)) == "429"
+    assert retry_reason(ProviderError(503)) == "503"
+    assert retry_reason(ProviderError(400)) is None
+    assert retry_reason(APIConnectionError("reset")) == "connection"
+    assert retry_reason(ValueError("bad input")) is None
+
+def test_token_bucket_paces_callers():
+    bucket = TokenBucket(rate=20.0, capacity=2.0)
+    assert bucket.acquire() < 0.01 and bucket.acquire() < 0.01
+
+    waited = bucket.acquire()
+
+    assert 0.03 <= waited < 0.2
+    try:
+        bucket.acquire(2.0, timeout=0.01)
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError("acquire did not time out")
+
+def test_block_for_holds_every_caller():
+    bucket = TokenBucket(rate=1000.0, capacity=10.0)
+    bucket.block_for(0.1)
+    started = time.monotonic()
+
+    bucket.acquire()
+
+    assert time.monotonic() - started >= 0.09
+
+def _retrying(**policy) -> ProviderRetry:
+    return ProviderRetry(RetryPolicy(**{"base_delay_s": 0.01, **policy}), RequestPacer({}))
+
+def test_rate_limits_are_retried_after_retry_after():
+    calls = []
+
+    def fn():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise ProviderError(429, {"retry-after-ms": "50"})
+        return "ok"
+
+    assert _retrying().call("claude", "m", fn) == "ok"
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 0.05 and calls[2] - calls[1] >= 0.05
+
+def test_retries_stop_at_max_attempts_and_skip_client_errors():
+    calls = []
+
+    def failing(status):
+        def fn():
+            calls.append(status)
+            raise ProviderError(status)
+        return fn
+
+    for status, attempts in ((503, 3), (400, 1)):
+        calls.clear()
+        try:
+            _retrying(max_attempts=3).call("claude", "m", failing(status))
+        except ProviderError as e:
+            assert e.status_code == status
+        else:
+            raise AssertionError("no error raised")
+        assert len(calls) == attempts, status
+
+class FakeClaudeStream:
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        yield from self.chunks
+        if self.error:
+            raise self.error
+
+class FakeClaude:
+    """messages.stream() fails to open with a 429 once, then streams and is cut off by a 503"""
+    def __init__(self):
+        self.opened = 0
+        self.messages = self
+
+    def stream(self, **kwargs):
+        self.opened += 1
+        if self.opened == 1:
+            raise ProviderError(429, {"retry-after-ms": "10"})
+        return FakeClaudeStream(["Hello", " there"], error=ProviderError(503))
+
+def test_streams_are_retried_only_while_opening():
+    fake = FakeClaude()
+    saved = llm.provider_retry, llm_clients._claude
+    llm.provider_retry, llm_clients._claude = _retrying(), fake
+    try:
+        received = []
+        try:
+            for chunk in llm.get_claude_response("hi", stream=True):
+                received.append(chunk)
+        except ProviderError as e:
+            assert e.status_code == 503
+        else:
+            raise AssertionError("the mid-stream error was swallowed")
+    finally:
+        llm.provider_retry, llm_clients._claude = saved
+
+    # The 429 on opening was retried; the 503 after the first chunk was not
+    assert fake.opened == 2
+    assert received == ["Hello", " there"]
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for revision history stored as reverse deltas (app/revisions.py)
+
+Runs against the in-memory storage backend, so no database is needed.
+
+Run: python test_revisions.py    (or: python -m pytest test_revisions.py)
+"""
+
+import asyncio
+import os
+import random
+import uuid
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from app.database import revisions_collection
+from app.revisions import REVISIONS_CONFIG, get_revision, list_revisions, record_revision
+
+def _versions(count: int, seed: int = 1) -> list:
+    """Successive drafts, each a small edit of the one before"""
+    rng = random.Random(seed)
+    words = ["The", "climate", "policy", "costs", "evidence", "suggests", "energy", "renewable"]
+    content = " ".join(rng.choice(words) for _ in range(300))
+    versions = []
+    for _ in range(count):
+        at = rng.randrange(len(content))
+        content = content[:at] + rng.choice(words) + " " + content[at + rng.randint(0, 20):]
+        versions.append(content)
+    return versions
+
+def _record(document_id: str, versions: list) -> None:
+    async def run():
+        for version, content in enumerate(versions, start=1):
+            await record_revision(document_id, version, content)
+    asyncio.run(run())
+
+def _stored(document_id: str) -> list:
+    async def run():
+        return await revisions_collection.find({"document_id": document_id}).sort("seq", 1).to_list(length=None)
+    return asyncio.run(run())
+
+def test_every_revision_is_reconstructed():
+    document_id = str(uuid.uuid4())
+    versions = _versions(45)
+    _record(document_id, versions)
+
+    for version, content in enumerate(versions, start=1):
+        revision = asyncio.run(get_revision(document_id, version))
+        assert revision["content"] == content, version
+        assert revision["size"] == len(content)
+
+def test_only_snapshots_and_the_newest_keep_full_content():
+    document_id = str(uuid.uuid4())
+    _record(document_id, _versions(45))
+    every = REVISIONS_CONFIG["snapshot_every"]
+
+    stored = _stored(document_id)
+    full = [revision["seq"] for revision in stored if "content" in revision]
+    assert full == [seq for seq in range(len(stored)) if seq % every == 0 or seq == len(stored) - 1]
+    assert all("delta" in revision for revision in stored if "content" not in revision)
+
+def test_duplicate_and_older_versions_are_ignored():
+    document_id = str(uuid.uuid4())
+    versions = _versions(3)
+    _record(document_id, versions)
+
+    async def run():
+        await record_revision(document_id, 3, "a different body")
+        await record_revision(document_id, 2, "an older body")
+        await record_revision(document_id, 4, versions[-1])
+    asyncio.run(run())
+
+    assert len(_stored(document_id)) == 3
+    assert asyncio.run(get_revision(document_id, 4)) is None
+
+def test_list_pages_newest_first():
+    document_id = str(uuid.uuid4())
+    _record(document_id, _versions(10))
+
+    first = asyncio.run(list_revisions(document_id, limit=4))
+    assert [revision["version"] for revision in first] == [10, 9, 8, 7]
+    after = asyncio.run(list_revisions(document_id, limit=4, before=first[-1]["version"]))
+    assert [revision["version"] for revision in after] == [6, 5, 4, 3]
+    assert "content" not in first[0] and "delta" not in first[0]
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Tests for fair-share LLM scheduling (app/scheduler.py)
+
+Runs against the in-memory storage backend, so no database or API keys are
+needed.
+
+Run: python test_scheduler.py    (or: python -m pytest test_scheduler.py)
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("LLM_WARM_ON_STARTUP", "false")
+
+from fastapi.testclient import TestClient
+
+from app.llm import llm_scheduler
+from app.main import app
+from app.scheduler import (
+    PRIORITY_BULK, PRIORITY_INTERACTIVE, FairScheduler, ProviderBusyError, ProviderLimiter, SchedulerRejected
+)
+
+async def _grant_order(scheduler: FairScheduler, requests: list) -> list:
+    """Queue (user, priority) requests behind a held slot; the order they are granted in"""
+    order = []
+    await scheduler.acquire("holder")
+
+    async def request(user, priority):
+        async with scheduler.slot(user, priority):
+            order.append(user)
+            await asyncio.sleep(0)
+
+    tasks = []
+    for user, priority in requests:
+        tasks.append(asyncio.create_task(request(user, priority)))
+        await asyncio.sleep(0)
+    scheduler.release("holder")
+    await asyncio.gather(*tasks)
+    return order
+
+def test_users_are_served_round_robin():
+    scheduler = FairScheduler(max_concurrent=1)
+
+    order = asyncio.run(_grant_order(scheduler, [("a", 0), ("a", 0), ("a", 0), ("b", 0), ("c", 0)]))
+
+    assert order == ["a", "b", "c", "a", "a"]
+
+def test_higher_priority_runs_first():
+    scheduler = FairScheduler(max_concurrent=1)
+
+    order = asyncio.run(_grant_order(scheduler, [
+        ("bulk", PRIORITY_BULK), ("bulk", PRIORITY_BULK), ("chat", PRIORITY_INTERACTIVE)
+    ]))
+
+    assert order == ["chat", "bulk", "bulk"]
+
+def test_per_user_active_cap_lets_others_through():
+    scheduler = FairScheduler(max_concurrent=4, max_active_per_user=1)
+
+    async def run():
+        await scheduler.acquire("a")
+        second = asyncio.create_task(scheduler.acquire("a"))
+        await scheduler.acquire("b")
+        await asyncio.sleep(0.01)
+        assert not second.done() and scheduler.snapshot()["active"] == 2
+        scheduler.release("a")
+        await asyncio.wait_for(second, 1)
+    asyncio.run(run())
+
+def test_full_queues_reject():
+    scheduler = FairScheduler(max_concurrent=1, max_queue=4, max_queue_per_user=2)
+
+    async def run():
+        await scheduler.acquire("holder")
+        rejections = []
+        waiting = []
+        for queued, user in ((("a", "a", "b"), "a"), (("b",), "c")):
+            waiting += [asyncio.create_task(scheduler.acquire(other)) for other in queued]
+            await asyncio.sleep(0)
+            try:
+                await scheduler.acquire(user)
+            except SchedulerRejected as e:
+                rejections.append(e.reason)
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        return rejections
+    rejections = asyncio.run(run())
+
+    assert rejections == ["too many pending requests for this user", "queue full"]
+    assert scheduler.snapshot()["queued"] == 0
+
+def test_waiting_too_long_is_rejected():
+    scheduler = FairScheduler(max_concurrent=1, queue_timeout_s=0.05)
+
+    async def run():
+        await scheduler.acquire("holder")
+        try:
+            await scheduler.acquire("a")
+        except SchedulerRejected as e:
+            return e
+    rejected = asyncio.run(run())
+
+    assert rejected is not None and rejected.reason == "timed out waiting for a slot"
+    assert scheduler.snapshot()["queued"] == 0
+
+def test_full_queue_is_a_429_with_retry_after():
+    max_queue = llm_scheduler.max_queue
+    llm_scheduler.max_queue = 0
+    try:
+        with TestClient(app) as client:
+            for path in ("/api/chat/message", "/api/chat/message/stream"):
+                response = client.post(path, json={"message": "hi", "user_id": "u"})
+                assert response.status_code == 429, path
+                assert int(response.headers["Retry-After"]) >= 1
+    finally:
+        llm_scheduler.max_queue = max_queue
+
+def test_provider_limiter_caps_concurrent_calls():
+    limiter = ProviderLimiter({"claude": 2}, wait_s=1.0)
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def call():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return "ok"
+
+    threads = [threading.Thread(target=limiter.call, args=("claude", call)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
+    # Providers without a cap are not limited
+    assert limiter.call("groq", lambda: "free") == "free"
+
+def test_provider_at_its_cap_too_long_is_busy():
+    limiter = ProviderLimiter({"claude": 1}, wait_s=0.05)
+    stream = limiter.limited("claude", lambda: iter(["a", "b"]))
+    assert next(stream) == "a"
+
+    try:
+        limiter.call("claude", lambda: "blocked")
+    except ProviderBusyError:
+        pass
+    else:
+        raise AssertionError("a call beyond the cap was admitted")
+
+    # Closing the stream gives the slot back
+    stream.close()
+    assert limiter.call("claude", lambda: "free") == "free"
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
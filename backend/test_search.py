@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Tests for in-process search (app/search.py)
+
+Runs against the in-memory storage backend, so no database is needed.
+
+Run: python test_search.py    (or: python -m pytest test_search.py)
+"""
+
+import asyncio
+import os
+import uuid
+from datetime import datetime
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from app.chat_store import append_messages
+from app.database import documents_collection
+from app.search import SearchIndexes, UserIndex, search_user
+
+def _new_document(user_id: str, title: str, content: str) -> str:
+    document_id = str(uuid.uuid4())
+    asyncio.run(documents_collection.insert_one({
+        "_id": document_id, "user_id": user_id, "title": title, "content": content,
+        "version": 0, "images": [], "updated_at": datetime.utcnow()
+    }))
+    return document_id
+
+def test_bm25_ranks_frequent_and_title_matches_first():
+    user_id = str(uuid.uuid4())
+    once = _new_document(user_id, "Notes", "the cell wall and some other words about plants and soil")
+    often = _new_document(user_id, "Notes", "cell cell cell division in every cell")
+    titled = _new_document(user_id, "Cell biology", "membranes and organelles")
+    _new_document(user_id, "Unrelated", "nothing to see here")
+
+    result = asyncio.run(search_user(user_id, "cell"))
+
+    assert result["total"] == 3
+    assert [hit["document_id"] for hit in result["hits"]] == [often, titled, once]
+    scores = [hit["score"] for hit in result["hits"]]
+    assert scores == sorted(scores, reverse=True)
+
+def test_rare_terms_weigh_more():
+    user_id = str(uuid.uuid4())
+    for i in range(5):
+        _new_document(user_id, f"Common {i}", "plants need water")
+    rare = _new_document(user_id, "Rare", "plants need photosynthesis")
+
+    result = asyncio.run(search_user(user_id, "water photosynthesis"))
+
+    assert result["hits"][0]["document_id"] == rare
+
+def test_snippets_and_chat_hits_are_read_for_the_page():
+    user_id = str(uuid.uuid4())
+    document_id = _new_document(user_id, "Essay", "An introduction. Photosynthesis turns light into energy.")
+    asyncio.run(append_messages(document_id, [
+        {"role": "user", "content": "Explain photosynthesis please"},
+        {"role": "assistant", "content": "Sure."}
+    ]))
+
+    result = asyncio.run(search_user(user_id, "photosynthesis"))
+
+    hits = {hit["type"]: hit for hit in result["hits"]}
+    document_hit = hits["document"]
+    start, end = document_hit["highlights"][0]
+    assert document_hit["snippet"][start:end] == "Photosynthesis"
+    chat_hit = hits["chat"]
+    assert chat_hit["role"] == "user" and chat_hit["title"] == "Essay"
+    start, end = chat_hit["highlights"][0]
+    assert chat_hit["snippet"][start:end] == "photosynthesis"
+
+def test_sync_picks_up_edits_and_deletions():
+    user_id = str(uuid.uuid4())
+    edited = _new_document(user_id, "Draft", "old words")
+    deleted = _new_document(user_id, "Gone", "old words")
+    assert asyncio.run(search_user(user_id, "old"))["total"] == 2
+
+    async def change():
+        await documents_collection.update_one({"_id": edited}, {"$set": {
+            "content": "new words", "version": 1, "updated_at": datetime.utcnow()
+        }})
+        await documents_collection.delete_one({"_id": deleted})
+    asyncio.run(change())
+
+    assert asyncio.run(search_user(user_id, "old"))["total"] == 0
+    assert [hit["document_id"] for hit in asyncio.run(search_user(user_id, "new"))["hits"]] == [edited]
+
+def test_index_keeps_term_counts_only():
+    user_id = str(uuid.uuid4())
+    _new_document(user_id, "Title", "alpha beta beta")
+    index = UserIndex(user_id)
+    asyncio.run(index.sync())
+
+    unit = next(iter(index.units.values()))
+    assert not hasattr(unit, "text") and unit.counts is None
+    assert index.postings["beta"] == {("document", unit.document_id): 2}
+    assert index.posting_count == 3
+    index._remove(("document", unit.document_id))
+    assert index.posting_count == 0 and not index.postings
+
+def test_least_recently_searched_index_is_evicted_over_budget():
+    indexes = SearchIndexes(max_users=10, max_bytes=10 ** 9)
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    for user_id in (first, second):
+        _new_document(user_id, "Words", "one two three four five")
+        asyncio.run(indexes.get(user_id).sync())
+
+    indexes.max_bytes = indexes.get(second).estimated_bytes()
+    indexes.enforce()
+
+    assert first not in indexes._indexes and second in indexes._indexes
+    indexes.max_bytes = 0
+    indexes.enforce()
+    assert not indexes._indexes
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-memory storage backend (MemoryCollection in app/storage.py)
+
+Checks that queries, updates, indexes and bulk writes behave as they do in
+MongoDB for the operations the app uses.
+
+Run: python test_storage.py    (or: python -m pytest test_storage.py)
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from app.storage import MemoryCollection
+
+def _collection(*documents) -> MemoryCollection:
+    collection = MemoryCollection("test")
+    for document in documents:
+        asyncio.run(collection.insert_one(document))
+    return collection
+
+def _ids(collection: MemoryCollection, query: dict) -> list:
+    async def run():
+        return [doc["_id"] async for doc in collection.find(query)]
+    return asyncio.run(run())
+
+def test_query_operators():
+    earlier = datetime(2024, 1, 1)
+    collection = _collection(
+        {"_id": 1, "n": 5, "tags": ["a", "b"], "at": earlier, "owner": {"name": "x"}},
+        {"_id": 2, "n": 10, "tags": ["c"], "at": earlier + timedelta(days=1)},
+        {"_id": 3, "n": "10", "gone": None},
+        {"_id": 4, "messages": [{"seq": 1}, {"seq": 7}]}
+    )
+
+    assert _ids(collection, {"tags": "b"}) == [1]
+    assert _ids(collection, {"n": {"$gte": 5, "$lt": 10}}) == [1]
+    # Numbers and strings do not compare with each other
+    assert _ids(collection, {"n": {"$gt": 1}}) == [1, 2]
+    assert _ids(collection, {"n": {"$in": [10, "10"]}}) == [2, 3]
+    assert _ids(collection, {"_id": {"$nin": [1, 2]}}) == [3, 4]
+    assert _ids(collection, {"n": {"$ne": 5}}) == [2, 3, 4]
+    assert _ids(collection, {"gone": None}) == [1, 2, 3, 4]
+    assert _ids(collection, {"gone": {"$exists": True}}) == [3]
+    assert _ids(collection, {"at": {"$gt": earlier}}) == [2]
+    assert _ids(collection, {"owner.name": "x"}) == [1]
+    assert _ids(collection, {"messages.seq": {"$gt": 5}}) == [4]
+    assert _ids(collection, {"$or": [{"n": 5}, {"tags": "c"}]}) == [1, 2]
+    assert _ids(collection, {"$and": [{"n": {"$exists": True}}, {"tags": {"$exists": True}}]}) == [1, 2]
+
+def test_unsupported_operators_fail_loudly():
+    collection = _collection({"_id": 1, "n": 5})
+    for operation in (lambda: _ids(collection, {"n": {"$regex": "5"}}),
+                      lambda: asyncio.run(collection.update_one({"_id": 1}, {"$pull": {"n": 5}}))):
+        try:
+            operation()
+        except NotImplementedError:
+            continue
+        raise AssertionError("an unsupported operator was silently accepted")
+
+def test_update_operators():
+    collection = _collection({"_id": 1, "count": 1, "peak": 5, "drop": True, "items": [1]})
+
+    async def run():
+        await collection.update_one({"_id": 1}, {
+            "$set": {"nested.value": "x"},
+            "$unset": {"drop": ""},
+            "$inc": {"count": 2, "fresh": 1},
+            "$max": {"peak": 3},
+            "$push": {"items": {"$each": [2, 3]}},
+            "$setOnInsert": {"created": True}
+        })
+        await collection.update_one({"_id": 1}, {"$max": {"peak": 9}, "$push": {"items": 4}})
+        return await collection.find_one({"_id": 1})
+    document = asyncio.run(run())
+
+    assert document == {"_id": 1, "count": 3, "fresh": 1, "peak": 9, "items": [1, 2, 3, 4], "nested": {"value": "x"}}
+
+def test_upsert_builds_from_the_query_and_set_on_insert():
+    collection = _collection()
+
+    async def run():
+        first = await collection.find_one_and_update(
+            {"document_id": "d", "status": {"$ne": "done"}},
+            {"$inc": {"count": 2}, "$setOnInsert": {"_id": "d"}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        before = await collection.find_one_and_update(
+            {"document_id": "d"}, {"$inc": {"count": 1}, "$setOnInsert": {"created": True}},
+            upsert=True, return_document=ReturnDocument.BEFORE
+        )
+        return first, before, await collection.find_one({"_id": "d"})
+    first, before, stored = asyncio.run(run())
+
+    assert first == {"_id": "d", "document_id": "d", "count": 2}
+    assert before["count"] == 2
+    assert stored == {"_id": "d", "document_id": "d", "count": 3}
+
+def test_find_sorts_pages_projects_and_copies():
+    collection = _collection(*({"_id": i, "group": i % 2, "n": i, "extra": [i]} for i in range(6)))
+
+    async def run():
+        cursor = collection.find({}, {"n": 1}).sort([("group", 1), ("n", -1)]).skip(1).limit(3)
+        page = await cursor.to_list(length=None)
+        found = await collection.find_one({"_id": 0})
+        found["extra"].append("changed")
+        return page, await collection.find_one({"_id": 0}, {"extra": 0})
+    page, unchanged = asyncio.run(run())
+
+    assert page == [{"_id": 2, "n": 2}, {"_id": 0, "n": 0}, {"_id": 5, "n": 5}]
+    assert unchanged == {"_id": 0, "group": 0, "n": 0}
+    assert asyncio.run(collection.find_one({"_id": 0}))["extra"] == [0]
+
+def test_indexed_lookups_match_a_scan():
+    documents = [{"_id": i, "user_id": f"u{i % 3}", "tags": [f"t{i % 4}"]} for i in range(30)]
+    scanned = _collection(*documents)
+    indexed = _collection(*documents)
+    asyncio.run(indexed.create_index([("user_id", 1), ("updated_at", -1)]))
+    asyncio.run(indexed.create_index("tags"))
+
+    async def update():
+        for collection in (scanned, indexed):
+            await collection.update_many({"user_id": "u1"}, {"$set": {"user_id": "u2"}})
+    asyncio.run(update())
+
+    for query in ({"user_id": "u2"}, {"user_id": {"$in": ["u0", "u2"]}}, {"tags": "t1"}, {"user_id": "u1"}):
+        assert _ids(indexed, query) == _ids(scanned, query), query
+
+def test_unique_index_and_drop_index():
+    collection = _collection({"_id": 1, "document_id": "a"})
+    name = asyncio.run(collection.create_index("document_id", unique=True))
+    assert name == "document_id_1"
+
+    for write in (collection.insert_one({"_id": 2, "document_id": "a"}),
+                  collection.insert_one({"_id": 1, "document_id": "b"})):
+        try:
+            asyncio.run(write)
+        except DuplicateKeyError as e:
+            assert e.code == 11000
+            continue
+        raise AssertionError("duplicate key accepted")
+
+    asyncio.run(collection.drop_index(name))
+    asyncio.run(collection.insert_one({"_id": 2, "document_id": "a"}))
+    try:
+        asyncio.run(collection.drop_index(name))
+    except OperationFailure as e:
+        assert e.code == 27
+    else:
+        raise AssertionError("dropping a missing index should fail")
+
+def test_bulk_write_reports_duplicates_by_index():
+    collection = _collection({"_id": 1})
+
+    async def run(ordered: bool):
+        try:
+            await collection.bulk_write([
+                InsertOne({"_id": 1}),
+                UpdateOne({"_id": 3 if ordered else 2}, {"$set": {"n": 1}}, upsert=True),
+                InsertOne({"_id": 1})
+            ], ordered=ordered)
+        except BulkWriteError as e:
+            return e.details
+        raise AssertionError("duplicate key accepted")
+
+    unordered = asyncio.run(run(ordered=False))
+    assert [error["index"] for error in unordered["writeErrors"]] == [0, 2]
+    assert unordered["nUpserted"] == 1 and _ids(collection, {"n": 1}) == [2]
+
+    ordered = asyncio.run(run(ordered=True))
+    assert [error["index"] for error in ordered["writeErrors"]] == [0]
+    assert _ids(collection, {"_id": 3}) == []
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
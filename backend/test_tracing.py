@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for request tracing (app/tracing.py)
+
+Run: python test_tracing.py    (or: python -m pytest test_tracing.py)
+"""
+
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.tracing import TracingMiddleware, _parse_traceparent, accumulate, span
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+def test_parse_valid_traceparent():
+    assert _parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01") == (TRACE_ID, PARENT_ID, True)
+    assert _parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-00") == (TRACE_ID, PARENT_ID, False)
+    # Only the sampled bit counts; other flags are ignored
+    assert _parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-03") == (TRACE_ID, PARENT_ID, True)
+    # Later versions may append fields
+    assert _parse_traceparent(f"01-{TRACE_ID}-{PARENT_ID}-01-extra") == (TRACE_ID, PARENT_ID, True)
+
+def test_parse_rejects_malformed_traceparent():
+    rejected = [
+        None,
+        "",
+        "garbage",
+        f"00-{TRACE_ID}-{PARENT_ID}",
+        # Bad flags
+        f"00-{TRACE_ID}-{PARENT_ID}-zz",
+        f"00-{TRACE_ID}-{PARENT_ID}-1",
+        f"00-{TRACE_ID}-{PARENT_ID}-001",
+        # Version ff is invalid, and version 00 has exactly four fields
+        f"ff-{TRACE_ID}-{PARENT_ID}-01",
+        f"00-{TRACE_ID}-{PARENT_ID}-01-extra",
+        # All-zero ids
+        f"00-{'0' * 32}-{PARENT_ID}-01",
+        f"00-{TRACE_ID}-{'0' * 16}-01",
+        # Wrong lengths and upper-case hex
+        f"00-{TRACE_ID[:-1]}-{PARENT_ID}-01",
+        f"00-{TRACE_ID}-{PARENT_ID}0-01",
+        f"00-{TRACE_ID.upper()}-{PARENT_ID}-01"
+    ]
+    for value in rejected:
+        assert _parse_traceparent(value) == (None, None, None), value
+
+def _traced_app() -> FastAPI:
+    traced = FastAPI()
+    traced.add_middleware(TracingMiddleware)
+
+    @traced.get("/work")
+    async def work():
+        with span("db.documents.find_one"):
+            await asyncio.sleep(0.01)
+        for _ in range(3):
+            with accumulate("encode"):
+                pass
+        return {"ok": True}
+
+    @traced.get("/stream")
+    async def stream():
+        with span("prepare"):
+            pass
+        return StreamingResponse(iter(["a", "b"]), media_type="text/plain")
+
+    return traced
+
+def _timings(header: str) -> dict:
+    timings = {}
+    for entry in header.split(", "):
+        name, duration = entry.split(";dur=")
+        timings[name] = float(duration)
+    return timings
+
+def test_middleware_sets_server_timing():
+    with TestClient(_traced_app()) as client:
+        response = client.get("/work")
+
+    assert response.status_code == 200
+    timings = _timings(response.headers["Server-Timing"])
+    # Span names are made into HTTP tokens; the root span is reported as total
+    assert set(timings) == {"db.documents.find_one", "encode", "total"}
+    assert timings["db.documents.find_one"] >= 10.0
+    assert timings["total"] >= timings["db.documents.find_one"]
+
+def test_middleware_continues_the_incoming_trace():
+    with TestClient(_traced_app()) as client:
+        response = client.get("/stream", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+        fresh = client.get("/stream", headers={"traceparent": f"ff-{TRACE_ID}-{PARENT_ID}-01"})
+
+    assert response.text == "ab"
+    assert "prepare;dur=" in response.headers["Server-Timing"]
+    version, trace_id, span_id, flags = response.headers["traceparent"].split("-")
+    assert (version, trace_id, flags) == ("00", TRACE_ID, "01") and span_id != PARENT_ID
+    # A malformed traceparent starts a new trace
+    assert fresh.headers["traceparent"].split("-")[1] != TRACE_ID
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -328,7 +328,8 @@ function ChatWindow({ documentId }) {
           message: `Create a short concise plan (2-4 bullet points, each bullet point on the new line) for the following edit request: ${trimmedInput}. DO EXACTLY what is asked by the user, nothing else. DO NOT INCLUDE THE REWRITTEN DOCUMENT. JUST THE BULLET POINTS. EACH BULLET ON A NEW LINE`,
           conversation_history: messages,
           document_id: documentId,
-          document_content: documentContent
+          document_content: documentContent,
+          save_to_history: false // internal prompt, not part of the chat
         }),
       });
 
@@ -428,6 +429,7 @@ function ChatWindow({ documentId }) {
         },
         body: JSON.stringify({
           message: `Summarize the changes you made to the document based on this json of changes: "${JSON.stringify(computedChanges)}". Be concise and explain your choice.`,
+          save_to_history: false // internal prompt, not part of the chat
         }),
       });
 
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef, useCallback } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import { useUser, useAuth, SignedIn, SignOutButton } from '@clerk/clerk-react';
 import DocumentGroup from './DocumentGroup';
@@ -14,6 +14,10 @@ function Dashboard() {
   const [isCreating, setIsCreating] = useState(false);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  // Cursor of the next page of documents; null once everything is loaded
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const loadMoreRef = useRef(null);
 
   // Apply dashboard background class to body
   useEffect(() => {
@@ -38,13 +42,14 @@ function Dashboard() {
         setLoading(true);
         setError(null);
         
-        // Fetch documents from backend
-        const apiDocuments = await documentAPI.getUserDocuments(userId);
+        // Fetch the first page of documents from backend
+        const page = await documentAPI.getUserDocuments(userId);
         
         // Format documents for frontend display
-        const formattedDocuments = apiDocuments.map(utils.formatDocument);
+        const formattedDocuments = page.documents.map(utils.formatDocument);
         
         setDocuments(formattedDocuments);
+        setNextCursor(page.nextCursor);
       } catch (err) {
         console.error('Error fetching documents:', err);
         setError('Failed to load documents. Please try again.');
@@ -58,6 +63,43 @@ function Dashboard() {
     fetchDocuments();
   }, [userId]);
 
+  // Fetch the next page, when the end of the list scrolls into view or on request
+  const loadMore = useCallback(async () => {
+    if (!nextCursor || loadingMore) {
+      return;
+    }
+    try {
+      setLoadingMore(true);
+      const page = await documentAPI.getUserDocuments(userId, nextCursor);
+      const formattedDocuments = page.documents.map(utils.formatDocument);
+      setDocuments(prev => {
+        // A document saved since the first page may come up again
+        const known = new Set(prev.map(doc => doc.id));
+        return [...prev, ...formattedDocuments.filter(doc => !known.has(doc.id))];
+      });
+      setNextCursor(page.nextCursor);
+    } catch (err) {
+      console.error('Error fetching more documents:', err);
+      setError('Failed to load more documents. Please try again.');
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [userId, nextCursor, loadingMore]);
+
+  useEffect(() => {
+    const sentinel = loadMoreRef.current;
+    if (!sentinel || !nextCursor) {
+      return undefined;
+    }
+    const observer = new IntersectionObserver(entries => {
+      if (entries.some(entry => entry.isIntersecting)) {
+        loadMore();
+      }
+    }, { rootMargin: '200px' });
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [nextCursor, loadMore]);
+
   const filteredDocuments = documents.filter(doc =>
     doc.title.toLowerCase().includes(searchTerm.toLowerCase())
   );
@@ -295,6 +337,14 @@ function Dashboard() {
                 />
               </div>
             )}
+
+            {nextCursor && (
+              <div className="load-more" ref={loadMoreRef}>
+                <button onClick={loadMore} disabled={loadingMore}>
+                  {loadingMore ? 'Loading...' : 'Load more documents'}
+                </button>
+              </div>
+            )}
           </section>
         </div>
       </main>
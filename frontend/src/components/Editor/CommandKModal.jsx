@@ -83,6 +83,7 @@ function CommandKWidget({ isOpen, onClose, documentId, selectedText = '', positi
           conversation_history: [],
           document_id: documentId,
           selected_text: selectedText || undefined, // Send selected text as separate field
+          save_to_history: false, // Command+K edits are not part of the document's chat
         }),
       });
 
@@ -47,11 +47,14 @@ export const documentAPI = {
     }
   },
 
-  // Get all documents for a user
-  getUserDocuments: async (userId) => {
+  // Get all documents for a user, most recently updated first
+  // One page of the listing, newest first; pass nextCursor back for the next page
+  getUserDocuments: async (userId, cursor = null, limit = 50) => {
     try {
-      const response = await api.get(`/documents/user/${userId}`);
-      return response.data.documents;
+      const response = await api.get(`/documents/user/${userId}`, {
+        params: { limit, ...(cursor && { cursor }) }
+      });
+      return { documents: response.data.documents, nextCursor: response.data.next_cursor };
     } catch (error) {
       throw new Error(`Failed to fetch documents: ${error.response?.data?.detail || error.message}`);
     }